@@ -8,5 +8,82 @@ GOOGLE_API_KEY: str = os.getenv("GOOGLE_API_KEY")
 # ИЗМЕНЕНИЕ ЗДЕСЬ: Используем точное имя из списка доступных моделей
 GEMINI_MODEL_NAME: str = os.getenv("GEMINI_MODEL_NAME", "models/gemini-1.5-flash-latest")
 
-if not GOOGLE_API_KEY:
-    print("CRITICAL: GOOGLE_API_KEY is not set.")
\ No newline at end of file
+# Локальная фейковая модель вместо Gemini (для нагрузочных тестов без расхода квоты)
+GEMINI_FAKE_MODE: bool = os.getenv("GEMINI_FAKE_MODE", "false").lower() in ("1", "true", "yes")
+GEMINI_FAKE_LATENCY_SECONDS: float = float(os.getenv("GEMINI_FAKE_LATENCY_SECONDS", "0.5"))
+GEMINI_FAKE_RATE_LIMIT_ERROR_RATE: float = float(os.getenv("GEMINI_FAKE_RATE_LIMIT_ERROR_RATE", "0.0"))
+GEMINI_FAKE_SERVER_ERROR_RATE: float = float(os.getenv("GEMINI_FAKE_SERVER_ERROR_RATE", "0.0"))
+# Ответ фейковой модели: JSON-массив ошибок или путь к JSON-файлу с ним (пусто = ошибок нет)
+GEMINI_FAKE_CANNED_ERRORS: str = os.getenv("GEMINI_FAKE_CANNED_ERRORS", "")
+GEMINI_FAKE_SEED: str = os.getenv("GEMINI_FAKE_SEED", "")
+
+# Режим JSON-ответа модели (response_mime_type + схема); разбор с очисткой markdown остается запасным вариантом
+GEMINI_JSON_RESPONSE_MODE: bool = os.getenv("GEMINI_JSON_RESPONSE_MODE", "true").lower() in ("1", "true", "yes")
+
+# Планировщик запросов к Gemini: ограничения параллелизма, квота и повторы
+GEMINI_MAX_CONCURRENCY: int = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_PER_REQUEST_CONCURRENCY: int = int(os.getenv("GEMINI_PER_REQUEST_CONCURRENCY", "4"))
+GEMINI_REQUESTS_PER_MINUTE: float = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60"))
+GEMINI_RATE_LIMIT_BURST: int = int(os.getenv("GEMINI_RATE_LIMIT_BURST", "10"))
+GEMINI_MAX_RETRIES: int = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BACKOFF_BASE_SECONDS: float = float(os.getenv("GEMINI_BACKOFF_BASE_SECONDS", "1.0"))
+GEMINI_BACKOFF_MAX_SECONDS: float = float(os.getenv("GEMINI_BACKOFF_MAX_SECONDS", "30.0"))
+
+# Упаковка нескольких коротких страниц в один запрос (0 = каждая страница отдельным запросом)
+GEMINI_BATCH_TOKEN_BUDGET: int = int(os.getenv("GEMINI_BATCH_TOKEN_BUDGET", "3000"))
+GEMINI_BATCH_MAX_PAGES: int = int(os.getenv("GEMINI_BATCH_MAX_PAGES", "10"))
+
+# Кэш результатов анализа: LRU в памяти + опциональный SQLite-файл (пустой путь = без дискового уровня)
+ANALYSIS_CACHE_MAX_ENTRIES: int = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "2048"))
+ANALYSIS_CACHE_TTL_SECONDS: float = float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "86400"))
+ANALYSIS_CACHE_DB_PATH: str = os.getenv("ANALYSIS_CACHE_DB_PATH", "")
+
+# Фоновые задания анализа: хранилище состояния ("memory" или "file") и число воркеров
+JOB_STORE_BACKEND: str = os.getenv("JOB_STORE_BACKEND", "memory").lower()
+JOB_STORE_DIR: str = os.getenv("JOB_STORE_DIR", "/tmp/pdf_checker_jobs")
+JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RESULT_TTL_SECONDS: float = float(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+
+# Пул процессов для CPU-нагруженных этапов (извлечение текста PyMuPDF, рендеринг ReportLab)
+PROCESS_POOL_WORKERS: int = int(os.getenv("PROCESS_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PROCESS_POOL_MAX_QUEUED: int = int(os.getenv("PROCESS_POOL_MAX_QUEUED", "16"))
+PROCESS_POOL_TASK_TIMEOUT_SECONDS: float = float(os.getenv("PROCESS_POOL_TASK_TIMEOUT_SECONDS", "120"))
+
+# Загрузки: лимиты размера и числа страниц, каталог для временных файлов, размер порции извлечения
+MAX_UPLOAD_BYTES: int = int(os.getenv("MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+MAX_PDF_PAGES: int = int(os.getenv("MAX_PDF_PAGES", "2000"))
+UPLOAD_SPOOL_DIR: str = os.getenv("UPLOAD_SPOOL_DIR", "")
+PDF_EXTRACT_CHUNK_PAGES: int = int(os.getenv("PDF_EXTRACT_CHUNK_PAGES", "8"))
+
+# Пакетный анализ: максимум документов и байт (после распаковки архивов) в пакете,
+# сколько документов извлекается одновременно
+MAX_BATCH_DOCUMENTS: int = int(os.getenv("MAX_BATCH_DOCUMENTS", "100"))
+MAX_BATCH_UPLOAD_BYTES: int = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))
+BATCH_MAX_ACTIVE_DOCUMENTS: int = int(os.getenv("BATCH_MAX_ACTIVE_DOCUMENTS", "4"))
+
+# Сессии документов: извлеченный текст и ошибки хранятся для скачивания исправленного PDF без повторной загрузки
+DOCUMENT_SESSION_TTL_SECONDS: float = float(os.getenv("DOCUMENT_SESSION_TTL_SECONDS", "3600"))
+DOCUMENT_SESSION_MAX_DOCUMENTS: int = int(os.getenv("DOCUMENT_SESSION_MAX_DOCUMENTS", "500"))
+DOCUMENT_SESSION_MAX_CHARS: int = int(os.getenv("DOCUMENT_SESSION_MAX_CHARS", str(200 * 1000 * 1000)))
+# Суммарный размер исходных PDF, которые сессии держат на диске для режима inplace (0 - без лимита)
+DOCUMENT_SESSION_MAX_FILE_BYTES: int = int(os.getenv("DOCUMENT_SESSION_MAX_FILE_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# Метрики: заголовок Server-Timing с длительностью этапов в каждом ответе (метрики Prometheus - всегда на /metrics)
+METRICS_SERVER_TIMING: bool = os.getenv("METRICS_SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+# Бэкенд анализа: "gemini", "local" (офлайн, без ключа), "hybrid" (локальная предпроверка + Gemini)
+# или "auto" (gemini при настроенной модели, иначе local). hybrid меняет результат анализа, поэтому включается только явно
+ANALYZER_BACKEND: str = os.getenv("ANALYZER_BACKEND", "auto").lower()
+if ANALYZER_BACKEND == "auto":
+    ANALYZER_BACKEND = "gemini" if (GOOGLE_API_KEY or GEMINI_FAKE_MODE) else "local"
+# Локальная проверка: словарь (по слову в строке, опционально "слово частота"), дистанция правки,
+# порог слов, ниже которого страница не отправляется в модель
+LOCAL_WORDLIST_PATH: str = os.getenv("LOCAL_WORDLIST_PATH", "")
+LOCAL_MAX_EDIT_DISTANCE: int = int(os.getenv("LOCAL_MAX_EDIT_DISTANCE", "1"))
+LOCAL_PREPASS_MIN_WORDS: int = int(os.getenv("LOCAL_PREPASS_MIN_WORDS", "5"))
+
+if not GOOGLE_API_KEY and not GEMINI_FAKE_MODE:
+    if ANALYZER_BACKEND == "local":
+        print("WARNING: GOOGLE_API_KEY is not set. Only the local proofreader is available.")
+    else:
+        print("CRITICAL: GOOGLE_API_KEY is not set.")
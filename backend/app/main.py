@@ -1,29 +1,54 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Body
-from fastapi.responses import StreamingResponse # Для отправки файла клиенту
+from fastapi import FastAPI, HTTPException, Body, Request
+from fastapi.responses import Response, StreamingResponse # Для отправки файла клиенту
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Any # Для типизации
-import io # Для работы с BytesIO как с файлом
+from typing import List, Dict, Any, AsyncIterator # Для типизации
 import json # Для разбора JSON строки с ошибками
 import os 
+import time
 
 # Импорты из нашего проекта
-from app.services.pdf_service import extract_text_and_pages_from_pdf
-from app.services.ai_service import analyze_text_with_gemini
-from app.services.corrected_pdf_service import create_pdf_with_corrected_text 
-# apply_corrections_to_text используется внутри create_pdf_with_corrected_text, его отдельно не вызываем в main
-from app.models.schemas import AnalysisResponse, ErrorDetail # Pydantic модели для валидации и ответа
-from app.core.config import GOOGLE_API_KEY # Конфигурация API ключа
+from app.services.upload_service import FORM_OVERHEAD_BYTES, SpooledUpload, stream_upload_form, remove_spooled_file, aiter_pdf_pages
+from app.services.scheduler import gemini_scheduler
+from app.services.analysis_cache import analysis_cache
+from app.services.jobs import job_manager
+from app.services.process_pool import cpu_pool
+from app.services.document_store import document_store, select_accepted_errors
+from app.services.revision_diff import RevisionDiff
+from app.services.corrected_pdf_service import create_pdf_with_corrected_text, create_pdf_with_inplace_corrections
+# Исправления к тексту применяет correction_engine.apply_corrections внутри create_pdf_with_corrected_text
+from app.services.ai_service import gemini_client, to_error_details
+from app.services.batch_analysis import BatchDocument, analyze_batch_documents, check_batch_file, collect_batch_documents, remove_batch_files
+from app.models.schemas import AnalysisResponse, BatchAnalysisResponse, ErrorDetail, JobStatus, JobSubmitResponse # Pydantic модели для валидации и ответа
+from app.services.analyzers import analyzer # Бэкенд анализа (Gemini, локальный или гибридный)
+from app.services.metrics import HTTP_REQUEST_SECONDS, format_server_timing, render_metrics, start_request_timings
+from app.core.config import METRICS_SERVER_TIMING, MAX_BATCH_DOCUMENTS, MAX_BATCH_UPLOAD_BYTES
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Запуск и остановка клиента модели, пула процессов и пула фоновых воркеров для заданий анализа
+    gemini_client.start()
+    cpu_pool.start()
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    cpu_pool.shutdown()
+    gemini_client.close()
+    document_store.clear()
 
 # Инициализация FastAPI приложения
 app = FastAPI(
     title="AI PDF Proofreader API",
     description="API for analyzing PDF files for errors using AI and downloading corrected versions.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Проверка наличия API ключа при старте (для информации в логах)
-if not GOOGLE_API_KEY:
+if not analyzer.available:
     print("WARNING from main.py: GOOGLE_API_KEY is not set. AI functionalities will be impaired or unavailable.")
+else:
+    print(f"Analyzer backend: {analyzer.name}")
 
 # Настройка CORS (Cross-Origin Resource Sharing)
 # Позволяет фронтенду (работающему на другом порту/домене) обращаться к этому API
@@ -41,8 +66,41 @@ app.add_middleware(
     allow_credentials=True,      # Разрешить куки и заголовки авторизации
     allow_methods=["*"],         # Разрешить все HTTP методы (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],         # Разрешить все заголовки
+    expose_headers=["Content-Disposition", "X-Correction-Mode", "Server-Timing"], # Заголовки ответа, доступные JS фронтенда
 )
 
+# Латентность каждого запроса по маршруту и (опционально) заголовок Server-Timing с длительностью этапов
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started_at = time.perf_counter()
+    timings = start_request_timings()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started_at
+    route = request.scope.get("route")
+    # Шаблон пути, а не сам путь: иначе каждый job_id станет отдельной серией
+    route_path = route.path if route is not None else "unmatched"
+    HTTP_REQUEST_SECONDS.labels(request.method, route_path, str(response.status_code)).observe(elapsed)
+    if METRICS_SERVER_TIMING:
+        response.headers["Server-Timing"] = format_server_timing(timings, elapsed)
+    return response
+
+def _multipart_form_openapi(properties: Dict[str, dict], required: List[str]) -> Dict[str, Any]:
+    """OpenAPI request body for endpoints that stream their multipart form (see stream_upload_form)."""
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {
+        "schema": {"type": "object", "properties": properties, "required": required},
+    }}}}
+
+def _require_pdf(upload: SpooledUpload) -> None:
+    # Проверяется по заголовкам части, до получения ее данных
+    if upload.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="Invalid file type. Only PDF files are allowed.")
+
+async def _collect_pages(pages: AsyncIterator[dict], collected: list) -> AsyncIterator[dict]:
+    """Passes pages through while keeping them in `collected`."""
+    async for page_info in pages:
+        collected.append(page_info)
+        yield page_info
+
 # Корневой эндпоинт для проверки, что API работает
 @app.get("/")
 async def read_root():
@@ -51,58 +109,91 @@ async def read_root():
     """
     return {"message": "Welcome to AI PDF Proofreader API. Use /docs for API documentation."}
 
+# Статистика кэша результатов анализа (сколько страниц обошлись без вызова модели)
+@app.get("/api/v1/cache/stats")
+async def get_cache_stats():
+    """
+    Returns hit/miss counters of the AI analysis cache.
+    """
+    return analysis_cache.stats()
+
+# Метрики Prometheus: латентность этапов, страницы, токены, ошибки модели, кэш, повторы, пул процессов
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# Загрузка пула процессов и задержки по этапам (извлечение, рендеринг)
+@app.get("/api/v1/pool/stats")
+async def get_process_pool_stats():
+    """
+    Returns process pool occupancy and per-stage latency (extract, render).
+    """
+    return cpu_pool.stats()
+
 # Эндпоинт для загрузки PDF, анализа и получения списка ошибок
-@app.post("/api/v1/analyze-pdf/", response_model=AnalysisResponse)
-async def upload_and_analyze_pdf(file: UploadFile = File(..., description="PDF file to be analyzed.")):
+@app.post("/api/v1/analyze-pdf/", response_model=AnalysisResponse, openapi_extra=_multipart_form_openapi({
+    "file": {"type": "string", "format": "binary", "description": "PDF file to be analyzed."},
+    "previous_document_id": {"type": "string", "description": "document_id of an earlier revision of this document. Only changed paragraphs are re-analyzed."},
+}, required=["file"]))
+async def upload_and_analyze_pdf(request: Request):
     """
     Uploads a PDF file, analyzes its text content page by page using an AI model,
     and returns a list of detected errors along with metadata.
+    The extracted text and errors are kept under `document_id` for a while, so the corrected
+    PDF can be downloaded without uploading the file again.
+    With `previous_document_id` the new revision is diffed against the earlier analysis paragraph
+    by paragraph: errors of unchanged paragraphs are carried forward and only changed or new
+    paragraphs are sent to the AI model.
+    The form is parsed while it is received (see stream_upload_form): the PDF is written to disk
+    once, and oversized uploads are rejected without reading them to the end.
     """
-    if not file.content_type == "application/pdf":
-        raise HTTPException(status_code=400, detail="Invalid file type. Only PDF files are allowed.")
-
-    if not GOOGLE_API_KEY:
+    if not analyzer.available:
          raise HTTPException(status_code=503, detail="AI Service is not available due to missing API key configuration on the server.")
 
+    form = None
+    pdf_path = None
     try:
-        # Читаем содержимое файла
-        contents = await file.read()
+        # PDF пишется во временный файл по мере получения, не держа его в памяти и не копируя повторно
+        form = await stream_upload_form(request, file_fields={"file"}, check_file=_require_pdf)
+        file = form.get_file("file")
+        if file is None:
+            raise HTTPException(status_code=422, detail="Field 'file' is required.")
+        previous_document_id = form.fields.get("previous_document_id")
+
+        # Предыдущая ревизия документа (404, если сессия уже истекла)
+        revision = RevisionDiff(document_store.get(previous_document_id)) if previous_document_id else None
+        pdf_path = file.detach()
         
-        # Извлекаем текст постранично
-        pages_data = extract_text_and_pages_from_pdf(contents)
-        if not pages_data: # Если PDF пустой или текст не извлечен
+        # Страницы извлекаются порциями в пуле процессов, а анализ первых страниц начинается,
+        # пока следующие еще извлекаются; планировщик соблюдает лимиты и квоту Gemini
+        # и возвращает результаты в порядке страниц
+        pages_data: list = [] # Извлеченные страницы сохраняются в сессии документа
+        pages_source = _collect_pages(aiter_pdf_pages(pdf_path), pages_data)
+        if revision is not None:
+            # В модель уходят только измененные абзацы каждой страницы
+            pages_source = revision.filter_pages(pages_source)
+        pages_errors_raw = await gemini_scheduler.analyze_pages(pages_source)
+        if not pages_errors_raw: # Если PDF пустой или текст не извлечен
             raise HTTPException(status_code=422, detail="Could not extract any text from the PDF or the PDF is empty.")
 
         all_errors_details: list[ErrorDetail] = [] # Список для хранения всех найденных ошибок
-        
-        # Анализируем текст каждой страницы
-        for page_info in pages_data:
-            page_text = page_info.get("text", "")
-            page_num = page_info.get("page_number", 0) # Нумерация страниц начинается с 1 в pages_data
-            
-            if page_text.strip(): # Анализируем, только если на странице есть текст
-                errors_on_page_raw = await analyze_text_with_gemini(page_text, original_page_number=page_num)
-                
-                # Преобразуем "сырые" ошибки от AI в нашу Pydantic модель ErrorDetail
-                for err_data in errors_on_page_raw:
-                    # Убедимся, что page_number корректный
-                    current_error_page_num = err_data.get("page_number", page_num)
-                    if isinstance(current_error_page_num, str) and current_error_page_num.lower() == "unknown":
-                        current_error_page_num = page_num # Если AI не указал, берем номер текущей обрабатываемой страницы
-
-                    processed_error = ErrorDetail(
-                        page_number=current_error_page_num,
-                        original_snippet=err_data.get("original_snippet", "N/A"),
-                        corrected_snippet=err_data.get("corrected_snippet", "N/A"),
-                        error_type=err_data.get("error_type", "Unknown"),
-                        explanation=err_data.get("explanation", "No explanation provided.")
-                    )
-                    all_errors_details.append(processed_error)
+        for page_num, errors_on_page_raw in pages_errors_raw: # Нумерация страниц начинается с 1
+            if revision is not None:
+                errors_on_page_raw = revision.carried_errors(page_num) + errors_on_page_raw
+            all_errors_details.extend(to_error_details(errors_on_page_raw, page_num))
+
+        # Сессия забирает временный файл себе: он нужен для исправления PDF "на месте" (output_mode=inplace)
+        document_id = document_store.save(file.filename, pages_data, [error.model_dump() for error in all_errors_details],
+                                          source_path=pdf_path)
+        pdf_path = None
         
         return AnalysisResponse(
             filename=file.filename, 
             errors=all_errors_details, 
-            total_pages=len(pages_data)
+            total_pages=len(pages_errors_raw),
+            document_id=document_id,
+            revision_stats=revision.stats() if revision is not None else None
         )
 
     except HTTPException as e:
@@ -112,55 +203,217 @@ async def upload_and_analyze_pdf(file: UploadFile = File(..., description="PDF f
         # Логируем неожиданные ошибки на сервере
         print(f"Unexpected server error during PDF analysis: {e}") # В продакшене лучше использовать полноценное логирование
         raise HTTPException(status_code=500, detail=f"An unexpected server error occurred during analysis: {str(e)}")
+    finally:
+        if pdf_path:
+            remove_spooled_file(pdf_path)
+        if form is not None:
+            form.remove_files()
+
+
+@app.post("/api/v1/analyze-batch/", response_model=BatchAnalysisResponse, openapi_extra=_multipart_form_openapi({
+    "files": {"type": "array", "items": {"type": "string", "format": "binary"},
+              "description": "PDF files and/or zip archives of PDF files to be analyzed together."},
+}, required=["files"]))
+async def upload_and_analyze_batch(request: Request):
+    """
+    Analyzes many PDF files in one request. Files can be uploaded directly or inside zip archives
+    (archives are streamed to disk and unpacked there, never into memory); all PDFs of a batch
+    together may take at most MAX_BATCH_UPLOAD_BYTES.
+    Documents are extracted in parallel and their pages are interleaved, so one large file does not
+    hold back the others. Identical pages and paragraphs are sent to the AI model only once per
+    batch, and their errors are reported in every document that contains them.
+    Each readable document gets its own AnalysisResponse (with a `document_id` for downloads);
+    documents that cannot be read are listed in `failed` without failing the whole batch.
+    """
+    if not analyzer.available:
+         raise HTTPException(status_code=503, detail="AI Service is not available due to missing API key configuration on the server.")
+
+    form = None
+    documents: List[BatchDocument] = []
+    try:
+        form = await stream_upload_form(request, file_fields={"files"}, max_files=MAX_BATCH_DOCUMENTS,
+                                        max_request_bytes=MAX_BATCH_UPLOAD_BYTES + FORM_OVERHEAD_BYTES,
+                                        check_file=check_batch_file)
+        uploads = form.get_files("files")
+        if not uploads:
+            raise HTTPException(status_code=422, detail="Field 'files' is required.")
+        await collect_batch_documents(uploads, documents)
+        return await analyze_batch_documents(documents)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Unexpected server error during batch analysis: {e}")
+        raise HTTPException(status_code=500, detail=f"An unexpected server error occurred during batch analysis: {str(e)}")
+    finally:
+        # Файлы, не переданные сессиям документов (ошибки, нечитаемые документы)
+        remove_batch_files(documents)
+        if form is not None:
+            form.remove_files()
+
+
+# Асинхронный режим для больших PDF: задание ставится в очередь, ответ приходит сразу
+@app.post("/api/v1/jobs/", response_model=JobSubmitResponse, status_code=202, openapi_extra=_multipart_form_openapi({
+    "file": {"type": "string", "format": "binary", "description": "PDF file to be analyzed in the background."},
+}, required=["file"]))
+async def submit_analysis_job(request: Request):
+    """
+    Submits a PDF for background analysis and returns a job id immediately.
+    Poll the status URL for progress and read errors incrementally from the results URL.
+    """
+    if not analyzer.available:
+         raise HTTPException(status_code=503, detail="AI Service is not available due to missing API key configuration on the server.")
+
+    form = await stream_upload_form(request, file_fields={"file"}, check_file=_require_pdf)
+    try:
+        file = form.get_file("file")
+        if file is None:
+            raise HTTPException(status_code=422, detail="Field 'file' is required.")
+        # Задание забирает временный файл себе
+        job_id = await job_manager.submit(file.filename, file.detach())
+    finally:
+        form.remove_files()
+    return JobSubmitResponse(
+        job_id=job_id,
+        status="queued",
+        status_url=f"/api/v1/jobs/{job_id}",
+        results_url=f"/api/v1/jobs/{job_id}/results"
+    )
+
+
+@app.get("/api/v1/jobs/{job_id}", response_model=JobStatus)
+async def get_analysis_job_status(job_id: str):
+    """
+    Returns the state of an analysis job: pages done versus total pages.
+    """
+    return JobStatus(**job_manager.get_status(job_id))
+
+
+@app.get("/api/v1/jobs/{job_id}/results")
+async def stream_analysis_job_results(job_id: str, format: str = "ndjson"):
+    """
+    Streams ErrorDetail records of a job as each page finishes.
+    format=ndjson: one ErrorDetail JSON object per line.
+    format=sse: Server-Sent Events; `error` events carry ErrorDetail objects,
+    a final `done` event carries the job status.
+    """
+    job_manager.get_status(job_id) # 404, если задания нет
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="Invalid format. Use 'ndjson' or 'sse'.")
+
+    async def ndjson_stream():
+        async for record in job_manager.iter_page_results(job_id):
+            for error in record["errors"]:
+                yield json.dumps(error, ensure_ascii=False) + "\n"
+
+    async def sse_stream():
+        async for record in job_manager.iter_page_results(job_id):
+            for error in record["errors"]:
+                yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+        status = JobStatus(**job_manager.get_status(job_id))
+        yield f"event: done\ndata: {status.model_dump_json()}\n\n"
+
+    if format == "sse":
+        return StreamingResponse(sse_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
 
 
 # Новый эндпоинт для скачивания PDF с примененными исправлениями
-@app.post("/api/v1/download-corrected-pdf/")
-async def download_corrected_pdf_endpoint(
-    file: UploadFile = File(..., description="The original PDF file (re-uploaded)."),
-    errors_json_str: str = Form(..., description="A JSON string representing the list of errors found by the AI.")
-):
-    """
-    Accepts the original PDF file (re-uploaded) and a JSON string of errors.
-    It then extracts text from the PDF, applies the corrections (based on the provided errors),
-    generates a new PDF document with the corrected text, and returns it for download.
-    The original PDF formatting (layouts, images, fonts) is NOT preserved; 
+@app.post("/api/v1/download-corrected-pdf/", openapi_extra=_multipart_form_openapi({
+    "document_id": {"type": "string", "description": "Id of a document analyzed by /analyze-pdf/ (no re-upload needed)."},
+    "accepted_error_indices": {"type": "string", "description": "Optional JSON array of indices into the document's errors to apply. All errors are applied if omitted."},
+    "file": {"type": "string", "format": "binary", "description": "The original PDF file (re-uploaded). Only needed without document_id."},
+    "errors_json_str": {"type": "string", "description": "A JSON string representing the list of errors found by the AI. Only needed without document_id."},
+    "output_mode": {"type": "string", "default": "rebuild", "description": "'rebuild': new PDF with the corrected text only. 'inplace': edit the original PDF, keeping layout and images."},
+}, required=[]))
+async def download_corrected_pdf_endpoint(request: Request):
+    """
+    Generates a new PDF document with the corrected text and returns it for download.
+    Preferred: pass the `document_id` returned by /analyze-pdf/ and, optionally, the indices of
+    accepted corrections; the stored text and errors are used, nothing is re-uploaded or re-parsed.
+    Legacy: re-upload the original PDF together with a JSON string of errors.
+    output_mode=rebuild (default): the original PDF formatting (layouts, images, fonts) is NOT preserved; 
     the new PDF contains only the corrected text in a simple layout.
+    output_mode=inplace: only the corrected fragments of the original PDF are replaced, layout and images
+    are kept. If any fragment cannot be located, the rebuild mode is used instead.
+    The mode actually used is returned in the X-Correction-Mode header.
     """
-    if not file.content_type == "application/pdf":
-        raise HTTPException(status_code=400, detail="Invalid file type for correction. Only PDF is allowed.")
+    form = await stream_upload_form(request, file_fields={"file"}, check_file=_require_pdf)
+    document_id = form.fields.get("document_id")
+    accepted_error_indices = form.fields.get("accepted_error_indices")
+    errors_json_str = form.fields.get("errors_json_str")
+    output_mode = form.fields.get("output_mode") or "rebuild"
+    file = form.get_file("file")
 
+    pdf_path = None
     try:
-        # Преобразуем строку JSON с ошибками в Python список словарей
-        # Эти ошибки должны быть в формате, совместимом с ожидаемым `create_pdf_with_corrected_text`
-        # (т.е., список словарей, каждый из которых имеет ключи 'page_number', 'original_snippet', 'corrected_snippet')
-        errors_list_of_dicts: List[Dict[str, Any]] = json.loads(errors_json_str)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="Invalid JSON format for 'errors_json_str'. Expected a list of error objects.")
+        if output_mode not in ("rebuild", "inplace"):
+            raise HTTPException(status_code=400, detail="Invalid output_mode. Use 'rebuild' or 'inplace'.")
 
+        if document_id:
+            session = document_store.get(document_id)
+            accepted_indices = None
+            if accepted_error_indices:
+                try:
+                    accepted_indices = json.loads(accepted_error_indices)
+                except json.JSONDecodeError:
+                    accepted_indices = None
+                if not isinstance(accepted_indices, list):
+                    raise HTTPException(status_code=400, detail="Invalid format for 'accepted_error_indices'. Expected a JSON array of integers.")
+            errors_list_of_dicts = select_accepted_errors(session["errors"], accepted_indices)
+            pages_data = session["pages"]
+            source_path = session["source_path"]
+            original_filename = session["filename"]
+        else:
+            if file is None or errors_json_str is None:
+                raise HTTPException(status_code=400, detail="Provide either 'document_id' or both 'file' and 'errors_json_str'.")
+            try:
+                # Преобразуем строку JSON с ошибками в Python список словарей
+                # Эти ошибки должны быть в формате, совместимом с ожидаемым `create_pdf_with_corrected_text`
+                # (т.е., список словарей, каждый из которых имеет ключи 'page_number', 'original_snippet', 'corrected_snippet')
+                errors_list_of_dicts: List[Dict[str, Any]] = json.loads(errors_json_str)
+            except json.JSONDecodeError:
+                raise HTTPException(status_code=400, detail="Invalid JSON format for 'errors_json_str'. Expected a list of error objects.")
 
-    try:
-        # Читаем содержимое оригинального PDF файла (который пользователь снова загрузил)
-        pdf_contents = await file.read()
-        
-        # 1. Извлекаем текст из оригинального PDF
-        pages_data = extract_text_and_pages_from_pdf(pdf_contents)
-        if not pages_data:
-            raise HTTPException(status_code=422, detail="Could not extract text from the provided PDF for correction.")
-
-        # 2. Создаем новый PDF файл с примененными исправлениями
-        # `errors_list_of_dicts` используется для применения исправлений
-        pdf_buffer: io.BytesIO = create_pdf_with_corrected_text(pages_data, errors_list_of_dicts)
+            # Оригинальный PDF (который пользователь снова загрузил) уже записан во временный файл при разборе формы
+            pdf_path = file.detach()
+            pages_data = None # Текст извлекается, только если понадобится режим rebuild
+            source_path = pdf_path
+            original_filename = file.filename
+
+        pdf_buffer = None
+        correction_mode = "rebuild"
+        if output_mode == "inplace" and source_path:
+            # Правим исходный PDF: меняются только найденные фрагменты, остальные страницы копируются как есть
+            pdf_buffer, unresolved = await cpu_pool.run("render_inplace", create_pdf_with_inplace_corrections, source_path, errors_list_of_dicts)
+            correction_mode = "inplace"
+            if unresolved:
+                print(f"In-place correction: {len(unresolved)} fragment(s) could not be located, falling back to rebuild.")
+                pdf_buffer = None
+                correction_mode = "rebuild-fallback"
+
+        if pdf_buffer is None:
+            if pages_data is None:
+                # 1. Извлекаем текст из оригинального PDF
+                pages_data = [page async for page in aiter_pdf_pages(pdf_path)]
+                if not pages_data:
+                    raise HTTPException(status_code=422, detail="Could not extract text from the provided PDF for correction.")
+
+            # 2. Создаем новый PDF файл с примененными исправлениями
+            # `errors_list_of_dicts` используется для применения исправлений
+            pdf_buffer = await cpu_pool.run("render", create_pdf_with_corrected_text, pages_data, errors_list_of_dicts)
         
         # Формируем имя для скачиваемого файла
-        base_filename, _ = os.path.splitext(file.filename) if file.filename else ("document", ".pdf")
+        base_filename, _ = os.path.splitext(original_filename) if original_filename else ("document", ".pdf")
         corrected_filename = f"corrected_{base_filename}.pdf"
         
         # Отправляем сгенерированный PDF как поток байт
         return StreamingResponse(
             iter([pdf_buffer.getvalue()]), # getvalue() возвращает все байты из буфера
             media_type="application/pdf",
-            headers={"Content-Disposition": f"attachment; filename=\"{corrected_filename}\""} # Кавычки вокруг имени файла важны для имен с пробелами
+            headers={
+                "Content-Disposition": f"attachment; filename=\"{corrected_filename}\"", # Кавычки вокруг имени файла важны для имен с пробелами
+                "X-Correction-Mode": correction_mode
+            }
         )
     except HTTPException as e:
         raise e # Перебрасываем известные HTTP исключения
@@ -168,6 +421,10 @@ async def download_corrected_pdf_endpoint(
         # Логируем неожиданные ошибки
         print(f"Error generating corrected PDF: {e}") # В продакшене - полноценное логирование
         raise HTTPException(status_code=500, detail=f"Could not generate corrected PDF: {str(e)}")
+    finally:
+        if pdf_path:
+            remove_spooled_file(pdf_path)
+        form.remove_files()
 
 # Если этот файл запускается напрямую (например, uvicorn main:app)
 # Эта часть не нужна, если используется docker-compose с командой uvicorn.
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Union
+from typing import Dict, List, Optional, Union
 
 class ErrorDetail(BaseModel):
     page_number: Union[int, str] # Can be int or "unknown"
@@ -11,4 +11,31 @@ class ErrorDetail(BaseModel):
 class AnalysisResponse(BaseModel):
     filename: str
     errors: List[ErrorDetail]
-    total_pages: int
\ No newline at end of file
+    total_pages: int
+    document_id: Optional[str] = None # Для скачивания исправленного PDF без повторной загрузки
+    revision_stats: Optional[Dict[str, int]] = None # Только при анализе новой ревизии (previous_document_id)
+
+class BatchDocumentFailure(BaseModel):
+    filename: str
+    detail: str
+
+class BatchAnalysisResponse(BaseModel):
+    documents: List[AnalysisResponse] # В порядке загрузки (файлы архива - в порядке архива)
+    failed: List[BatchDocumentFailure] # Документы, которые не удалось прочитать
+    dedup_stats: Dict[str, int] # Сколько страниц и абзацев повторялись внутри пакета
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+    results_url: str
+
+class JobStatus(BaseModel):
+    job_id: str
+    filename: str
+    status: str # "queued" | "running" | "completed" | "failed"
+    pages_done: int
+    total_pages: int
+    errors_found: int
+    detail: Optional[str] = None # Описание ошибки для status == "failed"
+    document_id: Optional[str] = None # Появляется, когда задание завершено
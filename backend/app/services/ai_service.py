@@ -1,86 +1,199 @@
 import google.generativeai as genai
 from fastapi import HTTPException
 import json
-from app.core.config import GOOGLE_API_KEY, GEMINI_MODEL_NAME
+from typing import Dict, List
+from app.core.config import (
+    GOOGLE_API_KEY, GEMINI_MODEL_NAME, GEMINI_JSON_RESPONSE_MODE,
+    GEMINI_FAKE_MODE, GEMINI_FAKE_LATENCY_SECONDS, GEMINI_FAKE_RATE_LIMIT_ERROR_RATE,
+    GEMINI_FAKE_SERVER_ERROR_RATE, GEMINI_FAKE_CANNED_ERRORS, GEMINI_FAKE_SEED,
+)
+from app.services.fake_gemini import FakeGenerativeModel, load_canned_errors
+from app.services.metrics import TOKENS_SENT, count_model_errors, stage_timer
+from app.services.page_batching import estimate_tokens
+from app.services.prompts import BATCH_PROMPT, PAGE_PROMPT, PromptTemplate, prompt_registry
+from app.models.schemas import ErrorDetail
 
 if GOOGLE_API_KEY:
     genai.configure(api_key=GOOGLE_API_KEY)
+elif GEMINI_FAKE_MODE:
+    print("AI Service: running against the local fake Gemini model.")
 else:
     print("AI Service: Google API Key not configured.")
 
+# Версия промпта: входит в ключ кэша и меняется вместе с версиями шаблонов в реестре (prompts.py)
+PROMPT_VERSION = prompt_registry.version
+
+# HTTP-коды, при которых имеет смысл повторить запрос (квота и временные сбои сервера)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def is_retryable_ai_error(exc: Exception) -> bool:
+    """True for rate-limit (429) and transient 5xx errors raised by the Gemini client."""
+    code = getattr(exc, "code", None)
+    try:
+        return int(code) in RETRYABLE_STATUS_CODES
+    except (TypeError, ValueError):
+        return False
+
+
+def _create_model(prompt: PromptTemplate, json_mode: bool = GEMINI_JSON_RESPONSE_MODE):
+    generation_config = None
+    if json_mode:
+        generation_config = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=prompt.response_schema,
+        )
+    if GEMINI_FAKE_MODE:
+        return FakeGenerativeModel(
+            GEMINI_MODEL_NAME,
+            latency_seconds=GEMINI_FAKE_LATENCY_SECONDS,
+            rate_limit_error_rate=GEMINI_FAKE_RATE_LIMIT_ERROR_RATE,
+            server_error_rate=GEMINI_FAKE_SERVER_ERROR_RATE,
+            canned_errors=load_canned_errors(GEMINI_FAKE_CANNED_ERRORS),
+            seed=int(GEMINI_FAKE_SEED) if GEMINI_FAKE_SEED else None,
+            system_instruction=prompt.system_instruction,
+            generation_config=generation_config,
+        )
+    return genai.GenerativeModel(
+        GEMINI_MODEL_NAME,
+        system_instruction=prompt.system_instruction,
+        generation_config=generation_config,
+    )
+
+
+class GeminiClient:
+    """
+    Long-lived model clients, one per registered prompt (system instruction and response
+    schema are fixed per model), created at startup by the FastAPI lifespan and shared by
+    all requests. The underlying transport of google-generativeai is a process-wide client,
+    so one model object per prompt is enough for any number of concurrent calls.
+    """
+
+    def __init__(self, json_mode: bool = GEMINI_JSON_RESPONSE_MODE):
+        self.json_mode = json_mode
+        self._models: Dict[str, object] = {}
+
+    def start(self) -> None:
+        if not GOOGLE_API_KEY and not GEMINI_FAKE_MODE:
+            return  # Без ключа модели не создаем; запросы вернут 503
+        for prompt in prompt_registry.all():
+            self.model_for(prompt)
+
+    def close(self) -> None:
+        self._models.clear()
+
+    def model_for(self, prompt: PromptTemplate):
+        """Returns the shared model for `prompt`, creating it on first use (e.g. outside the lifespan)."""
+        model = self._models.get(prompt.name)
+        if model is None:
+            model = _create_model(prompt, self.json_mode)
+            self._models[prompt.name] = model
+        return model
+
+
+gemini_client = GeminiClient()
+
+
+def to_error_details(errors_on_page_raw: list, page_num: int) -> List[ErrorDetail]:
+    """Converts raw AI errors of one page into ErrorDetail models."""
+    details = []
+    for err_data in errors_on_page_raw:
+        # Убедимся, что page_number корректный
+        current_error_page_num = err_data.get("page_number", page_num)
+        if isinstance(current_error_page_num, str) and current_error_page_num.lower() == "unknown":
+            current_error_page_num = page_num # Если AI не указал, берем номер текущей обрабатываемой страницы
+
+        details.append(ErrorDetail(
+            page_number=current_error_page_num,
+            original_snippet=err_data.get("original_snippet", "N/A"),
+            corrected_snippet=err_data.get("corrected_snippet", "N/A"),
+            error_type=err_data.get("error_type", "Unknown"),
+            explanation=err_data.get("explanation", "No explanation provided.")
+        ))
+    return details
+
 
 async def analyze_text_with_gemini(text_to_analyze: str, original_page_number: int = -1) -> list:
     """Sends text to Gemini API for error analysis."""
-    if not GOOGLE_API_KEY:
+    if not GOOGLE_API_KEY and not GEMINI_FAKE_MODE:
         raise HTTPException(status_code=503, detail="AI Service is not configured (API Key missing).")
 
-    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-
-    prompt = f"""
-        Analyze the following text for grammatical, spelling, punctuation, and stylistic errors.
-        The text to analyze (this is text from page {original_page_number if original_page_number != -1 else "unknown"}):
-        ---
-        {text_to_analyze}
-        ---
-        For each error found, provide the following information in a JSON array of objects. Each object must contain the following keys:
-        - "page_number": {original_page_number if original_page_number != -1 else "unknown"},
-        - "original_snippet": The exact short text fragment with the error (up to 15 words).
-        - "corrected_snippet": The corrected version of the fragment.
-        - "error_type": The type of error (e.g., "spelling", "grammar", "style", "punctuation").
-        - "explanation": A brief explanation of the error.
-
-        Example of one object in the JSON array:
-        {{
-        "page_number": {original_page_number if original_page_number != -1 else 1},
-        "original_snippet": "He go to the store.",
-        "corrected_snippet": "He goes to the store.",
-        "error_type": "grammar",
-        "explanation": "Incorrect verb tense. 'Go' should be 'goes' for third-person singular present."
-        }}
-
-        If no errors are found, return an empty JSON array [].
-        Please return ONLY the JSON array. Do not add any other text, comments, or explanations outside the JSON structure.
-        """
-    
+    prompt = PAGE_PROMPT.render(
+        page_number=original_page_number if original_page_number != -1 else "unknown",
+        text=text_to_analyze,
+    )
+    errors = await _generate_and_parse(gemini_client.model_for(PAGE_PROMPT), prompt, original_page_number,
+                                       system_instruction=PAGE_PROMPT.system_instruction)
+    count_model_errors([err for err in errors if is_service_error(err)])
+    return errors
+
+
+def parse_errors_json(response_text: str) -> list:
+    """
+    Parses the model output. In JSON response mode the text is the bare array; otherwise
+    (or if the model still wrapped it) a ```json fence is stripped first.
+    Raises json.JSONDecodeError if the text is not JSON.
+    """
+    try:
+        errors = json.loads(response_text)
+    except json.JSONDecodeError:
+        cleaned_response_text = response_text.strip()
+        if cleaned_response_text.startswith("```json"):
+            cleaned_response_text = cleaned_response_text[7:]
+        if cleaned_response_text.endswith("```"):
+            cleaned_response_text = cleaned_response_text[:-3]
+        errors = json.loads(cleaned_response_text.strip())
+    if not isinstance(errors, list):
+        if isinstance(errors, dict) and "original_snippet" in errors:
+            return [errors]
+        return []
+    return errors
+
+
+async def _generate_and_parse(model, prompt: str, original_page_number, page_label: str = None,
+                              system_instruction: str = "") -> list:
+    """
+    Calls the model and parses its JSON array of errors.
+    Service failures are returned as AI_* pseudo-errors for `original_page_number`.
+    `system_instruction` is only used to estimate the tokens sent.
+    """
+    if page_label is None:
+        page_label = str(original_page_number)
+
     response_obj = None # Инициализируем переменную response_obj (чтобы не конфликтовать с именем функции response)
     cleaned_response_text = "" # Инициализируем на случай ошибки до ее определения
 
     try:
-        response_obj = await model.generate_content_async(prompt) # Используем response_obj
+        # Системная инструкция тарифицируется при каждом запросе, поэтому учитывается в расходе токенов
+        TOKENS_SENT.inc(estimate_tokens(prompt) + (estimate_tokens(system_instruction) if system_instruction else 0))
+        with stage_timer("model_call"):
+            response_obj = await model.generate_content_async(prompt) # Используем response_obj
         
         # Проверяем, есть ли вообще текст в ответе, прежде чем пытаться его обработать
         if not hasattr(response_obj, 'text') or not response_obj.text:
             # Проверяем prompt_feedback на случай, если запрос был заблокирован
             if hasattr(response_obj, 'prompt_feedback') and response_obj.prompt_feedback:
                  block_reason = str(response_obj.prompt_feedback)
-                 print(f"Gemini API request blocked (Page {original_page_number}). Feedback: {block_reason}")
+                 print(f"Gemini API request blocked (Page {page_label}). Feedback: {block_reason}")
                  return [{"error_type": "AI_Blocked_Request", "explanation": f"Gemini API request blocked: {block_reason}", "page_number": original_page_number, "original_snippet": "N/A", "corrected_snippet": "N/A"}]
             # Если нет текста и нет информации о блокировке, это странная ситуация
-            print(f"AI returned no text and no prompt feedback (Page {original_page_number}).")
+            print(f"AI returned no text and no prompt feedback (Page {page_label}).")
             return [{"error_type": "AI_Empty_Response", "explanation": "AI returned an empty response without error details.", "page_number": original_page_number, "original_snippet": "N/A", "corrected_snippet": "N/A"}]
 
-        raw_response_text = response_obj.text # Теперь используем response_obj.text
-        cleaned_response_text = raw_response_text.strip()
-        if cleaned_response_text.startswith("```json"):
-            cleaned_response_text = cleaned_response_text[7:]
-        if cleaned_response_text.endswith("```"):
-            cleaned_response_text = cleaned_response_text[:-3]
-        cleaned_response_text = cleaned_response_text.strip()
-        
-        errors = json.loads(cleaned_response_text)
-        if not isinstance(errors, list):
-             if isinstance(errors, dict) and "original_snippet" in errors:
-                 return [errors]
-             return []
-        return errors
+        cleaned_response_text = response_obj.text # Теперь используем response_obj.text
+        with stage_timer("parse_response"):
+            return parse_errors_json(cleaned_response_text)
         
     except json.JSONDecodeError as e:
-        print(f"AI JSON Decode Error (Page {original_page_number}): {e}. Response: {cleaned_response_text}")
+        print(f"AI JSON Decode Error (Page {page_label}): {e}. Response: {cleaned_response_text}")
         # В cleaned_response_text может быть полезная информация от AI, почему он не вернул JSON
         return [{"error_type": "AI_Parse_Error", "explanation": f"Could not parse AI response: {e}. Raw AI output: '{cleaned_response_text[:200]}...' (truncated)", "page_number": original_page_number, "original_snippet": "N/A", "corrected_snippet": "N/A"}]
     
     except Exception as e: # Общий обработчик исключений
-        error_message = f"Error calling Gemini API (Page {original_page_number}): {str(e)}"
+        if is_retryable_ai_error(e):
+            # 429/5xx пробрасываем как есть: повторами занимается планировщик (scheduler.py)
+            raise
+        error_message = f"Error calling Gemini API (Page {page_label}): {str(e)}"
         print(error_message)
         
         # Теперь безопасно проверяем response_obj, так как он был инициализирован
@@ -96,4 +209,75 @@ async def analyze_text_with_gemini(text_to_analyze: str, original_page_number: i
         # Например:
         # return [{"error_type": "AI_Generic_Error", "explanation": error_message, "page_number": original_page_number, "original_snippet": "N/A", "corrected_snippet": "N/A"}]
         # Но для неожиданных ошибок сервера 500 - это нормально.
-        raise HTTPException(status_code=500, detail=f"Error communicating with AI API (Page {original_page_number}): {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error communicating with AI API (Page {page_label}): {str(e)}")
+
+def build_batch_prompt(batch: list) -> str:
+    """Builds one prompt for several pages; each page's text is wrapped in numbered markers."""
+    pages_block = "\n".join(
+        PAGE_PROMPT.render(page_number=page.get("page_number"), text=page.get("text", "")) for page in batch
+    )
+    page_numbers = ", ".join(str(page.get("page_number")) for page in batch)
+    return BATCH_PROMPT.render(page_numbers=page_numbers, pages_block=pages_block)
+
+
+def is_service_error(error: dict) -> bool:
+    """Service failures (AI_* error types) are pseudo-errors about the request, not errors in the text."""
+    return str(error.get("error_type", "")).startswith("AI_")
+
+
+def demultiplex_batch_errors(errors: list, batch: list) -> dict:
+    """
+    Distributes errors of a grouped response back to pages: {page_number: [error, ...]}.
+    Uses the reported page_number when it belongs to the batch, otherwise the first page
+    containing the snippet, otherwise the first page of the batch.
+    Service failures (AI_* error types) concern the whole request and are attached to every page.
+    """
+    page_numbers = [page.get("page_number") for page in batch]
+    errors_by_page = {page_number: [] for page_number in page_numbers}
+
+    for err in errors:
+        if not isinstance(err, dict):
+            continue
+        if is_service_error(err):
+            for page_number in page_numbers:
+                errors_by_page[page_number].append({**err, "page_number": page_number})
+            continue
+
+        reported = err.get("page_number")
+        try:
+            reported = int(reported)
+        except (TypeError, ValueError):
+            reported = None
+
+        if reported in errors_by_page:
+            target = reported
+        else:
+            snippet = err.get("original_snippet") or ""
+            target = next(
+                (page.get("page_number") for page in batch if snippet and snippet in page.get("text", "")),
+                page_numbers[0],
+            )
+        errors_by_page[target].append({**err, "page_number": target})
+
+    return errors_by_page
+
+
+async def analyze_batch_with_gemini(batch: list) -> dict:
+    """
+    Analyzes a batch of pages ([{'page_number': int, 'text': str}, ...]) with one model request
+    and returns {page_number: [error, ...]}. A single-page batch uses the regular per-page prompt.
+    """
+    if len(batch) == 1:
+        page = batch[0]
+        errors = await analyze_text_with_gemini(page.get("text", ""), original_page_number=page.get("page_number", -1))
+        return demultiplex_batch_errors(errors, batch)
+
+    if not GOOGLE_API_KEY and not GEMINI_FAKE_MODE:
+        raise HTTPException(status_code=503, detail="AI Service is not configured (API Key missing).")
+
+    model = gemini_client.model_for(BATCH_PROMPT)
+    page_label = ", ".join(str(page.get("page_number")) for page in batch)
+    errors = await _generate_and_parse(model, build_batch_prompt(batch), batch[0].get("page_number"), page_label,
+                                       system_instruction=BATCH_PROMPT.system_instruction)
+    count_model_errors([err for err in errors if is_service_error(err)])
+    return demultiplex_batch_errors(errors, batch)
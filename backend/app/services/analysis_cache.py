@@ -0,0 +1,162 @@
+import asyncio
+import copy
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.core.config import (
+    GEMINI_MODEL_NAME, ANALYSIS_CACHE_MAX_ENTRIES, ANALYSIS_CACHE_TTL_SECONDS, ANALYSIS_CACHE_DB_PATH,
+    ANALYZER_BACKEND,
+)
+from app.services.ai_service import PROMPT_VERSION, is_service_error
+from app.services.metrics import CACHE_EVENTS
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace so re-extracted or re-wrapped pages hash identically."""
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def make_cache_key(text: str, model_name: str = GEMINI_MODEL_NAME, prompt_version: str = PROMPT_VERSION) -> str:
+    payload = f"{model_name}\0{prompt_version}\0{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(errors: list) -> bool:
+    """Service-level failures (AI_Parse_Error, AI_Blocked_Request, ...) must not be cached."""
+    return not any(is_service_error(err) for err in errors)
+
+
+class _SqliteTier:
+    """On-disk tier that survives restarts. Calls are blocking and are run in a thread."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str, ttl_seconds: float) -> Optional[list]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if ttl_seconds > 0 and time.time() - row[1] > ttl_seconds:
+                self._conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return json.loads(row[0])
+
+    def put(self, key: str, errors: list) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(errors, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+
+class AnalysisCache:
+    """
+    Content-addressed cache of AI analysis results.
+    Key = sha256(model name, prompt version, normalized page text).
+    Tier 1 is an in-process LRU with size and TTL eviction, tier 2 is an optional SQLite file.
+    """
+
+    def __init__(self, max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = ANALYSIS_CACHE_TTL_SECONDS,
+                 db_path: Optional[str] = ANALYSIS_CACHE_DB_PATH,
+                 prompt_version: str = PROMPT_VERSION):
+        self.max_entries = max_entries
+        self.prompt_version = prompt_version
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (stored_at, errors)
+        self._disk = _SqliteTier(db_path) if db_path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _memory_get(self, key: str) -> Optional[list]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        stored_at, errors = entry
+        if self.ttl_seconds > 0 and time.monotonic() - stored_at > self.ttl_seconds:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return errors
+
+    def _memory_put(self, key: str, errors: list) -> None:
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (time.monotonic(), errors)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, text: str, page_number: int) -> Optional[list]:
+        """Returns cached errors re-numbered to `page_number`, or None on a miss."""
+        key = make_cache_key(text, prompt_version=self.prompt_version)
+        errors = self._memory_get(key)
+        if errors is not None:
+            self.memory_hits += 1
+            CACHE_EVENTS.labels("memory_hit").inc()
+        elif self._disk is not None:
+            errors = await asyncio.to_thread(self._disk.get, key, self.ttl_seconds)
+            if errors is not None:
+                self.disk_hits += 1
+                CACHE_EVENTS.labels("disk_hit").inc()
+                self._memory_put(key, errors)
+        if errors is None:
+            self.misses += 1
+            CACHE_EVENTS.labels("miss").inc()
+            return None
+        # Один и тот же текст может оказаться на другой странице (шаблоны, новая версия документа)
+        result = copy.deepcopy(errors)
+        for err in result:
+            err["page_number"] = page_number
+        return result
+
+    async def put(self, text: str, errors: list) -> None:
+        if not is_cacheable(errors):
+            return
+        key = make_cache_key(text, prompt_version=self.prompt_version)
+        stored = copy.deepcopy(errors)
+        self._memory_put(key, stored)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.put, key, stored)
+        self.stores += 1
+        CACHE_EVENTS.labels("store").inc()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_enabled": self._disk is not None,
+        }
+
+
+# Гибридный анализ добавляет к ответу модели локальные находки: его результаты хранятся отдельно
+analysis_cache = AnalysisCache(
+    prompt_version=PROMPT_VERSION if ANALYZER_BACKEND == "gemini" else f"{PROMPT_VERSION}+{ANALYZER_BACKEND}"
+)
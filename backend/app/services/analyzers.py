@@ -0,0 +1,125 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from app.core.config import ANALYZER_BACKEND, GOOGLE_API_KEY, GEMINI_FAKE_MODE, LOCAL_PREPASS_MIN_WORDS
+from app.services.ai_service import analyze_batch_with_gemini, is_service_error
+from app.services.local_proofreader import LocalProofreader, local_proofreader
+
+
+class Analyzer(ABC):
+    """
+    Analysis backend used by the scheduler.
+    - `prepass(page)` may return the errors of a page right away, so the page skips the model;
+    - `analyze_batch(batch)` analyzes pages packed into one request: {page_number: [error, ...]};
+    - `fallback_batch(batch, exc)`, if defined, replaces results of a request that failed for good.
+    """
+
+    name = "base"
+    fallback_batch = None
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def prepass(self, page_info: dict) -> Optional[list]:
+        return None
+
+    @abstractmethod
+    async def analyze_batch(self, batch: List[dict]) -> Dict[int, list]:
+        ...
+
+
+class GeminiAnalyzer(Analyzer):
+    """Every page goes to the Gemini model."""
+
+    name = "gemini"
+
+    @property
+    def available(self) -> bool:
+        return bool(GOOGLE_API_KEY or GEMINI_FAKE_MODE)
+
+    async def analyze_batch(self, batch: List[dict]) -> Dict[int, list]:
+        return await analyze_batch_with_gemini(batch)
+
+
+class LocalAnalyzer(Analyzer):
+    """Offline mode: every page is checked by the local proofreader only (no API key needed)."""
+
+    name = "local"
+
+    def __init__(self, proofreader: LocalProofreader = local_proofreader):
+        self.proofreader = proofreader
+
+    def prepass(self, page_info: dict) -> Optional[list]:
+        return self.proofreader.check_text(page_info.get("text", ""), page_info.get("page_number", 0))
+
+    async def analyze_batch(self, batch: List[dict]) -> Dict[int, list]:
+        return self.proofreader.analyze_batch(batch)
+
+
+class HybridAnalyzer(GeminiAnalyzer):
+    """
+    Local pre-pass in front of Gemini.
+    - pages with fewer than `min_words` words (titles, page numbers, figure captions) are
+      checked locally and never reach the model;
+    - findings of the local checks are added to the model's, unless a model error already
+      covers the same fragment;
+    - when the model fails for a page (AI_* errors, or the request fails after all retries),
+      the local findings are still returned.
+    """
+
+    name = "hybrid"
+
+    def __init__(self, proofreader: LocalProofreader = local_proofreader,
+                 min_words: int = LOCAL_PREPASS_MIN_WORDS):
+        self.proofreader = proofreader
+        self.min_words = min_words
+
+    @property
+    def available(self) -> bool:
+        return True  # Без модели каждый запрос уходит в fallback_batch
+
+    def prepass(self, page_info: dict) -> Optional[list]:
+        text = page_info.get("text", "")
+        if self.proofreader.count_words(text) >= self.min_words:
+            return None
+        return self.proofreader.check_text(text, page_info.get("page_number", 0))
+
+    async def analyze_batch(self, batch: List[dict]) -> Dict[int, list]:
+        errors_by_page = await analyze_batch_with_gemini(batch)
+        local_by_page = self.proofreader.analyze_batch(batch)
+        for page_number, local_errors in local_by_page.items():
+            model_errors = errors_by_page.setdefault(page_number, [])
+            covered = [err.get("original_snippet") or "" for err in model_errors if not is_service_error(err)]
+            model_errors.extend(
+                err for err in local_errors
+                if not any(err["original_snippet"] in snippet for snippet in covered)
+            )
+        return errors_by_page
+
+    async def fallback_batch(self, batch: List[dict], exc: BaseException) -> Dict[int, list]:
+        print(f"Hybrid analyzer: model request failed ({exc}); using local checks only.")
+        errors_by_page = self.proofreader.analyze_batch(batch)
+        for page_number, errors in errors_by_page.items():
+            # AI_* пометка: пользователь видит, что проверка была неполной, и результат не попадает в кэш
+            errors.append({
+                "page_number": page_number,
+                "original_snippet": "N/A",
+                "corrected_snippet": "N/A",
+                "error_type": "AI_Fallback_Local",
+                "explanation": f"AI analysis was unavailable ({exc}); only local spelling and punctuation checks were applied.",
+            })
+        return errors_by_page
+
+
+def create_analyzer(backend: str = ANALYZER_BACKEND) -> Analyzer:
+    if backend == "gemini":
+        return GeminiAnalyzer()
+    if backend == "local":
+        return LocalAnalyzer()
+    if backend == "hybrid":
+        return HybridAnalyzer()
+    raise ValueError(f"Unknown ANALYZER_BACKEND '{backend}'. Use 'gemini', 'local', 'hybrid' or 'auto'.")
+
+
+analyzer = create_analyzer()
@@ -0,0 +1,422 @@
+import asyncio
+import os
+import tempfile
+import zipfile
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from app.core.config import (
+    MAX_UPLOAD_BYTES, MAX_BATCH_DOCUMENTS, MAX_BATCH_UPLOAD_BYTES, BATCH_MAX_ACTIVE_DOCUMENTS, UPLOAD_SPOOL_DIR,
+)
+from app.models.schemas import AnalysisResponse, BatchAnalysisResponse, BatchDocumentFailure
+from app.services.ai_service import is_service_error, to_error_details
+from app.services.document_store import document_store
+from app.services.metrics import stage_timer
+from app.services.process_pool import StageHTTPException
+from app.services.revision_diff import Span, join_unit_runs, locate_errors, split_unit_spans, unit_hash
+from app.services.scheduler import gemini_scheduler
+from app.services.upload_service import SpooledUpload, aiter_pdf_pages, remove_spooled_file
+
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed", "application/x-zip"}
+ZIP_COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class BatchDocument:
+    """One PDF of a batch: its spooled file, extracted pages and analysis state."""
+
+    def __init__(self, filename: str, path: str):
+        self.filename = filename
+        self.path: Optional[str] = path  # None, когда файл передан сессии документа
+        self.pages: List[dict] = []
+        self.errors_by_page: Dict[int, List[dict]] = {}
+        self.failure: Optional[str] = None
+
+
+def _is_zip_upload(upload: SpooledUpload) -> bool:
+    return upload.content_type in ZIP_CONTENT_TYPES or (upload.filename or "").lower().endswith(".zip")
+
+
+def check_batch_file(upload: SpooledUpload) -> None:
+    """
+    `check_file` hook of the batch form: PDFs keep the per-file limit, a zip archive may take the
+    whole batch limit (its members are held to the per-file limit when unpacked).
+    """
+    if _is_zip_upload(upload):
+        upload.max_bytes = MAX_BATCH_UPLOAD_BYTES
+    elif upload.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail=f"Invalid file type for '{upload.filename}'. Only PDF files and zip archives of PDF files are allowed.")
+
+
+def _batch_too_large(max_total_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"The batch is too large. Maximum total size of the PDF files is {max_total_bytes} bytes.")
+
+
+def _extract_zip_members(zip_path: str, max_members: int, max_total_bytes: Optional[int],
+                         max_bytes: int = MAX_UPLOAD_BYTES) -> List[Tuple[str, str]]:
+    """
+    Extracts the PDF members of a spooled zip archive to temporary files, streaming each member
+    and enforcing the per-file limit and the remaining batch budget (`max_total_bytes`) on the
+    bytes actually written (declared sizes may lie). `max_total_bytes=None` means no batch limit.
+    Returns [(member name, path)] in archive order.
+    """
+    extracted: List[Tuple[str, str]] = []
+    total = 0
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            members = [
+                info for info in archive.infolist()
+                if not info.is_dir()
+                and info.filename.lower().endswith(".pdf")
+                and not info.filename.startswith("__MACOSX/")
+                and not os.path.basename(info.filename).startswith(".")
+            ]
+            if len(members) > max_members:
+                raise HTTPException(status_code=413, detail=f"Too many documents in the batch. Maximum is {MAX_BATCH_DOCUMENTS} documents.")
+            for info in members:
+                if max_bytes > 0 and info.file_size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"'{info.filename}' is too large. Maximum file size is {max_bytes} bytes.")
+                if max_total_bytes is not None and total + info.file_size > max_total_bytes:
+                    raise _batch_too_large(MAX_BATCH_UPLOAD_BYTES)
+                fd, path = tempfile.mkstemp(suffix=".pdf", dir=UPLOAD_SPOOL_DIR or None)
+                extracted.append((os.path.basename(info.filename), path))
+                size = 0
+                with archive.open(info) as src, os.fdopen(fd, "wb") as out:
+                    while True:
+                        chunk = src.read(ZIP_COPY_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        total += len(chunk)
+                        if max_bytes > 0 and size > max_bytes:
+                            raise HTTPException(status_code=413, detail=f"'{info.filename}' is too large. Maximum file size is {max_bytes} bytes.")
+                        if max_total_bytes is not None and total > max_total_bytes:
+                            raise _batch_too_large(MAX_BATCH_UPLOAD_BYTES)
+                        out.write(chunk)
+    except zipfile.BadZipFile:
+        for _, path in extracted:
+            remove_spooled_file(path)
+        raise HTTPException(status_code=422, detail="The uploaded archive is not a valid zip file.")
+    except BaseException:
+        for _, path in extracted:
+            remove_spooled_file(path)
+        raise
+    return extracted
+
+
+async def collect_batch_documents(uploads: List[SpooledUpload], documents: List[BatchDocument],
+                                  max_documents: int = MAX_BATCH_DOCUMENTS,
+                                  max_total_bytes: int = MAX_BATCH_UPLOAD_BYTES) -> None:
+    """
+    Appends every uploaded PDF, and every PDF inside uploaded zip archives, to `documents` (which
+    the caller cleans up, also on errors). Uploaded PDFs are taken over from the form; archives
+    are unpacked next to them and removed. The PDFs of a batch may take at most `max_total_bytes`
+    on disk in total, counting unpacked archive members.
+    """
+    total = sum(upload.size for upload in uploads if not _is_zip_upload(upload))
+    if max_total_bytes > 0 and total > max_total_bytes:
+        raise _batch_too_large(max_total_bytes)
+    for upload in uploads:
+        if _is_zip_upload(upload):
+            zip_path = upload.detach()
+            try:
+                # Распаковка - блокирующий ввод-вывод, поэтому в отдельном потоке
+                members = await asyncio.to_thread(
+                    _extract_zip_members, zip_path, max_documents - len(documents),
+                    max_total_bytes - total if max_total_bytes > 0 else None,
+                )
+            finally:
+                remove_spooled_file(zip_path)
+            documents.extend(BatchDocument(name, path) for name, path in members)
+            total += sum(os.path.getsize(path) for _, path in members)
+        else:
+            if len(documents) >= max_documents:
+                raise HTTPException(status_code=413, detail=f"Too many documents in the batch. Maximum is {max_documents} documents.")
+            documents.append(BatchDocument(upload.filename, upload.detach()))
+    if not documents:
+        raise HTTPException(status_code=422, detail="The batch does not contain any PDF files.")
+
+
+async def _next_page(pages: AsyncIterator[dict]) -> dict:
+    return await pages.__anext__()
+
+
+async def interleave_documents(documents: List[BatchDocument],
+                               max_active: int = BATCH_MAX_ACTIVE_DOCUMENTS) -> AsyncIterator[Tuple[BatchDocument, dict]]:
+    """
+    Yields (document, page) round-robin across up to `max_active` documents at a time: their
+    extraction runs in parallel, a large document takes one page per turn like everyone else,
+    and the next document joins as soon as one finishes.
+    Extraction waits for a free process instead of being rejected when the pool is busy.
+    A document that cannot be read (the PDF itself is rejected: invalid, too many pages) is marked
+    failed and dropped without stopping the rest of the batch; failures of the server (timeouts,
+    crashed workers) fail the whole batch.
+    """
+    waiting = deque(documents)
+    active: deque = deque()  # (документ, итератор страниц, задача следующей страницы)
+
+    def activate() -> None:
+        while waiting and len(active) < max(1, max_active):
+            document = waiting.popleft()
+            pages = aiter_pdf_pages(document.path, wait_for_slot=True)
+            active.append((document, pages, asyncio.ensure_future(_next_page(pages))))
+
+    activate()
+    try:
+        while active:
+            document, pages, next_page = active.popleft()
+            try:
+                page = await next_page
+            except StopAsyncIteration:
+                activate()
+                continue
+            except HTTPException as e:
+                # Ошибка самого документа: его отклонил этап в процессе пула или лимит страниц
+                if not isinstance(e, StageHTTPException) and e.status_code >= 500:
+                    raise
+                document.failure = e.detail
+                print(f"Batch analysis: could not read '{document.filename}': {document.failure}")
+                await pages.aclose()
+                activate()
+                continue
+            active.append((document, pages, asyncio.ensure_future(_next_page(pages))))
+            yield document, page
+    finally:
+        for _, pages, next_page in active:
+            next_page.cancel()
+            try:
+                await next_page
+            except BaseException:
+                pass
+            await pages.aclose()
+
+
+class _BatchPage:
+    """Units of one page of a batch and which of them were sent to the model."""
+
+    def __init__(self, text: str, spans: List[Span], hashes: List[str], sent: List[bool]):
+        self.text = text
+        self.spans = spans
+        self.hashes = hashes
+        self.sent = sent
+        self.resend: List[bool] = []
+
+
+class BatchDeduplicator:
+    """
+    Deduplicates text across all pages of a batch (pages get batch-wide sequence numbers) at unit
+    (paragraph or sentence) granularity, as RevisionDiff does for revisions of one document.
+    - a unit is sent to the model only with the page where it first occurs in the batch; other
+      pages send only their new units, as whole paragraphs or sentences (a page seen in full
+      before is not sent at all). Repeats within the sending page are sent with it;
+    - after analysis, errors are located in the page text by their snippet (also across line
+      breaks) and attributed per occurrence: a page reusing a unit gets the errors of the
+      occurrence that was analyzed, once, never the errors of all its copies;
+    - an error spanning several units is reused where the whole run repeats; units that share
+      only a part of such a run are analyzed again (see `resend_pages`);
+    - errors whose snippet was not found stay with the analyzed page and exact copies of it;
+    - service errors (AI_*) of the page that sent a unit are copied to every page reusing it,
+      so an incomplete analysis is never silently hidden.
+    """
+
+    def __init__(self):
+        self._unit_owner: Dict[str, Tuple[int, int]] = {}  # хэш единицы -> (страница, номер единицы), где она отправлена
+        self._page_owner: Dict[str, int] = {}             # хэш страницы -> первая такая страница
+        self._pages: Dict[int, _BatchPage] = {}
+        self._duplicate_of: Dict[int, int] = {}
+        self._unit_errors: Dict[Tuple[int, int], List[dict]] = {}
+        self._chain_owner: Dict[Tuple[str, ...], Tuple[int, int]] = {}  # цепочка хэшей -> (страница, первая единица) первого вхождения
+        self._chain_errors: Dict[Tuple[str, ...], List[dict]] = {}     # цепочка хэшей -> ошибки этого вхождения
+        self._chains_by_first_unit: Dict[str, List[Tuple[str, ...]]] = {}
+        self._service_errors: Dict[int, List[dict]] = {}
+        self.pages_total = 0
+        self.pages_deduplicated = 0
+        self.paragraphs_total = 0
+        self.paragraphs_deduplicated = 0
+        self.paragraphs_reanalyzed = 0
+
+    def reduce(self, seq: int, text: str) -> str:
+        """Returns the part of the page that still has to be analyzed (empty when nothing is new)."""
+        self.pages_total += 1
+        page_hash = unit_hash(text)
+        if text.strip() and page_hash in self._page_owner:
+            self._duplicate_of[seq] = self._page_owner[page_hash]
+        else:
+            self._page_owner.setdefault(page_hash, seq)
+
+        spans = split_unit_spans(text)
+        hashes = [unit_hash(text[start:end]) for start, end in spans]
+        sent = []
+        for index, unit in enumerate(hashes):
+            owner = self._unit_owner.setdefault(unit, (seq, index))
+            sent.append(owner[0] == seq)
+        self._pages[seq] = _BatchPage(text, spans, hashes, sent)
+        self.paragraphs_total += len(hashes)
+        self.paragraphs_deduplicated += len(hashes) - sum(sent)
+        if hashes and not any(sent):
+            self.pages_deduplicated += 1
+        return join_unit_runs(text, spans, sent)
+
+    def _add_service_errors(self, errors: List[dict], seen: set, owners: Sequence[int]) -> None:
+        for owner in sorted(set(owners)):
+            for error in self._service_errors.get(owner, []):
+                key = (error.get("error_type"), error.get("explanation"))
+                if key not in seen:
+                    seen.add(key)
+                    errors.append(error)
+
+    def fan_out(self, results: Dict[int, List[dict]]) -> Dict[int, List[dict]]:
+        """
+        Maps analysis results of the reduced pages to the full errors of every page.
+        Units that have to be analyzed again get no errors here (see `resend_pages`).
+        """
+        self._unit_errors, self._chain_owner, self._chain_errors = {}, {}, {}
+        self._chains_by_first_unit, self._service_errors = {}, {}
+        self.paragraphs_reanalyzed = 0
+        not_found_errors: Dict[int, List[dict]] = {}
+        own_chain_errors: Dict[int, List[dict]] = {}
+        chained_units = set()
+        for seq, errors in results.items():
+            page = self._pages.get(seq)
+            if page is None:
+                continue
+            self._service_errors[seq] = [error for error in errors if is_service_error(error)]
+            located, not_found_errors[seq] = locate_errors(
+                page.text, page.spans, [error for error in errors if not is_service_error(error)], allowed=page.sent,
+            )
+            for error, (first, last) in located:
+                if first == last:
+                    self._unit_errors.setdefault((seq, first), []).append(error)
+                    continue
+                own_chain_errors.setdefault(seq, []).append(error)
+                chain = tuple(page.hashes[first:last + 1])
+                if self._chain_owner.setdefault(chain, (seq, first)) == (seq, first):
+                    self._chain_errors.setdefault(chain, []).append(error)
+                chains = self._chains_by_first_unit.setdefault(chain[0], [])
+                if chain not in chains:
+                    chains.append(chain)
+                chained_units.update(chain)
+
+        fanned: Dict[int, List[dict]] = {}
+        for seq, page in self._pages.items():
+            reused = [not flag for flag in page.sent]
+            in_chain = [False] * len(page.hashes)
+            errors = list(own_chain_errors.get(seq, []))
+            for index, unit in enumerate(page.hashes):
+                if not reused[index]:
+                    continue
+                for chain in self._chains_by_first_unit.get(unit, ()):
+                    end = index + len(chain)
+                    if tuple(page.hashes[index:end]) == chain and all(reused[index:end]):
+                        errors.extend(self._chain_errors[chain])
+                        in_chain[index:end] = [True] * len(chain)
+            # Ошибка захватывала соседнюю единицу, которой здесь нет: такие единицы анализируются заново
+            page.resend = [reused[index] and unit in chained_units and not in_chain[index]
+                           for index, unit in enumerate(page.hashes)]
+            self.paragraphs_reanalyzed += sum(page.resend)
+
+            owners = [seq]
+            for index, unit in enumerate(page.hashes):
+                if page.sent[index]:
+                    errors.extend(self._unit_errors.get((seq, index), []))
+                elif not page.resend[index]:
+                    owner = self._unit_owner[unit]
+                    owners.append(owner[0])
+                    errors.extend(self._unit_errors.get(owner, []))
+            errors.extend(not_found_errors.get(self._duplicate_of.get(seq, seq), []))
+            self._add_service_errors(errors, set(), owners)
+            fanned[seq] = errors
+        return fanned
+
+    def resend_pages(self) -> List[dict]:
+        """Pages with units that have to be analyzed again after `fan_out`, reduced to those units."""
+        return [
+            {"page_number": seq, "text": join_unit_runs(page.text, page.spans, page.resend)}
+            for seq, page in self._pages.items() if any(page.resend)
+        ]
+
+    def merge_resent(self, fanned: Dict[int, List[dict]], results: Dict[int, List[dict]]) -> None:
+        """Adds the errors of the units analyzed again to the fanned-out errors of their pages."""
+        for seq, errors in results.items():
+            page = self._pages.get(seq)
+            if page is None:
+                continue
+            page_errors = fanned.setdefault(seq, [])
+            located, not_found = locate_errors(
+                page.text, page.spans, [error for error in errors if not is_service_error(error)], allowed=page.resend,
+            )
+            page_errors.extend(error for error, _ in located)
+            page_errors.extend(not_found)
+            seen = {(error.get("error_type"), error.get("explanation")) for error in page_errors if is_service_error(error)}
+            self._service_errors[seq] = [error for error in errors if is_service_error(error)]
+            self._add_service_errors(page_errors, seen, [seq])
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pages_total": self.pages_total,
+            "pages_deduplicated": self.pages_deduplicated,
+            "paragraphs_total": self.paragraphs_total,
+            "paragraphs_deduplicated": self.paragraphs_deduplicated,
+            "paragraphs_reanalyzed": self.paragraphs_reanalyzed,
+        }
+
+
+async def analyze_batch_documents(documents: List[BatchDocument]) -> BatchAnalysisResponse:
+    """
+    Analyzes the documents of a batch as one stream of pages: pages are interleaved across
+    documents (see `interleave_documents`), deduplicated across the whole batch
+    (see `BatchDeduplicator`) and sent through the shared scheduler. Each readable document is
+    saved as a document session; its spooled file moves to the session.
+    """
+    deduplicator = BatchDeduplicator()
+    origins: List[Tuple[BatchDocument, int]] = []  # номер в пакете - 1 -> (документ, номер страницы)
+
+    async def batch_pages() -> AsyncIterator[dict]:
+        async for document, page in interleave_documents(documents):
+            document.pages.append(page)
+            origins.append((document, page.get("page_number", 0)))
+            seq = len(origins)
+            # Номера страниц уникальны в пределах пакета: планировщик и кэш работают с ними как с одним документом
+            yield {"page_number": seq, "text": deduplicator.reduce(seq, page.get("text", ""))}
+
+    results = await gemini_scheduler.analyze_pages(batch_pages())
+    with stage_timer("batch_fan_out"):
+        fanned = deduplicator.fan_out(dict(results))
+    resend = deduplicator.resend_pages()
+    if resend:
+        # Единицы, совпавшие лишь с частью фрагмента многоединичной ошибки, анализируются заново
+        deduplicator.merge_resent(fanned, dict(await gemini_scheduler.analyze_pages(resend)))
+    for seq, (document, page_num) in enumerate(origins, start=1):
+        document.errors_by_page[page_num] = [{**error, "page_number": page_num} for error in fanned.get(seq, [])]
+
+    responses: List[AnalysisResponse] = []
+    failed: List[BatchDocumentFailure] = []
+    for document in documents:
+        if document.failure is None and not document.pages:
+            document.failure = "Could not extract any text from the PDF or the PDF is empty."
+        if document.failure is not None:
+            failed.append(BatchDocumentFailure(filename=document.filename, detail=document.failure))
+            continue
+        errors = []
+        for page in document.pages:
+            page_num = page.get("page_number", 0)
+            errors.extend(to_error_details(document.errors_by_page.get(page_num, []), page_num))
+        document_id = document_store.save(document.filename, document.pages, [error.model_dump() for error in errors],
+                                          source_path=document.path)
+        document.path = None
+        responses.append(AnalysisResponse(
+            filename=document.filename,
+            errors=errors,
+            total_pages=len(document.pages),
+            document_id=document_id,
+        ))
+
+    return BatchAnalysisResponse(documents=responses, failed=failed, dedup_stats=deduplicator.stats())
+
+
+def remove_batch_files(documents: List[BatchDocument]) -> None:
+    for document in documents:
+        if document.path:
+            remove_spooled_file(document.path)
+            document.path = None
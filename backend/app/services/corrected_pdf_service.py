@@ -3,28 +3,12 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import inch
 from io import BytesIO
+import re
 
-def apply_corrections_to_text(original_text: str, errors: list) -> str:
-    """
-    Применяет исправления к тексту.
-    Это очень упрощенная версия. В реальности нужно более умное сопоставление.
-    Для лучшего результата, AI должен возвращать не только snippet, но и его позицию.
-    Здесь мы просто заменяем первое вхождение оригинального сниппета.
-    """
-    corrected_text = original_text
-    # Сортируем ошибки по длине оригинального сниппета (от длинных к коротким)
-    # чтобы избежать проблем, когда короткий сниппет является частью длинного
-    sorted_errors = sorted(errors, key=lambda e: len(e.get("original_snippet", "")), reverse=True)
-
-    for error in sorted_errors:
-        original_snippet = error.get("original_snippet")
-        corrected_snippet = error.get("corrected_snippet")
-        if original_snippet and corrected_snippet and original_snippet != "N/A":
-            # Заменяем только первое вхождение, чтобы не испортить другие части текста, если сниппеты повторяются
-            # В идеале, нам нужны индексы или более точные локаторы ошибок от AI
-            if original_snippet in corrected_text:
-                 corrected_text = corrected_text.replace(original_snippet, corrected_snippet, 1)
-    return corrected_text
+import fitz  # PyMuPDF
+
+from app.services.correction_engine import apply_corrections
+from app.services.pdf_service import open_pdf_mapped
 
 def create_pdf_with_corrected_text(pages_data: list, all_errors: list) -> BytesIO:
     """
@@ -55,9 +39,10 @@ def create_pdf_with_corrected_text(pages_data: list, all_errors: list) -> BytesI
         errors_on_this_page = errors_by_page.get(page_num, [])
         
         # Применяем исправления к тексту этой страницы
-        # Этот шаг самый сложный для идеального результата.
-        # Текущая реализация apply_corrections_to_text очень базовая.
-        corrected_page_text = apply_corrections_to_text(original_page_text, errors_on_this_page)
+        correction = apply_corrections(original_page_text, errors_on_this_page)
+        corrected_page_text = correction.text
+        if correction.not_found:
+            print(f"Page {page_num}: {len(correction.not_found)} correction(s) not found in the extracted text.")
 
         if not first_page:
             story.append(PageBreak())
@@ -77,4 +62,149 @@ def create_pdf_with_corrected_text(pages_data: list, all_errors: list) -> BytesI
 
     doc.build(story)
     buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return buffer
+
+# Минимальный размер шрифта, до которого уменьшаем исправление, чтобы оно влезло на место оригинала
+MIN_INPLACE_FONT_SIZE = 4.0
+
+
+def _span_style(page, rect) -> tuple:
+    """Returns (font size, RGB color) of the first text span inside `rect`."""
+    for block in page.get_text("dict", clip=rect).get("blocks", []):
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                color = span.get("color", 0)
+                return span.get("size", rect.height * 0.8), ((color >> 16 & 255) / 255, (color >> 8 & 255) / 255, (color & 255) / 255)
+    return rect.height * 0.8, (0, 0, 0)
+
+
+def _page_chars(page) -> tuple:
+    """
+    Returns (text, boxes): the page text in reading order, one character per entry, with a line
+    break after every line, and for each character its (rect, line key) (None for the line breaks).
+    """
+    chars = []
+    boxes = []
+    for block_number, block in enumerate(page.get_text("rawdict").get("blocks", [])):
+        for line_number, line in enumerate(block.get("lines", [])):
+            for span in line.get("spans", []):
+                for char in span.get("chars", []):
+                    chars.append(char["c"])
+                    boxes.append((fitz.Rect(char["bbox"]), (block_number, line_number)))
+            chars.append("\n")
+            boxes.append(None)
+    return "".join(chars), boxes
+
+
+def _find_hits(text: str, boxes: list, snippet: str) -> list:
+    """
+    Finds every occurrence of `snippet` (any whitespace, including line breaks, matches any whitespace).
+    Each hit is a list of rects, one per line it covers, so a hit wrapped across lines stays one hit.
+    """
+    pattern = re.compile(r"\s+".join(re.escape(token) for token in snippet.split()))
+    hits = []
+    for match in pattern.finditer(text):
+        line_rects = {}
+        for position in range(match.start(), match.end()):
+            if boxes[position] is None:
+                continue
+            rect, line_key = boxes[position]
+            line_rects[line_key] = line_rects[line_key] | rect if line_key in line_rects else fitz.Rect(rect)
+        if line_rects:
+            hits.append(list(line_rects.values()))
+    return hits
+
+
+def _overlaps(rect, other) -> bool:
+    # Области соседних строк немного пересекаются по вертикали; это не одно и то же вхождение
+    intersection = rect & other
+    return not intersection.is_empty and intersection.get_area() > 0.5 * min(rect.get_area(), other.get_area())
+
+
+def _split_for_lines(corrected_snippet: str, line_lengths: list) -> list:
+    """Splits a correction into one piece per line, at word boundaries, in proportion to the original lines."""
+    words = corrected_snippet.split()
+    pieces = [[] for _ in line_lengths]
+    total_original = sum(line_lengths) or 1
+    total_corrected = len(corrected_snippet) or 1
+    boundaries = []
+    cumulative = 0
+    for length in line_lengths:
+        cumulative += length
+        boundaries.append(cumulative / total_original)
+    position = 0
+    for word in words:
+        middle = (position + len(word) / 2) / total_corrected
+        line = next((i for i, boundary in enumerate(boundaries) if middle <= boundary), len(boundaries) - 1)
+        pieces[line].append(word)
+        position += len(word) + 1
+    return [" ".join(piece) for piece in pieces]
+
+
+def create_pdf_with_inplace_corrections(pdf_path: str, all_errors: list) -> tuple:
+    """
+    Правит исходный PDF на месте, сохраняя верстку и изображения.
+    Для каждой ошибки сниппет ищется в символах своей страницы (переносы строк считаются пробелами),
+    каждая строка найденного фрагмента закрывается redaction-аннотацией, а на ее место пишется
+    соответствующая часть исправления (с разбиением по словам).
+    Страницы без ошибок не трогаются, так что стоимость зависит от числа исправлений, а не от размера документа.
+    Возвращает (BytesIO с PDF, список ошибок, которые не удалось найти или разместить).
+    """
+    unresolved = []
+
+    errors_by_page = {}
+    for error in all_errors:
+        errors_by_page.setdefault(error.get("page_number"), []).append(error)
+
+    with open_pdf_mapped(pdf_path) as doc:
+        for page_num, errors_on_this_page in errors_by_page.items():
+            if not isinstance(page_num, int) or not 1 <= page_num <= doc.page_count:
+                unresolved.extend(errors_on_this_page)
+                continue
+            page = doc.load_page(page_num - 1)
+            page_text, char_boxes = _page_chars(page)
+            taken_rects = []  # Уже занятые области: одно вхождение - одно исправление
+            hits_by_snippet = {}
+            redactions = 0
+
+            for error in errors_on_this_page:
+                original_snippet = error.get("original_snippet")
+                corrected_snippet = error.get("corrected_snippet")
+                if not original_snippet or corrected_snippet is None or original_snippet == "N/A" or corrected_snippet == "N/A":
+                    continue
+                if original_snippet not in hits_by_snippet:
+                    hits_by_snippet[original_snippet] = _find_hits(page_text, char_boxes, original_snippet)
+                hit = next((rects for rects in hits_by_snippet[original_snippet]
+                            if not any(_overlaps(rect, taken) for rect in rects for taken in taken_rects)), None)
+                if hit is None:
+                    unresolved.append(error)
+                    continue
+
+                # Фрагмент, перенесенный на несколько строк, заменяется по строкам: каждая строка - своя область
+                if len(hit) == 1:
+                    pieces = [corrected_snippet]
+                else:
+                    pieces = _split_for_lines(corrected_snippet, [rect.width for rect in hit])
+                fontsize, color = _span_style(page, hit[0])
+                placements = []
+                for rect, piece in zip(hit, pieces):
+                    piece_fontsize = fontsize
+                    text_width = fitz.get_text_length(piece, fontname="helv", fontsize=fontsize)
+                    if text_width > rect.width:
+                        piece_fontsize = fontsize * rect.width / text_width
+                    placements.append((rect, piece, piece_fontsize))
+                if any(piece_fontsize < MIN_INPLACE_FONT_SIZE for _, _, piece_fontsize in placements):
+                    unresolved.append(error)  # Исправление не помещается на место оригинала
+                    continue
+
+                for rect, piece, piece_fontsize in placements:
+                    taken_rects.append(rect)
+                    page.add_redact_annot(rect, text=piece, fontname="helv", fontsize=piece_fontsize,
+                                          fill=(1, 1, 1), text_color=color, cross_out=False)
+                redactions += 1
+
+            if redactions:
+                page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE)
+
+        buffer = BytesIO(doc.tobytes(garbage=0, deflate=True))
+    return buffer, unresolved
@@ -0,0 +1,135 @@
+from collections import deque
+from typing import Dict, List, NamedTuple, Tuple
+
+# До этого числа разных сниппетов поиск str.find (на C) по каждому сниппету быстрее,
+# чем проход автомата на Python; выше - автомат выигрывает за счет линейности
+AUTOMATON_MIN_PATTERNS = 200
+
+
+class CorrectionResult(NamedTuple):
+    text: str
+    applied: List[dict]      # Ошибки, исправления которых применены
+    not_found: List[dict]    # Ошибки, сниппет которых не найден (или перекрыт другим исправлением)
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton: finds all occurrences of many patterns in one pass over the text,
+    O(len(text) + number of matches) regardless of the number of patterns.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]  # Индексы паттернов, заканчивающихся в состоянии
+
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(pattern_id)
+
+        # Суффиксные ссылки строятся обходом в ширину
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail_state = self._fail[state]
+                while fail_state and char not in self._goto[fail_state]:
+                    fail_state = self._fail[fail_state]
+                candidate = self._goto[fail_state].get(char, 0)
+                self._fail[next_state] = candidate if candidate != next_state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_all(self, text: str) -> List[Tuple[int, int, int]]:
+        """Returns (start, end, pattern_id) for every occurrence; `end` is exclusive."""
+        matches = []
+        goto, fail, output, patterns = self._goto, self._fail, self._output, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_id in output[state]:
+                matches.append((position + 1 - len(patterns[pattern_id]), position + 1, pattern_id))
+        return matches
+
+
+def _find_all_by_scanning(text: str, patterns: List[str]) -> List[Tuple[int, int, int]]:
+    """Same result as AhoCorasick.find_all, one str.find scan per pattern."""
+    matches = []
+    for pattern_id, pattern in enumerate(patterns):
+        start = text.find(pattern)
+        while start != -1:
+            matches.append((start, start + len(pattern), pattern_id))
+            start = text.find(pattern, start + 1)
+    return matches
+
+
+def find_all_occurrences(text: str, patterns: List[str]) -> List[Tuple[int, int, int]]:
+    """Returns (start, end, pattern_id) for every (possibly overlapping) occurrence of every pattern."""
+    if len(patterns) < AUTOMATON_MIN_PATTERNS:
+        return _find_all_by_scanning(text, patterns)
+    return AhoCorasick(patterns).find_all(text)
+
+
+def _is_applicable(error: dict) -> bool:
+    original_snippet = error.get("original_snippet")
+    corrected_snippet = error.get("corrected_snippet")
+    return bool(original_snippet) and corrected_snippet is not None and original_snippet != "N/A" and corrected_snippet != "N/A"
+
+
+def apply_corrections(original_text: str, errors: list) -> CorrectionResult:
+    """
+    Applies all corrections to the text in a single pass.
+    - every original snippet is located with one Aho-Corasick scan of the *original* text
+      (plain str.find for a handful of snippets), so earlier replacements can never shift
+      or corrupt later matches;
+    - each error claims the next unclaimed occurrence of its snippet (errors with the same
+      snippet take successive occurrences, in input order);
+    - overlapping occurrences are resolved deterministically: leftmost first, then longest,
+      then the earliest error; the losing correction is reported in `not_found`;
+    - the corrected text is built once from the kept spans.
+    """
+    applicable = [error for error in errors if _is_applicable(error)]
+    if not applicable:
+        return CorrectionResult(original_text, [], [])
+
+    # Ошибки с одинаковым сниппетом обслуживаются очередью в исходном порядке
+    snippet_ids: Dict[str, int] = {}
+    queues: List[deque] = []
+    for error in applicable:
+        snippet = error["original_snippet"]
+        if snippet not in snippet_ids:
+            snippet_ids[snippet] = len(queues)
+            queues.append(deque())
+        queues[snippet_ids[snippet]].append(error)
+
+    matches = find_all_occurrences(original_text, list(snippet_ids))
+    # Самое левое, затем самое длинное, затем паттерн первой по порядку ошибки
+    matches.sort(key=lambda match: (match[0], match[0] - match[1], match[2]))
+
+    pieces = []
+    applied = []
+    cursor = 0
+    for start, end, pattern_id in matches:
+        if start < cursor or not queues[pattern_id]:
+            continue
+        error = queues[pattern_id].popleft()
+        pieces.append(original_text[cursor:start])
+        pieces.append(error["corrected_snippet"])
+        applied.append(error)
+        cursor = end
+    pieces.append(original_text[cursor:])
+
+    not_found = [error for queue in queues for error in queue]
+    return CorrectionResult("".join(pieces), applied, not_found)
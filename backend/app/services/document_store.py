@@ -0,0 +1,150 @@
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+from app.core.config import (
+    DOCUMENT_SESSION_TTL_SECONDS, DOCUMENT_SESSION_MAX_DOCUMENTS, DOCUMENT_SESSION_MAX_CHARS,
+    DOCUMENT_SESSION_MAX_FILE_BYTES,
+)
+from app.services.upload_service import remove_spooled_file
+
+
+def _session_size(pages: List[dict], errors: List[dict]) -> int:
+    """Approximate memory footprint of a session in characters."""
+    size = sum(len(page.get("text", "")) for page in pages)
+    for err in errors:
+        size += len(err.get("original_snippet", "")) + len(err.get("corrected_snippet", "")) + len(err.get("explanation", ""))
+    return size
+
+
+class DocumentSessionStore:
+    """
+    Keeps extracted pages and analysis results of analyzed documents under a document id,
+    so the corrected PDF can be downloaded without re-uploading and re-parsing the original.
+    Sessions expire after `ttl_seconds`; when `max_documents` or `max_chars` is exceeded,
+    the least recently used sessions are evicted.
+    A session may own the spooled original PDF (`source_path`, needed for in-place correction);
+    the file is deleted together with the session. These files have their own budget,
+    `max_file_bytes`: when it is exceeded, the files of the least recently used sessions are
+    deleted first while their text stays available (in-place downloads then fall back to rebuild).
+    """
+
+    def __init__(self, ttl_seconds: float = DOCUMENT_SESSION_TTL_SECONDS,
+                 max_documents: int = DOCUMENT_SESSION_MAX_DOCUMENTS,
+                 max_chars: int = DOCUMENT_SESSION_MAX_CHARS,
+                 max_file_bytes: int = DOCUMENT_SESSION_MAX_FILE_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_documents = max(1, max_documents)
+        self.max_chars = max_chars
+        self.max_file_bytes = max_file_bytes
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self._total_chars = 0
+        self._total_file_bytes = 0
+
+    def _drop_source_file(self, session: dict) -> None:
+        if session["source_path"]:
+            remove_spooled_file(session["source_path"])
+            self._total_file_bytes -= session["file_bytes"]
+            session["source_path"] = None
+            session["file_bytes"] = 0
+
+    def _evict(self, document_id: str) -> None:
+        session = self._sessions.pop(document_id, None)
+        if session is not None:
+            self._total_chars -= session["size"]
+            self._drop_source_file(session)
+
+    def _evict_expired(self) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        now = time.monotonic()
+        expired = [doc_id for doc_id, session in self._sessions.items()
+                   if now - session["last_access"] > self.ttl_seconds]
+        for doc_id in expired:
+            self._evict(doc_id)
+
+    def save(self, filename: str, pages: List[dict], errors: List[dict],
+             source_path: Optional[str] = None) -> Optional[str]:
+        """
+        Stores a session and returns its document id (None if the document alone exceeds the budget).
+        Takes ownership of the file at `source_path` in both cases.
+        """
+        self._evict_expired()
+        document_id = uuid.uuid4().hex
+        size = _session_size(pages, errors)
+        if self.max_chars > 0 and size > self.max_chars:
+            # Документ больше всего бюджета: не сохраняем, скачивание пойдет по старой схеме с повторной загрузкой
+            print(f"Document session for '{filename}' not stored: {size} chars exceed the {self.max_chars} budget.")
+            if source_path:
+                remove_spooled_file(source_path)
+            return None
+        file_bytes = 0
+        if source_path:
+            try:
+                file_bytes = os.path.getsize(source_path)
+            except OSError:
+                source_path = None
+        if source_path and self.max_file_bytes > 0 and file_bytes > self.max_file_bytes:
+            # Файл больше всего бюджета: сессия хранит только текст, inplace недоступен
+            print(f"Document session for '{filename}': source PDF not kept, {file_bytes} bytes exceed the {self.max_file_bytes} budget.")
+            remove_spooled_file(source_path)
+            source_path, file_bytes = None, 0
+        self._sessions[document_id] = {
+            "document_id": document_id,
+            "filename": filename,
+            "pages": pages,
+            "errors": errors,
+            "source_path": source_path,
+            "file_bytes": file_bytes,
+            "size": size,
+            "last_access": time.monotonic(),
+        }
+        self._total_chars += size
+        self._total_file_bytes += file_bytes
+        while len(self._sessions) > self.max_documents or (self.max_chars > 0 and self._total_chars > self.max_chars):
+            oldest_id = next(iter(self._sessions))
+            self._evict(oldest_id)
+        if self.max_file_bytes > 0:
+            for session in list(self._sessions.values()):
+                if self._total_file_bytes <= self.max_file_bytes:
+                    break
+                self._drop_source_file(session)
+        return document_id
+
+    def get(self, document_id: str) -> dict:
+        """Returns the session or raises 404 if it is unknown or has expired."""
+        self._evict_expired()
+        session = self._sessions.get(document_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"Document '{document_id}' not found or expired. Please analyze the PDF again.")
+        session["last_access"] = time.monotonic()
+        self._sessions.move_to_end(document_id)
+        return session
+
+    def clear(self) -> None:
+        """Drops all sessions and their spooled files (used on shutdown)."""
+        for document_id in list(self._sessions):
+            self._evict(document_id)
+
+    def stats(self) -> dict:
+        return {"documents": len(self._sessions), "total_chars": self._total_chars,
+                "total_file_bytes": self._total_file_bytes}
+
+
+document_store = DocumentSessionStore()
+
+
+def select_accepted_errors(errors: List[dict], accepted_indices: Optional[List[int]]) -> List[dict]:
+    """Returns the subset of session errors accepted by the user (all of them when `accepted_indices` is None)."""
+    if accepted_indices is None:
+        return errors
+    selected = []
+    for index in accepted_indices:
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < len(errors):
+            raise HTTPException(status_code=400, detail=f"Invalid error index in accepted corrections: {index!r}.")
+        selected.append(errors[index])
+    return selected
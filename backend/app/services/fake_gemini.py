@@ -0,0 +1,70 @@
+import asyncio
+import json
+import os
+import random
+
+
+def load_canned_errors(value: str) -> list:
+    """Parses GEMINI_FAKE_CANNED_ERRORS: an inline JSON array or a path to a JSON file with one."""
+    if not value:
+        return []
+    if os.path.isfile(value):
+        with open(value, encoding="utf-8") as canned_file:
+            return json.load(canned_file)
+    return json.loads(value)
+
+
+class FakeRateLimitError(Exception):
+    """Imitates google.api_core.exceptions.ResourceExhausted (HTTP 429)."""
+    code = 429
+
+
+class FakeServerError(Exception):
+    """Imitates google.api_core.exceptions.ServiceUnavailable (HTTP 503)."""
+    code = 503
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.prompt_feedback = None
+
+
+class FakeGenerativeModel:
+    """
+    Local stand-in for genai.GenerativeModel.
+    Injects latency and rate-limit errors so the scheduler can be exercised without real quota.
+    Only canned errors whose original_snippet occurs in the prompt are returned, like a real
+    model reporting errors of the given text.
+    In JSON response mode (generation_config.response_mime_type == "application/json") the
+    canned errors are returned as bare JSON, otherwise wrapped in a markdown fence like the real model.
+    """
+
+    def __init__(self, model_name: str = "fake-model", latency_seconds: float = 0.5,
+                 rate_limit_error_rate: float = 0.0, server_error_rate: float = 0.0,
+                 canned_errors: list = None, seed: int = None,
+                 system_instruction: str = None, generation_config=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.json_mode = getattr(generation_config, "response_mime_type", None) == "application/json"
+        self.latency_seconds = latency_seconds
+        self.rate_limit_error_rate = rate_limit_error_rate
+        self.server_error_rate = server_error_rate
+        self.canned_errors = canned_errors or []
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    async def generate_content_async(self, prompt: str) -> FakeResponse:
+        self.calls += 1
+        await asyncio.sleep(self.latency_seconds)
+
+        roll = self._random.random()
+        if roll < self.rate_limit_error_rate:
+            raise FakeRateLimitError("429 Resource has been exhausted (fake)")
+        if roll < self.rate_limit_error_rate + self.server_error_rate:
+            raise FakeServerError("503 The service is currently unavailable (fake)")
+
+        errors = [error for error in self.canned_errors if error.get("original_snippet", "") in prompt]
+        if self.json_mode:
+            return FakeResponse(json.dumps(errors))
+        return FakeResponse("```json\n" + json.dumps(errors) + "\n```")
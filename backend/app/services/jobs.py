@@ -0,0 +1,329 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from app.core.config import JOB_STORE_BACKEND, JOB_STORE_DIR, JOB_WORKERS, JOB_RESULT_TTL_SECONDS
+from app.services.ai_service import to_error_details
+from app.services.document_store import document_store
+from app.services.scheduler import gemini_scheduler
+from app.services.upload_service import aiter_pdf_pages, remove_spooled_file
+
+FINISHED_STATUSES = ("completed", "failed")
+
+
+class JobStore(ABC):
+    """
+    Storage of job state and per-page results.
+    A job is a dict with the fields of schemas.JobStatus plus `created_at`/`finished_at`;
+    page results are records {'page_number': int, 'errors': [ErrorDetail dict, ...]} in completion order.
+    """
+
+    @abstractmethod
+    def create(self, job: dict) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields) -> dict:
+        ...
+
+    @abstractmethod
+    def append_page_result(self, job_id: str, record: dict) -> None:
+        ...
+
+    @abstractmethod
+    def get_page_results(self, job_id: str, offset: int = 0) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def list_jobs(self) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def delete(self, job_id: str) -> None:
+        ...
+
+
+class InMemoryJobStore(JobStore):
+    def __init__(self):
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._results: Dict[str, List[dict]] = {}
+
+    def create(self, job: dict) -> None:
+        self._jobs[job["job_id"]] = dict(job)
+        self._results[job["job_id"]] = []
+
+    def get(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def update(self, job_id: str, **fields) -> dict:
+        self._jobs[job_id].update(fields)
+        return dict(self._jobs[job_id])
+
+    def append_page_result(self, job_id: str, record: dict) -> None:
+        self._results[job_id].append(record)
+
+    def get_page_results(self, job_id: str, offset: int = 0) -> List[dict]:
+        return self._results.get(job_id, [])[offset:]
+
+    def list_jobs(self) -> List[dict]:
+        return [dict(job) for job in self._jobs.values()]
+
+    def delete(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+        self._results.pop(job_id, None)
+
+
+class FileJobStore(JobStore):
+    """
+    Keeps each job in `<dir>/<job_id>.json` and its page results in `<dir>/<job_id>.ndjson`,
+    so status and already finished pages survive a server restart.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _results_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.ndjson")
+
+    def _write_job(self, job: dict) -> None:
+        tmp_path = self._job_path(job["job_id"]) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, self._job_path(job["job_id"]))  # Атомарная замена
+
+    def create(self, job: dict) -> None:
+        with self._lock:
+            self._write_job(job)
+            open(self._results_path(job["job_id"]), "w", encoding="utf-8").close()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(self._job_path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def update(self, job_id: str, **fields) -> dict:
+        with self._lock:
+            job = self.get(job_id)
+            job.update(fields)
+            self._write_job(job)
+            return job
+
+    def append_page_result(self, job_id: str, record: dict) -> None:
+        with self._lock:
+            with open(self._results_path(job_id), "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def get_page_results(self, job_id: str, offset: int = 0) -> List[dict]:
+        try:
+            with open(self._results_path(job_id), encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        # Последняя строка может быть дописана не полностью - берем только завершенные
+        return [json.loads(line) for line in lines[offset:] if line.endswith("\n")]
+
+    def list_jobs(self) -> List[dict]:
+        jobs = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                job = self.get(name[:-len(".json")])
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def delete(self, job_id: str) -> None:
+        for path in (self._job_path(job_id), self._results_path(job_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def create_job_store() -> JobStore:
+    if JOB_STORE_BACKEND == "file":
+        return FileJobStore(JOB_STORE_DIR)
+    if JOB_STORE_BACKEND == "memory":
+        return InMemoryJobStore()
+    raise ValueError(f"Unknown JOB_STORE_BACKEND: {JOB_STORE_BACKEND!r} (expected 'memory' or 'file').")
+
+
+class JobManager:
+    """
+    Runs PDF analysis jobs in a pool of background asyncio workers.
+    Each worker extracts the pages of one job and fans them out through the shared scheduler;
+    every finished page is appended to the store right away, so results can be streamed.
+    """
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS,
+                 result_ttl_seconds: float = JOB_RESULT_TTL_SECONDS):
+        self.store = store
+        self.workers = max(1, workers)
+        self.result_ttl_seconds = result_ttl_seconds
+        self._queue: "asyncio.Queue[tuple]" = asyncio.Queue()
+        self._worker_tasks: List[asyncio.Task] = []
+        self._events: Dict[str, asyncio.Event] = {}  # Будит стримы результатов при новых данных
+
+    async def start(self) -> None:
+        # Задания, прерванные перезапуском, не продолжаем: часть результатов уже записана
+        for job in self.store.list_jobs():
+            if job["status"] not in FINISHED_STATUSES:
+                if job.get("source_path"):
+                    remove_spooled_file(job["source_path"])
+                self.store.update(job["job_id"], status="failed", finished_at=time.time(),
+                                  detail="Job was interrupted by a server restart. Please resubmit the file.")
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def _notify(self, job_id: str) -> None:
+        event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _purge_expired(self) -> None:
+        if self.result_ttl_seconds <= 0:
+            return
+        now = time.time()
+        for job in self.store.list_jobs():
+            finished_at = job.get("finished_at")
+            if finished_at and now - finished_at > self.result_ttl_seconds:
+                self.store.delete(job["job_id"])
+                self._events.pop(job["job_id"], None)
+
+    async def submit(self, filename: str, pdf_path: str) -> str:
+        """Queues analysis of a spooled upload; the job takes ownership of the file at `pdf_path`."""
+        self._purge_expired()
+        job_id = uuid.uuid4().hex
+        self.store.create({
+            "job_id": job_id,
+            "filename": filename,
+            "status": "queued",
+            "pages_done": 0,
+            "total_pages": 0,
+            "errors_found": 0,
+            "detail": None,
+            "document_id": None,
+            "source_path": pdf_path,
+            "created_at": time.time(),
+            "finished_at": None,
+        })
+        await self._queue.put((job_id, pdf_path))
+        return job_id
+
+    async def _worker(self) -> None:
+        while True:
+            job_id, pdf_path = await self._queue.get()
+            source_kept = False
+            try:
+                source_kept = await self._run_job(job_id, pdf_path)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                print(f"Job {job_id} failed: {detail}")
+                self.store.update(job_id, status="failed", detail=detail, finished_at=time.time())
+            finally:
+                if not source_kept: # После успешного задания файлом владеет сессия документа
+                    remove_spooled_file(pdf_path)
+                self._queue.task_done()
+                self._notify(job_id)
+
+    async def _run_job(self, job_id: str, pdf_path: str) -> bool:
+        """Returns True when the spooled file was handed over to the document session."""
+        self.store.update(job_id, status="running")
+        self._notify(job_id)
+
+        progress = {"pages_done": 0, "errors_found": 0}
+        # Для сессии документа (скачивание исправленного PDF без повторной загрузки)
+        session_pages: Dict[int, str] = {}
+        session_errors: Dict[int, List[dict]] = {}
+
+        async def on_page_result(page_info: dict, errors_on_page_raw: list) -> None:
+            page_num = page_info.get("page_number", 0)
+            details = [detail.model_dump() for detail in to_error_details(errors_on_page_raw, page_num)]
+            session_pages[page_num] = page_info.get("text", "")
+            session_errors[page_num] = details
+            self.store.append_page_result(job_id, {
+                "page_number": page_num,
+                "errors": details,
+            })
+            progress["pages_done"] += 1
+            progress["errors_found"] += len(details)
+            self.store.update(job_id, **progress)
+            self._notify(job_id)
+
+        def on_total_pages(total_pages: int) -> None:
+            self.store.update(job_id, total_pages=total_pages)
+            self._notify(job_id)
+
+        results = await gemini_scheduler.analyze_pages(
+            # Принятое задание ждет свободный процесс пула, а не падает с 503, как синхронный запрос
+            aiter_pdf_pages(pdf_path, on_total_pages=on_total_pages, wait_for_slot=True), on_page_result=on_page_result
+        )
+        if not results:
+            raise HTTPException(status_code=422, detail="Could not extract any text from the PDF or the PDF is empty.")
+        document_id = document_store.save(
+            self.store.get(job_id)["filename"],
+            [{"page_number": page_num, "text": session_pages[page_num]} for page_num in sorted(session_pages)],
+            [error for page_num in sorted(session_errors) for error in session_errors[page_num]],
+            source_path=pdf_path,
+        )
+        self.store.update(job_id, status="completed", total_pages=len(results), document_id=document_id,
+                          finished_at=time.time())
+        return True
+
+    def get_status(self, job_id: str) -> dict:
+        job = self.store.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+        return job
+
+    async def iter_page_results(self, job_id: str, poll_interval: float = 1.0) -> AsyncIterator[dict]:
+        """Yields page result records as they appear until the job is finished."""
+        offset = 0
+        while True:
+            event = self._events.setdefault(job_id, asyncio.Event())
+            records = self.store.get_page_results(job_id, offset)
+            for record in records:
+                yield record
+            offset += len(records)
+
+            job = self.store.get(job_id)
+            if job is None or job["status"] in FINISHED_STATUSES:
+                # Добираем то, что успело записаться между чтением результатов и статуса
+                for record in self.store.get_page_results(job_id, offset):
+                    yield record
+                # Новых данных не будет: будим остальные стримы задания и удаляем событие
+                self._notify(job_id)
+                return
+            try:
+                await asyncio.wait_for(event.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+job_manager = JobManager(create_job_store())
@@ -0,0 +1,202 @@
+import re
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import LOCAL_WORDLIST_PATH, LOCAL_MAX_EDIT_DISTANCE
+
+# Частые опечатки, которые ловятся без словаря
+COMMON_MISSPELLINGS = {
+    "teh": "the", "hte": "the", "adn": "and", "nad": "and", "taht": "that", "thier": "their",
+    "recieve": "receive", "recieved": "received", "reciept": "receipt", "beleive": "believe",
+    "belive": "believe", "acheive": "achieve", "acheived": "achieved", "wich": "which",
+    "becuase": "because", "becasue": "because", "untill": "until", "occured": "occurred",
+    "occurence": "occurrence", "occurrance": "occurrence", "seperate": "separate",
+    "seperately": "separately", "definately": "definitely", "definitly": "definitely",
+    "goverment": "government", "enviroment": "environment", "accomodate": "accommodate",
+    "accomodation": "accommodation", "adress": "address", "agressive": "aggressive",
+    "apparantly": "apparently", "arguement": "argument", "calender": "calendar",
+    "commited": "committed", "comittee": "committee", "concious": "conscious",
+    "existance": "existence", "foward": "forward", "freind": "friend", "garantee": "guarantee",
+    "gaurd": "guard", "immediatly": "immediately", "independant": "independent",
+    "knowlege": "knowledge", "liason": "liaison", "libary": "library", "maintainance": "maintenance",
+    "millenium": "millennium", "neccessary": "necessary", "necessery": "necessary",
+    "noticable": "noticeable", "occassion": "occasion", "persistant": "persistent",
+    "posession": "possession", "prefered": "preferred", "publically": "publicly",
+    "realy": "really", "recomend": "recommend", "refered": "referred", "relevent": "relevant",
+    "resistence": "resistance", "responsability": "responsibility", "succesful": "successful",
+    "sucessful": "successful", "suprise": "surprise", "tommorow": "tomorrow", "tomorow": "tomorrow",
+    "truely": "truly", "wierd": "weird", "writting": "writing", "alot": "a lot",
+}
+
+# Повторы, которые бывают правильными: в английском ("had had", "that that")
+# и в немецком (артикль и относительное местоимение: "das das", "die die", "Sie sie")
+_ALLOWED_REPEATS = {"had", "that", "der", "die", "das", "den", "dem", "des", "sie"}
+
+_WORD_RE = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)?")
+
+
+def _match_case(word: str, correction: str) -> str:
+    if word.isupper() and len(word) > 1:
+        return correction.upper()
+    if word[:1].isupper():
+        return correction[:1].upper() + correction[1:]
+    return correction
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Damerau-Levenshtein (optimal string alignment) distance; returns max_distance + 1 if it is larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+def _deletes(word: str, max_distance: int) -> set:
+    """All strings obtained from `word` by deleting up to `max_distance` characters."""
+    result = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {item[:i] + item[i + 1:] for item in frontier for i in range(len(item)) if len(item) > 1}
+        result |= frontier
+    return result
+
+
+class _Rule:
+    def __init__(self, pattern: str, error_type: str, explanation: str,
+                 correct: Callable[[re.Match], Optional[str]], flags: int = 0):
+        self.regex = re.compile(pattern, flags)
+        self.error_type = error_type
+        self.explanation = explanation
+        self.correct = correct
+
+
+def _fix_repeat(match: re.Match) -> Optional[str]:
+    if match.group(1).lower() in _ALLOWED_REPEATS:
+        return None
+    return match.group(1)
+
+
+PUNCTUATION_RULES = [
+    # Только в пределах строки: повтор через перенос строки нельзя исправить одной заменой
+    _Rule(r"\b([^\W\d_]+)[ \t]+\1\b", "grammar", "Repeated word.", _fix_repeat, re.IGNORECASE),
+    _Rule(r"([^\W\d_]+)[ \t]+([,;:!?])(?=\s|$)", "punctuation", "No space is needed before a punctuation mark.",
+          lambda m: m.group(1) + m.group(2)),
+    _Rule(r"([^\W\d_]{2,})([,;])([^\W\d_]{2,})", "punctuation", "A space is needed after a comma or semicolon.",
+          lambda m: f"{m.group(1)}{m.group(2)} {m.group(3)}"),
+    _Rule(r"([^\W\d_]+)([,;:])\2+", "punctuation", "Doubled punctuation mark.",
+          lambda m: m.group(1) + m.group(2)),
+    _Rule(r"(?<![\w'’-])i(?=\s+(?:am|have|had|was|will|would|can|could|think|do|did|should)\b)\s+(\w+)",
+          "grammar", "The pronoun 'I' is always capitalized.", lambda m: f"I {m.group(1)}"),
+]
+
+
+class LocalProofreader:
+    """
+    Pure-Python proofreader used as the offline backend and as a pre-pass in front of the model.
+    - spelling: a table of common misspellings plus, when a wordlist is configured, a
+      symspell-style index (deletes of every dictionary word up to `max_edit_distance`)
+      that suggests the most frequent dictionary word within that edit distance;
+    - punctuation and simple grammar: the regex rules in PUNCTUATION_RULES.
+    Errors have the same raw shape as the model's (see ai_service.to_error_details).
+    """
+
+    def __init__(self, wordlist_path: str = LOCAL_WORDLIST_PATH, max_edit_distance: int = LOCAL_MAX_EDIT_DISTANCE,
+                 misspellings: Dict[str, str] = COMMON_MISSPELLINGS):
+        self.max_edit_distance = max(0, max_edit_distance)
+        self.misspellings = misspellings
+        self._frequencies: Dict[str, int] = {}
+        self._deletes_index: Dict[str, List[str]] = {}
+        if wordlist_path:
+            self.load_wordlist(wordlist_path)
+
+    def load_wordlist(self, path: str) -> None:
+        with open(path, encoding="utf-8") as wordlist:
+            for line in wordlist:
+                parts = line.split()
+                if not parts:
+                    continue
+                word = parts[0].lower()
+                frequency = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 1
+                self._frequencies[word] = self._frequencies.get(word, 0) + frequency
+        for word in self._frequencies:
+            for variant in _deletes(word, self.max_edit_distance):
+                self._deletes_index.setdefault(variant, []).append(word)
+        print(f"Local proofreader: loaded {len(self._frequencies)} words from '{path}'.")
+
+    def suggest(self, word: str) -> Optional[str]:
+        """Returns the correction of a lowercase word, or None if it is known or has no close match."""
+        if word in self.misspellings:
+            return self.misspellings[word]
+        if not self._frequencies or word in self._frequencies or self.max_edit_distance == 0:
+            return None
+        best: Optional[Tuple[int, int, str]] = None
+        for variant in _deletes(word, self.max_edit_distance):
+            for candidate in self._deletes_index.get(variant, ()):
+                distance = edit_distance(word, candidate, self.max_edit_distance)
+                if distance > self.max_edit_distance:
+                    continue
+                key = (distance, -self._frequencies[candidate], candidate)
+                if best is None or key < best:
+                    best = key
+        return best[2] if best else None
+
+    def count_words(self, text: str) -> int:
+        return sum(1 for _ in _WORD_RE.finditer(text))
+
+    def _spelling_errors(self, text: str) -> Iterator[Tuple[str, str]]:
+        for match in _WORD_RE.finditer(text):
+            word = match.group(0)
+            lower = word.lower()
+            if lower in self.misspellings:
+                yield word, _match_case(word, self.misspellings[lower])
+                continue
+            # Слова с заглавной буквой (имена, аббревиатуры) по словарю не проверяем
+            if len(word) < 4 or not word.islower():
+                continue
+            suggestion = self.suggest(lower)
+            if suggestion is not None and suggestion != lower:
+                yield word, suggestion
+
+    def check_text(self, text: str, page_number: int) -> List[dict]:
+        errors = []
+        for word, correction in self._spelling_errors(text):
+            errors.append({
+                "page_number": page_number,
+                "original_snippet": word,
+                "corrected_snippet": correction,
+                "error_type": "spelling",
+                "explanation": f"Possible misspelling of '{correction}'.",
+            })
+        for rule in PUNCTUATION_RULES:
+            for match in rule.regex.finditer(text):
+                correction = rule.correct(match)
+                if correction is None or correction == match.group(0):
+                    continue
+                errors.append({
+                    "page_number": page_number,
+                    "original_snippet": match.group(0),
+                    "corrected_snippet": correction,
+                    "error_type": rule.error_type,
+                    "explanation": rule.explanation,
+                })
+        return errors
+
+    def analyze_batch(self, batch: List[dict]) -> Dict[int, list]:
+        errors_by_page: Dict[int, list] = {}
+        for page in batch:
+            page_number = page.get("page_number")
+            errors_by_page.setdefault(page_number, []).extend(self.check_text(page.get("text", ""), page_number))
+        return errors_by_page
+
+
+local_proofreader = LocalProofreader()
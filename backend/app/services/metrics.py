@@ -0,0 +1,102 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Границы корзин в секундах: от миллисекунд (кэш, разбор JSON) до минут (большие PDF, повторы)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "pdf_checker_stage_seconds",
+    "Time spent in a pipeline stage (upload_read, count_pages, extract, model_call, parse_response, render, ...).",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "pdf_checker_http_request_seconds",
+    "HTTP request latency by route.",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+PAGES = Counter(
+    "pdf_checker_pages_total",
+    "Analyzed pages by where the result came from (model, cache, prepass, empty).",
+    ["source"],
+)
+MODEL_REQUESTS = Counter(
+    "pdf_checker_model_requests_total",
+    "Model requests by outcome (ok, retry, failed, fallback).",
+    ["outcome"],
+)
+TOKENS_SENT = Counter(
+    "pdf_checker_model_tokens_sent_total",
+    "Estimated prompt tokens sent to the model (~4 characters per token).",
+)
+MODEL_ERRORS = Counter(
+    "pdf_checker_model_errors_total",
+    "Service-level model failures returned as pseudo-errors, by error_type (AI_Parse_Error, AI_Blocked_Request, ...).",
+    ["error_type"],
+)
+CACHE_EVENTS = Counter(
+    "pdf_checker_cache_events_total",
+    "Analysis cache events (memory_hit, disk_hit, miss, store).",
+    ["event"],
+)
+POOL_IN_FLIGHT = Gauge(
+    "pdf_checker_process_pool_in_flight",
+    "Process pool tasks running or waiting for a worker.",
+)
+POOL_QUEUE_WAIT_SECONDS = Histogram(
+    "pdf_checker_process_pool_queue_wait_seconds",
+    "Time a process pool task waited for a free worker.",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+POOL_TASK_FAILURES = Counter(
+    "pdf_checker_process_pool_task_failures_total",
+    "Process pool tasks that did not complete, by reason (rejected, timeout, error).",
+    ["stage", "reason"],
+)
+
+# Длительности этапов текущего HTTP-запроса (для заголовка Server-Timing); None вне запроса
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        # Параллельные вызовы одного этапа суммируются: это время работы, а не время ожидания клиента
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Times the enclosed block as `stage` (also when it raises)."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started_at)
+
+
+def count_model_errors(errors: list) -> None:
+    """Counts service errors (see ai_service.is_service_error) by type."""
+    for err in errors:
+        MODEL_ERRORS.labels(str(err.get("error_type", ""))).inc()
+
+
+def start_request_timings() -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def format_server_timing(timings: Dict[str, float], total_seconds: float) -> str:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def render_metrics() -> tuple:
+    """Returns (body, content type) in the Prometheus text exposition format."""
+    return generate_latest(), CONTENT_TYPE_LATEST
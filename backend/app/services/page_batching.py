@@ -0,0 +1,82 @@
+from typing import List
+
+# Грубая оценка: ~4 символа на токен для европейских языков
+CHARS_PER_TOKEN = 4
+
+# Разделители в порядке предпочтения: абзац, строка, пробел
+_SPLIT_SEPARATORS = ("\n\n", "\n", " ")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _split_text(text: str, max_chars: int) -> List[str]:
+    parts = []
+    while len(text) > max_chars:
+        # Нет ни одного разделителя (например, длинная строка без пробелов) - режем жестко
+        cut = max_chars
+        for separator in _SPLIT_SEPARATORS:
+            position = text.rfind(separator, 0, max_chars)
+            if position > 0:
+                cut = position + len(separator)  # Разделитель остается в конце первой части
+                break
+        parts.append(text[:cut])
+        text = text[cut:]
+    parts.append(text)
+    return parts
+
+
+def split_oversized_page(page: dict, max_tokens: int) -> List[dict]:
+    """
+    Splits a page that does not fit into `max_tokens` into chunks on paragraph, line or word
+    boundaries. All chunks keep the page number of the original page.
+    """
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    return [
+        {"page_number": page.get("page_number", 0), "text": chunk}
+        for chunk in _split_text(page.get("text", ""), max_chars)
+        if chunk.strip()
+    ]
+
+
+class PagePacker:
+    """
+    Groups consecutive pages into batches that fit into `token_budget` (and at most `max_pages`
+    pages), so sparse pages (slides, forms) share one model request.
+    Pages larger than the budget are split and each chunk goes out as its own batch.
+    Works incrementally: `add` returns the batches completed by the new page, `flush` the rest.
+    A `token_budget` <= 0 disables batching (one page per batch, no splitting).
+    """
+
+    def __init__(self, token_budget: int, max_pages: int = 10):
+        self.token_budget = token_budget
+        self.max_pages = max(1, max_pages)
+        self._current: List[dict] = []
+        self._current_tokens = 0
+
+    def add(self, page: dict) -> List[List[dict]]:
+        if self.token_budget <= 0:
+            return [[page]]
+
+        page_tokens = estimate_tokens(page.get("text", ""))
+        ready: List[List[dict]] = []
+        if page_tokens > self.token_budget:
+            ready.extend(self.flush())
+            ready.extend([chunk] for chunk in split_oversized_page(page, self.token_budget))
+            return ready
+
+        if self._current and (self._current_tokens + page_tokens > self.token_budget
+                              or len(self._current) >= self.max_pages):
+            ready.extend(self.flush())
+        self._current.append(page)
+        self._current_tokens += page_tokens
+        return ready
+
+    def flush(self) -> List[List[dict]]:
+        if not self._current:
+            return []
+        batch = self._current
+        self._current = []
+        self._current_tokens = 0
+        return [batch]
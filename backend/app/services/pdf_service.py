@@ -1,16 +1,53 @@
+import mmap
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
 import fitz  # PyMuPDF
 from fastapi import HTTPException
 
-def extract_text_and_pages_from_pdf(file_content: bytes) -> list:
-    """Extracts text page by page from a PDF."""
-    pages_content = []
+@contextmanager
+def open_pdf_mapped(path: str):
+    """
+    Opens a PDF file through a read-only memory mapping: the bytes are not copied into the
+    Python heap, the OS pages them in as MuPDF reads them.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    doc = None
+    try:
+        doc = fitz.open(stream=view, filetype="pdf")
+        yield doc
+    finally:
+        if doc is not None:
+            doc.close()
+        view.release()  # Без этого mmap нельзя закрыть (BufferError)
+        mapped.close()
+
+
+def count_pdf_pages(path: str) -> int:
+    """Returns the number of pages of the PDF file at `path`."""
+    try:
+        with open_pdf_mapped(path) as doc:
+            return doc.page_count
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error extracting text from PDF: {str(e)}")
+
+
+def iter_pages_from_pdf(path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+    """Yields {'page_number': int, 'text': str} one page at a time (0-based `start`/`stop` page indexes)."""
     try:
-        doc = fitz.open(stream=file_content, filetype="pdf")
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text = page.get_text("text")
-            pages_content.append({"page_number": page_num + 1, "text": text})
-        return pages_content
+        with open_pdf_mapped(path) as doc:
+            stop = doc.page_count if stop is None else min(stop, doc.page_count)
+            for page_index in range(start, stop):
+                page = doc.load_page(page_index)
+                yield {"page_number": page_index + 1, "text": page.get_text("text")}
+    except HTTPException:
+        raise
     except Exception as e:
-        # Consider more specific logging/error handling
-        raise HTTPException(status_code=500, detail=f"Error extracting text from PDF: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error extracting text from PDF: {str(e)}")
+
+
+def extract_page_range(path: str, start: int, stop: Optional[int] = None) -> List[dict]:
+    """Extracts pages [start, stop) of the PDF file at `path`; used to extract a large document in chunks."""
+    return list(iter_pages_from_pdf(path, start, stop))
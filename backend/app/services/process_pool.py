@@ -0,0 +1,188 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from app.core.config import PROCESS_POOL_WORKERS, PROCESS_POOL_MAX_QUEUED, PROCESS_POOL_TASK_TIMEOUT_SECONDS
+from app.services.metrics import POOL_IN_FLIGHT, POOL_QUEUE_WAIT_SECONDS, POOL_TASK_FAILURES, observe_stage
+
+
+class StageError(Exception):
+    """
+    Carries an HTTPException raised inside a worker process back to the server.
+    HTTPException itself does not survive pickling (its args are empty).
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class StageHTTPException(HTTPException):
+    """
+    An HTTPException raised by the stage itself (e.g. a PDF that cannot be parsed), as opposed to
+    failures of the pool: rejection (503), timeout (504) or a crashed worker.
+    """
+
+
+def _run_stage(fn: Callable, args: tuple) -> tuple:
+    """Executed in a worker process. Returns (result, seconds spent running)."""
+    started_at = time.perf_counter()
+    try:
+        result = fn(*args)
+    except HTTPException as e:
+        raise StageError(e.status_code, str(e.detail))
+    return result, time.perf_counter() - started_at
+
+
+class _StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "avg_seconds": self.total_seconds / self.count if self.count else 0.0,
+            "max_seconds": self.max_seconds,
+            # Время ожидания свободного процесса = общее время - время работы в процессе
+            "avg_queue_wait_seconds": (self.total_seconds - self.run_seconds) / self.count if self.count else 0.0,
+        }
+
+
+class CpuTaskPool:
+    """
+    Runs CPU-bound stages (PyMuPDF extraction, ReportLab rendering) in a process pool,
+    so one large PDF does not block the event loop for every other request.
+    - at most `max_workers` tasks run at once, at most `max_queued` more wait for a process;
+      beyond that new tasks are rejected with 503 (backpressure), unless the caller asks to wait
+      for a free slot (`wait=True`, used by batch analysis);
+    - a task that does not finish within `task_timeout` seconds fails with 504. The worker
+      process itself cannot be interrupted and keeps its slot until the task ends.
+    Latency per stage is collected in `stats()` and exported to Prometheus (see metrics.py).
+    """
+
+    def __init__(self, max_workers: int = PROCESS_POOL_WORKERS,
+                 max_queued: int = PROCESS_POOL_MAX_QUEUED,
+                 task_timeout: float = PROCESS_POOL_TASK_TIMEOUT_SECONDS):
+        self.max_workers = max(1, max_workers)
+        self.max_queued = max(0, max_queued)
+        self.task_timeout = task_timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._in_flight = 0
+        self._slot_freed: Optional[asyncio.Event] = None
+        self._stats: Dict[str, _StageStats] = {}
+
+    def start(self) -> None:
+        if self._executor is None:
+            # spawn: не наследуем состояние event loop и gRPC-клиента родительского процесса
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _stage_stats(self, stage: str) -> _StageStats:
+        return self._stats.setdefault(stage, _StageStats())
+
+    def _release_slot(self, _future) -> None:
+        self._in_flight -= 1
+        POOL_IN_FLIGHT.set(self._in_flight)
+        if self._slot_freed is not None:
+            self._slot_freed.set()
+            self._slot_freed = None
+
+    def _is_full(self) -> bool:
+        return self._in_flight >= self.max_workers + self.max_queued
+
+    async def wait_for_slot(self) -> None:
+        """Waits until a new task would be accepted instead of rejected."""
+        while self._is_full():
+            if self._slot_freed is None:
+                self._slot_freed = asyncio.Event()
+            await self._slot_freed.wait()
+
+    async def run(self, stage: str, fn: Callable, *args, wait: bool = False):
+        """
+        Runs `fn(*args)` in a worker process. `fn` and its arguments must be picklable.
+        With `wait=True` a full pool delays the task instead of rejecting it with 503.
+        """
+        stats = self._stage_stats(stage)
+        if wait:
+            # Между проверкой и занятием слота нет await, поэтому слот не перехватят
+            await self.wait_for_slot()
+        if self._is_full():
+            stats.rejected += 1
+            POOL_TASK_FAILURES.labels(stage, "rejected").inc()
+            raise HTTPException(status_code=503, detail=f"Server is busy ({stage}): too many documents in progress, please retry later.")
+
+        self.start()
+        loop = asyncio.get_running_loop()
+        submitted_at = time.perf_counter()
+        try:
+            future = loop.run_in_executor(self._executor, _run_stage, fn, args)
+        except BrokenProcessPool:
+            # Процесс пула упал (например, OOM) - пересоздаем пул и пробуем еще раз
+            self.shutdown()
+            self.start()
+            future = loop.run_in_executor(self._executor, _run_stage, fn, args)
+        self._in_flight += 1
+        POOL_IN_FLIGHT.set(self._in_flight)
+        # Слот освобождается, когда задача реально завершилась в процессе, а не по таймауту
+        future.add_done_callback(self._release_slot)
+
+        try:
+            result, run_seconds = await asyncio.wait_for(asyncio.shield(future), timeout=self.task_timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            POOL_TASK_FAILURES.labels(stage, "timeout").inc()
+            raise HTTPException(status_code=504, detail=f"Processing took too long ({stage}): exceeded {self.task_timeout:.0f}s.")
+        except StageError as e:
+            stats.errors += 1
+            POOL_TASK_FAILURES.labels(stage, "error").inc()
+            raise StageHTTPException(status_code=e.status_code, detail=e.detail)
+        except BrokenProcessPool:
+            stats.errors += 1
+            POOL_TASK_FAILURES.labels(stage, "error").inc()
+            self.shutdown()
+            raise HTTPException(status_code=500, detail=f"Worker process crashed during {stage}.")
+        except Exception:
+            stats.errors += 1
+            POOL_TASK_FAILURES.labels(stage, "error").inc()
+            raise
+
+        elapsed = time.perf_counter() - submitted_at
+        stats.count += 1
+        stats.total_seconds += elapsed
+        stats.max_seconds = max(stats.max_seconds, elapsed)
+        stats.run_seconds += run_seconds
+        observe_stage(stage, elapsed)
+        POOL_QUEUE_WAIT_SECONDS.labels(stage).observe(max(0.0, elapsed - run_seconds))
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queued": self.max_queued,
+            "in_flight": self._in_flight,
+            "stages": {stage: stats.as_dict() for stage, stats in self._stats.items()},
+        }
+
+
+cpu_pool = CpuTaskPool()
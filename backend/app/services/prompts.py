@@ -0,0 +1,111 @@
+from string import Formatter
+from typing import Dict, List, Optional
+
+# Общая системная инструкция: передается модели один раз при создании клиента,
+# а не повторяется в тексте каждого запроса
+PROOFREADING_SYSTEM_INSTRUCTION = """
+Analyze the text you are given for grammatical, spelling, punctuation, and stylistic errors.
+The text consists of one or more pages. Each page starts with a marker <<<PAGE N>>> and ends with <<<END PAGE N>>>, where N is the page number.
+The markers are not part of the text; never report them as errors.
+For each error found, provide the following information in a JSON array of objects. Each object must contain the following keys:
+- "page_number": The number N of the page (from its <<<PAGE N>>> marker) on which the error occurs.
+- "original_snippet": The exact short text fragment with the error (up to 15 words).
+- "corrected_snippet": The corrected version of the fragment.
+- "error_type": The type of error (e.g., "spelling", "grammar", "style", "punctuation").
+- "explanation": A brief explanation of the error.
+
+Example of one object in the JSON array:
+{
+"page_number": 1,
+"original_snippet": "He go to the store.",
+"corrected_snippet": "He goes to the store.",
+"error_type": "grammar",
+"explanation": "Incorrect verb tense. 'Go' should be 'goes' for third-person singular present."
+}
+
+If no errors are found, return an empty JSON array [].
+Please return ONLY the JSON array. Do not add any other text, comments, or explanations outside the JSON structure.
+""".strip()
+
+# Схема ответа для режима JSON (response_mime_type="application/json")
+ERRORS_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "page_number": {"type": "integer"},
+            "original_snippet": {"type": "string"},
+            "corrected_snippet": {"type": "string"},
+            "error_type": {"type": "string"},
+            "explanation": {"type": "string"},
+        },
+        "required": ["page_number", "original_snippet", "corrected_snippet", "error_type", "explanation"],
+    },
+}
+
+
+class PromptTemplate:
+    """
+    A versioned prompt: the static instructions live in `system_instruction`, and `template`
+    (str.format syntax, plain `{field}` placeholders only) holds only the per-call part.
+    The template is parsed once into literal and field parts, so rendering is a single join.
+    """
+
+    def __init__(self, name: str, version: str, template: str,
+                 system_instruction: str = PROOFREADING_SYSTEM_INSTRUCTION,
+                 response_schema: Optional[dict] = None):
+        self.name = name
+        self.version = version
+        self.template = template
+        self.system_instruction = system_instruction
+        self.response_schema = response_schema
+        self._parts = [(literal, field) for literal, field, _, _ in Formatter().parse(template)]
+
+    def render(self, **values) -> str:
+        pieces = []
+        for literal, field in self._parts:
+            pieces.append(literal)
+            if field is not None:
+                pieces.append(str(values[field]))
+        return "".join(pieces)
+
+
+class PromptRegistry:
+    """Prompt templates built once at import time and looked up by name."""
+
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+
+    def register(self, prompt: PromptTemplate) -> PromptTemplate:
+        if prompt.name in self._templates:
+            raise ValueError(f"Prompt '{prompt.name}' is already registered.")
+        self._templates[prompt.name] = prompt
+        return prompt
+
+    def get(self, name: str) -> PromptTemplate:
+        return self._templates[name]
+
+    def all(self) -> List[PromptTemplate]:
+        return list(self._templates.values())
+
+    @property
+    def version(self) -> str:
+        """Combined version of all templates (part of the analysis cache key)."""
+        return "+".join(f"{name}.{prompt.version}" for name, prompt in sorted(self._templates.items()))
+
+
+prompt_registry = PromptRegistry()
+
+PAGE_PROMPT = prompt_registry.register(PromptTemplate(
+    name="page",
+    version="2",
+    template="<<<PAGE {page_number}>>>\n{text}\n<<<END PAGE {page_number}>>>",
+    response_schema=ERRORS_RESPONSE_SCHEMA,
+))
+
+BATCH_PROMPT = prompt_registry.register(PromptTemplate(
+    name="batch",
+    version="2",
+    template="The text consists of several pages ({page_numbers}).\n{pages_block}",
+    response_schema=ERRORS_RESPONSE_SCHEMA,
+))
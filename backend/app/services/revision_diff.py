@@ -0,0 +1,241 @@
+import bisect
+import hashlib
+import re
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from app.services.ai_service import is_service_error
+from app.services.analysis_cache import normalize_text
+
+_PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+_LINE_RE = re.compile(r"[^\n]+")
+# Строка, заканчивающаяся концом предложения (с возможной закрывающей кавычкой или скобкой)
+_SENTENCE_END_RE = re.compile(r"[.!?:;][\"'”’»)\]]*$")
+
+Span = Tuple[int, int]
+
+
+def _strip_span(text: str, start: int, end: int) -> Span:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def split_unit_spans(text: str) -> List[Span]:
+    """
+    Splits page text into units and returns their (start, end) offsets: paragraphs separated by
+    blank lines. PyMuPDF often emits no blank lines; such pages are split into runs of lines that
+    end a sentence or end early (a heading, the last line of a paragraph), so a unit never stops
+    in the middle of a sentence.
+    """
+    blocks = []
+    start = 0
+    for match in _PARAGRAPH_BREAK_RE.finditer(text):
+        blocks.append(_strip_span(text, start, match.start()))
+        start = match.end()
+    blocks.append(_strip_span(text, start, len(text)))
+    blocks = [span for span in blocks if span[0] < span[1]]
+    if len(blocks) > 1:
+        return blocks
+
+    lines = [_strip_span(text, match.start(), match.end()) for match in _LINE_RE.finditer(text)]
+    lines = [span for span in lines if span[0] < span[1]]
+    if not lines:
+        return []
+    longest = max(end - start for start, end in lines)
+    spans = []
+    unit_start = None
+    for start, end in lines:
+        if unit_start is None:
+            unit_start = start
+        if _SENTENCE_END_RE.search(text[start:end]) or end - start < longest / 2:
+            spans.append((unit_start, end))
+            unit_start = None
+    if unit_start is not None:
+        spans.append((unit_start, lines[-1][1]))
+    return spans
+
+
+def split_paragraphs(text: str) -> List[str]:
+    """Page text split into units (see split_unit_spans)."""
+    return [text[start:end] for start, end in split_unit_spans(text)]
+
+
+def unit_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def locate_errors(text: str, spans: Sequence[Span], errors: List[dict],
+                  allowed: Optional[Sequence[bool]] = None) -> Tuple[List[Tuple[dict, Span]], List[dict]]:
+    """
+    Finds the snippet of every error in the page text and maps it to the units it covers.
+    Whitespace in a snippet matches any whitespace, so snippets may cross line breaks and unit
+    boundaries. Errors with the same snippet take its occurrences in order, as the correction
+    engine applies them. With `allowed`, only occurrences inside allowed units count.
+    Returns ([(error, (first unit, last unit))], errors whose snippet was not found).
+    """
+    starts = [start for start, _ in spans]
+    ends = [end for _, end in spans]
+    occurrences: Dict[str, List[Span]] = {}
+    used: Dict[str, int] = {}
+    located = []
+    not_found = []
+    for error in errors:
+        tokens = (error.get("original_snippet") or "").split()
+        if not tokens:
+            not_found.append(error)
+            continue
+        key = " ".join(tokens)
+        if key not in occurrences:
+            candidates = []
+            for match in re.finditer(r"\s+".join(re.escape(token) for token in tokens), text):
+                first = bisect.bisect_right(ends, match.start())
+                last = bisect.bisect_left(starts, match.end()) - 1
+                if first > last:
+                    continue
+                if allowed is None or all(allowed[first:last + 1]):
+                    candidates.append((first, last))
+            occurrences[key] = candidates
+        candidates = occurrences[key]
+        if not candidates:
+            not_found.append(error)
+            continue
+        index = used.get(key, 0)
+        used[key] = index + 1
+        located.append((error, candidates[min(index, len(candidates) - 1)]))
+    return located, not_found
+
+
+def join_unit_runs(text: str, spans: Sequence[Span], selected: Sequence[bool]) -> str:
+    """
+    Returns the selected units for analysis: adjacent selected units are kept together exactly as
+    they appear on the page (with their line breaks), separate runs are joined with a blank line.
+    """
+    runs = []
+    run_start = run_end = None
+    for (start, end), is_selected in zip(spans, selected):
+        if is_selected:
+            if run_start is None:
+                run_start = start
+            run_end = end
+        elif run_start is not None:
+            runs.append(text[run_start:run_end])
+            run_start = None
+    if run_start is not None:
+        runs.append(text[run_start:run_end])
+    return "\n\n".join(runs)
+
+
+class RevisionDiff:
+    """
+    Diffs a new revision of a document against a previously analyzed one (a document session)
+    at unit (paragraph or sentence) granularity.
+    - errors of the previous analysis are located in the page text and attributed to the unit,
+      or the run of adjacent units, that their snippet covers;
+    - errors are kept per occurrence: a paragraph repeated on several pages carries forward
+      only the errors found in its own occurrence, never the errors of all copies;
+    - unchanged units of the new revision reuse those errors, renumbered to the new page; an
+      error spanning several units is reused only where the whole run is unchanged, otherwise
+      the units it touched are analyzed again;
+    - only changed units are sent to the model, as whole paragraphs or sentences.
+    Errors whose snippet was not found in the page text are carried over only when the whole page
+    is unchanged. Pages of the previous analysis with service errors (AI_*) are not reused.
+    """
+
+    def __init__(self, previous_session: dict):
+        # Цепочка хэшей единиц (одна или несколько подряд) -> ошибки каждого ее вхождения
+        self._occurrences: Dict[Tuple[str, ...], List[List[dict]]] = {}
+        self._chains_by_first_unit: Dict[str, List[Tuple[str, ...]]] = {}
+        self._chained_units = set()  # Единицы, на которые приходится ошибка, захватившая соседнюю единицу
+        self._page_errors: Dict[Tuple[str], List[List[dict]]] = {}  # (хэш страницы,) -> ненайденные ошибки каждого вхождения
+        self._taken: Dict[tuple, int] = {}
+        self._carried: Dict[int, List[dict]] = {}
+        self.units_total = 0
+        self.units_reused = 0
+        self.errors_carried_forward = 0
+
+        errors_by_page: Dict[int, List[dict]] = {}
+        for error in previous_session["errors"]:
+            errors_by_page.setdefault(error.get("page_number"), []).append(error)
+
+        for page in previous_session["pages"]:
+            page_errors = errors_by_page.get(page.get("page_number"), [])
+            if any(is_service_error(error) for error in page_errors):
+                continue  # Страница не была проанализирована нормально - ничего не переиспользуем
+            text = page.get("text", "")
+            spans = split_unit_spans(text)
+            hashes = [unit_hash(text[start:end]) for start, end in spans]
+            located, not_found = locate_errors(text, spans, page_errors)
+            errors_by_span: Dict[Span, List[dict]] = {}
+            for error, covered in located:
+                errors_by_span.setdefault(covered, []).append(error)
+            for index, unit in enumerate(hashes):
+                self._occurrences.setdefault((unit,), []).append(errors_by_span.pop((index, index), []))
+            for (first, last), errors in errors_by_span.items():
+                chain = tuple(hashes[first:last + 1])
+                self._occurrences.setdefault(chain, []).append(errors)
+                chains = self._chains_by_first_unit.setdefault(chain[0], [])
+                if chain not in chains:
+                    chains.append(chain)
+                self._chained_units.update(chain)
+            self._page_errors.setdefault((unit_hash(text),), []).append(not_found)
+
+    def _take(self, store: Dict[tuple, List[List[dict]]], key: tuple) -> List[dict]:
+        """Errors of the next occurrence of `key` (the last one repeats if the new revision has more)."""
+        taken_key = (id(store), key)
+        index = self._taken.get(taken_key, 0)
+        self._taken[taken_key] = index + 1
+        occurrences = store[key]
+        return occurrences[min(index, len(occurrences) - 1)]
+
+    def prepare_page(self, page_info: dict) -> dict:
+        """
+        Returns the page reduced to its changed units (empty text when nothing changed)
+        and remembers the errors carried forward for it.
+        """
+        page_num = page_info.get("page_number", 0)
+        page_text = page_info.get("text", "")
+        spans = split_unit_spans(page_text)
+        hashes = [unit_hash(page_text[start:end]) for start, end in spans]
+        reused = [(unit,) in self._occurrences for unit in hashes]
+        carried: List[dict] = []
+
+        in_chain = [False] * len(hashes)
+        for index, unit in enumerate(hashes):
+            for chain in self._chains_by_first_unit.get(unit, ()):
+                end = index + len(chain)
+                if tuple(hashes[index:end]) == chain and all(reused[index:end]):
+                    carried.extend(self._take(self._occurrences, chain))
+                    in_chain[index:end] = [True] * len(chain)
+        for index, unit in enumerate(hashes):
+            if reused[index] and unit in self._chained_units and not in_chain[index]:
+                # Ошибка прошлой ревизии захватывала соседнюю единицу, которой здесь нет: анализируем заново
+                reused[index] = False
+        for index, unit in enumerate(hashes):
+            if reused[index]:
+                carried.extend(self._take(self._occurrences, (unit,)))
+        page_key = (unit_hash(page_text),)
+        if all(reused) and page_key in self._page_errors:
+            carried.extend(self._take(self._page_errors, page_key))
+
+        carried = [{**error, "page_number": page_num} for error in carried]
+        self.units_total += len(hashes)
+        self.units_reused += sum(reused)
+        self._carried[page_num] = carried
+        self.errors_carried_forward += len(carried)
+        return {"page_number": page_num, "text": join_unit_runs(page_text, spans, [not flag for flag in reused])}
+
+    async def filter_pages(self, pages: AsyncIterator[dict]) -> AsyncIterator[dict]:
+        async for page_info in pages:
+            yield self.prepare_page(page_info)
+
+    def carried_errors(self, page_number: int) -> List[dict]:
+        return self._carried.get(page_number, [])
+
+    def stats(self) -> dict:
+        return {
+            "paragraphs_total": self.units_total,
+            "paragraphs_reused": self.units_reused,
+            "errors_carried_forward": self.errors_carried_forward,
+        }
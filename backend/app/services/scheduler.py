@@ -0,0 +1,251 @@
+import asyncio
+import random
+import time
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+from app.core.config import (
+    GEMINI_MAX_CONCURRENCY, GEMINI_PER_REQUEST_CONCURRENCY,
+    GEMINI_REQUESTS_PER_MINUTE, GEMINI_RATE_LIMIT_BURST,
+    GEMINI_MAX_RETRIES, GEMINI_BACKOFF_BASE_SECONDS, GEMINI_BACKOFF_MAX_SECONDS,
+    GEMINI_BATCH_TOKEN_BUDGET, GEMINI_BATCH_MAX_PAGES,
+)
+from app.services.ai_service import analyze_batch_with_gemini, is_retryable_ai_error
+from app.services.analysis_cache import AnalysisCache, analysis_cache
+from app.services.analyzers import analyzer
+from app.services.metrics import MODEL_REQUESTS, PAGES
+from app.services.page_batching import PagePacker
+
+# Анализ пачки страниц: [{'page_number', 'text'}, ...] -> {page_number: [error, ...]}
+AnalyzeBatchFn = Callable[[List[dict]], Awaitable[Dict[int, list]]]
+# Результат пачки, запрос которой окончательно не удался: (batch, exception) -> {page_number: [error, ...]}
+FallbackBatchFn = Callable[[List[dict], BaseException], Awaitable[Dict[int, list]]]
+# Предварительная проверка страницы без модели: ошибки страницы или None, если нужна модель
+PrepassFn = Callable[[dict], Optional[list]]
+# Вызывается, как только страница полностью проанализирована: (page_info, errors)
+PageResultCallback = Callable[[dict, list], Awaitable[None]]
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, at most `capacity` tokens stored.
+    Used to keep the request rate within the Gemini quota.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:  # Ограничение отключено
+            return
+        async with self._lock:  # Ожидающие обслуживаются по очереди (FIFO)
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class GeminiScheduler:
+    """
+    Fans page analysis out to Gemini concurrently.
+    Consecutive sparse pages are packed into one request up to `batch_token_budget`
+    (see page_batching.py); oversized pages are split into several requests.
+    - `max_concurrency` caps in-flight model calls across all requests of the process;
+    - `per_request_concurrency` caps in-flight calls of a single `analyze_pages` call,
+      so one huge document cannot take every slot;
+    - a token bucket keeps the request rate within the quota;
+    - 429/5xx errors are retried with exponential backoff and full jitter.
+    Pages for which the optional `prepass_fn` returns errors, and pages found in the optional
+    `cache`, skip the model (and the quota) completely. If a request fails for good (a
+    non-retryable error or retries exhausted), the optional `fallback_batch_fn` supplies the
+    results of its pages instead of failing the whole document.
+    Results are returned in the order of the input pages.
+    """
+
+    def __init__(self, analyze_batch_fn: AnalyzeBatchFn = analyze_batch_with_gemini,
+                 max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                 per_request_concurrency: int = GEMINI_PER_REQUEST_CONCURRENCY,
+                 requests_per_minute: float = GEMINI_REQUESTS_PER_MINUTE,
+                 burst: int = GEMINI_RATE_LIMIT_BURST,
+                 max_retries: int = GEMINI_MAX_RETRIES,
+                 backoff_base: float = GEMINI_BACKOFF_BASE_SECONDS,
+                 backoff_max: float = GEMINI_BACKOFF_MAX_SECONDS,
+                 cache: Optional[AnalysisCache] = None,
+                 batch_token_budget: int = GEMINI_BATCH_TOKEN_BUDGET,
+                 batch_max_pages: int = GEMINI_BATCH_MAX_PAGES,
+                 prepass_fn: Optional[PrepassFn] = None,
+                 fallback_batch_fn: Optional[FallbackBatchFn] = None):
+        self.analyze_batch_fn = analyze_batch_fn
+        self.prepass_fn = prepass_fn
+        self.fallback_batch_fn = fallback_batch_fn
+        self.cache = cache
+        self.batch_token_budget = batch_token_budget
+        self.batch_max_pages = batch_max_pages
+        self.per_request_concurrency = max(1, per_request_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._global_semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._bucket = TokenBucket(requests_per_minute / 60.0, burst)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # Full jitter: равномерно из [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _call_with_fallback(self, batch: List[dict]) -> Dict[int, list]:
+        try:
+            return await self._call_with_retries(batch)
+        except Exception as e:
+            MODEL_REQUESTS.labels("failed").inc()
+            if self.fallback_batch_fn is None:
+                raise
+            MODEL_REQUESTS.labels("fallback").inc()
+            return await self.fallback_batch_fn(batch, e)
+
+    async def _call_with_retries(self, batch: List[dict]) -> Dict[int, list]:
+        page_label = ", ".join(str(page.get("page_number")) for page in batch)
+        attempt = 0
+        while True:
+            await self._bucket.acquire()
+            try:
+                async with self._global_semaphore:
+                    errors_by_page = await self.analyze_batch_fn(batch)
+                MODEL_REQUESTS.labels("ok").inc()
+                return errors_by_page
+            except Exception as e:
+                if not is_retryable_ai_error(e):
+                    raise
+                if attempt >= self.max_retries:
+                    status_code = 429 if getattr(e, "code", None) == 429 else 503
+                    raise HTTPException(
+                        status_code=status_code,
+                        detail=f"AI service unavailable after {attempt + 1} attempts (Page {page_label}): {str(e)}"
+                    )
+                delay = self._backoff_delay(attempt)
+                print(f"Scheduler: retryable AI error on page {page_label} ({e}); retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                MODEL_REQUESTS.labels("retry").inc()
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def analyze_pages(self, pages: Union[Iterable[dict], AsyncIterable[dict]],
+                            per_request_concurrency: Optional[int] = None,
+                            on_page_result: Optional[PageResultCallback] = None) -> List[Tuple[int, list]]:
+        """
+        Analyzes pages ({'page_number': int, 'text': str}) concurrently.
+        `pages` may be a list or an async iterator: requests start as soon as pages arrive,
+        while later pages are still being extracted.
+        Returns (page_number, raw errors) pairs in input order; pages without text get [].
+        `on_page_result` is awaited for every page as soon as its analysis is complete
+        (pages finish out of order).
+        """
+        request_semaphore = asyncio.Semaphore(max(1, per_request_concurrency or self.per_request_concurrency))
+        packer = PagePacker(self.batch_token_budget, self.batch_max_pages)
+        results: List[Tuple[int, list]] = []
+        pending: Dict[int, int] = {}  # page_number -> индекс в `results` для страниц, которые уйдут в модель
+        pending_texts: Dict[int, str] = {}  # Текст нужен только до записи в кэш
+        # Сколько запросов еще должно завершиться для каждой страницы (большие страницы режутся на части)
+        requests_left: Dict[int, int] = {}
+        tasks: List[asyncio.Task] = []
+        failures: List[BaseException] = []
+
+        async def complete_page(page_num: int) -> None:
+            errors = results[pending[page_num]][1]
+            page_text = pending_texts.pop(page_num, "")
+            if self.cache is not None:
+                await self.cache.put(page_text, errors)
+            if on_page_result is not None:
+                await on_page_result({"page_number": page_num, "text": page_text}, errors)
+
+        async def analyze_batch(batch: List[dict]) -> None:
+            try:
+                async with request_semaphore:
+                    errors_by_page = await self._call_with_fallback(batch)
+            except BaseException as e:
+                failures.append(e)
+                raise
+            for page_num, errors in errors_by_page.items():
+                if page_num in pending:
+                    # Части разрезанной страницы дописываются к одному и тому же списку
+                    results[pending[page_num]][1].extend(errors)
+            for page_num in {chunk.get("page_number") for chunk in batch}:
+                requests_left[page_num] -= 1
+                if requests_left[page_num] == 0:
+                    await complete_page(page_num)
+
+        def schedule(batches: List[List[dict]]) -> None:
+            for batch in batches:
+                for chunk in batch:
+                    requests_left[chunk.get("page_number")] = requests_left.get(chunk.get("page_number"), 0) + 1
+                tasks.append(asyncio.create_task(analyze_batch(batch)))
+
+        try:
+            async for page_info in _aiter(pages):
+                if failures:  # Какой-то запрос уже упал - дальше документ не читаем
+                    raise failures[0]
+                page_text = page_info.get("text", "")
+                page_num = page_info.get("page_number", 0)
+                results.append((page_num, []))
+                if not page_text.strip():  # Пустые страницы в модель не отправляем
+                    PAGES.labels("empty").inc()
+                    if on_page_result is not None:
+                        await on_page_result(page_info, results[-1][1])
+                    continue
+                if self.prepass_fn is not None:
+                    prepass_errors = self.prepass_fn(page_info)
+                    if prepass_errors is not None:  # Страница полностью проверена локально
+                        PAGES.labels("prepass").inc()
+                        results[-1] = (page_num, prepass_errors)
+                        if on_page_result is not None:
+                            await on_page_result(page_info, prepass_errors)
+                        continue
+                if self.cache is not None:
+                    cached = await self.cache.get(page_text, page_num)
+                    if cached is not None:
+                        PAGES.labels("cache").inc()
+                        results[-1] = (page_num, cached)
+                        if on_page_result is not None:
+                            await on_page_result(page_info, cached)
+                        continue
+                PAGES.labels("model").inc()
+                pending[page_num] = len(results) - 1
+                pending_texts[page_num] = page_text
+                schedule(packer.add(page_info))
+            schedule(packer.flush())
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # При первой ошибке отменяем остальные запросы, чтобы не тратить квоту впустую
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return results
+
+
+async def _aiter(pages: Union[Iterable[dict], AsyncIterable[dict]]) -> AsyncIterator[dict]:
+    if hasattr(pages, "__aiter__"):
+        async for page in pages:
+            yield page
+    else:
+        for page in pages:
+            yield page
+
+
+# Общий на процесс планировщик: глобальный лимит и квота распределяются между всеми запросами
+gemini_scheduler = GeminiScheduler(
+    analyze_batch_fn=analyzer.analyze_batch,
+    prepass_fn=analyzer.prepass,
+    fallback_batch_fn=analyzer.fallback_batch,
+    cache=analysis_cache,
+)
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import tempfile
+from urllib.parse import parse_qsl
+from typing import AsyncIterator, Callable, Collection, Dict, List, Optional
+
+import aiofiles
+from fastapi import HTTPException, Request
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from app.core.config import MAX_UPLOAD_BYTES, MAX_PDF_PAGES, UPLOAD_SPOOL_DIR, PDF_EXTRACT_CHUNK_PAGES
+from app.services.metrics import stage_timer
+from app.services.pdf_service import count_pdf_pages, extract_page_range
+from app.services.process_pool import cpu_pool
+
+# Текстовые поля формы (document_id, errors_json_str, ...): тот же лимит, что у Starlette по умолчанию
+FORM_FIELD_MAX_BYTES = 1024 * 1024
+# Запас на поля и заголовки частей сверх размера файлов при проверке Content-Length
+FORM_OVERHEAD_BYTES = 4 * FORM_FIELD_MAX_BYTES
+
+
+class SpooledUpload:
+    """A file part of a multipart request, written straight to a temporary file while it is received."""
+
+    def __init__(self, field: str, filename: str, content_type: str, path: str, max_bytes: int = 0):
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        self.path: Optional[str] = path  # None, когда файл передан дальше (заданию, сессии документа)
+        self.size = 0
+        self.max_bytes = max_bytes  # 0 - без лимита; `check_file` может изменить лимит для своей части
+
+    def detach(self) -> str:
+        """Hands the file over to the caller, who becomes responsible for removing it."""
+        path, self.path = self.path, None
+        return path
+
+
+class StreamedForm:
+    """Text fields and spooled files of a request parsed by `stream_upload_form`."""
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.files: List[SpooledUpload] = []
+
+    def get_file(self, field: str) -> Optional[SpooledUpload]:
+        return next((upload for upload in self.files if upload.field == field), None)
+
+    def get_files(self, field: str) -> List[SpooledUpload]:
+        return [upload for upload in self.files if upload.field == field]
+
+    def remove_files(self) -> None:
+        for upload in self.files:
+            if upload.path:
+                remove_spooled_file(upload.detach())
+
+
+class _PartState:
+    def __init__(self):
+        self.headers: Dict[bytes, bytes] = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.name = ""
+        self.is_file = False
+        self.upload: Optional[SpooledUpload] = None
+        self.out = None  # aiofiles-файл для частей с файлом
+        self.value = bytearray()
+
+
+async def stream_upload_form(
+    request: Request,
+    file_fields: Collection[str],
+    max_files: int = 1,
+    max_file_bytes: int = MAX_UPLOAD_BYTES,
+    max_request_bytes: Optional[int] = None,
+    check_file: Optional[Callable[[SpooledUpload], None]] = None,
+) -> StreamedForm:
+    """
+    Parses a multipart/form-data request body while it is being received. File parts go straight
+    to temporary files in UPLOAD_SPOOL_DIR (one copy on disk, nothing held in RAM), so limits are
+    enforced as the bytes arrive:
+    - a Content-Length above `max_request_bytes` is rejected with 413 before the body is read;
+    - a file part above `max_file_bytes` (or a body above `max_request_bytes`) stops reading with 413;
+    - `check_file` is called as soon as the headers of a file part arrive, e.g. to reject a wrong
+      content type with 400 before its data is received, or to set another `max_bytes` for it.
+    Only file parts named in `file_fields` are accepted. The caller removes the files with
+    `StreamedForm.remove_files` (files handed over with `SpooledUpload.detach` are skipped).
+    URL-encoded forms (text fields only) are accepted as well.
+    """
+    if max_request_bytes is None:
+        max_request_bytes = max_files * max_file_bytes + FORM_OVERHEAD_BYTES if max_file_bytes > 0 else 0
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    content_length = request.headers.get("content-length", "")
+    if max_request_bytes > 0 and content_length.isdigit() and int(content_length) > max_request_bytes:
+        raise HTTPException(status_code=413, detail=f"Request is too large. Maximum size is {max_request_bytes} bytes.")
+
+    form = StreamedForm()
+    if not content_type:
+        return form  # Запрос без тела: пустая форма
+    if content_type == b"application/x-www-form-urlencoded":
+        body = bytearray()
+        async for chunk in request.stream():
+            body += chunk
+            if len(body) > FORM_OVERHEAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Request is too large. Maximum size is {FORM_OVERHEAD_BYTES} bytes.")
+        form.fields.update(parse_qsl(body.decode("latin-1"), keep_blank_values=True))
+        return form
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data or application/x-www-form-urlencoded request.")
+
+    events: list = []  # Колбэки парсера синхронные: события копятся и обрабатываются после каждого куска
+    parser = MultipartParser(boundary, {
+        "on_part_begin": lambda: events.append(("part_begin", b"")),
+        "on_part_data": lambda data, start, end: events.append(("part_data", data[start:end])),
+        "on_part_end": lambda: events.append(("part_end", b"")),
+        "on_header_field": lambda data, start, end: events.append(("header_field", data[start:end])),
+        "on_header_value": lambda data, start, end: events.append(("header_value", data[start:end])),
+        "on_header_end": lambda: events.append(("header_end", b"")),
+        "on_headers_finished": lambda: events.append(("headers_finished", b"")),
+    })
+    part = _PartState()
+
+    async def process_events() -> None:
+        nonlocal part
+        for event, data in events:
+            if event == "part_begin":
+                part = _PartState()
+            elif event == "header_field":
+                part.header_field += data
+            elif event == "header_value":
+                part.header_value += data
+            elif event == "header_end":
+                part.headers[part.header_field.lower()] = part.header_value
+                part.header_field, part.header_value = b"", b""
+            elif event == "headers_finished":
+                _, options = parse_options_header(part.headers.get(b"content-disposition", b""))
+                part.name = options.get(b"name", b"").decode("utf-8", errors="replace")
+                part.is_file = b"filename" in options
+                if not part.is_file:
+                    continue
+                filename = options[b"filename"].decode("utf-8", errors="replace")
+                if not filename:
+                    continue  # Пустое поле выбора файла: браузер отправляет часть без имени и данных
+                if part.name not in file_fields:
+                    raise HTTPException(status_code=400, detail=f"Unexpected file field '{part.name}'.")
+                if len(form.files) >= max_files:
+                    raise HTTPException(status_code=413, detail=f"Too many files. Maximum is {max_files} files per request.")
+                extension = os.path.splitext(filename)[1].lower()
+                fd, path = tempfile.mkstemp(suffix=extension if extension in (".pdf", ".zip") else "",
+                                            dir=UPLOAD_SPOOL_DIR or None)
+                os.close(fd)
+                part.upload = SpooledUpload(part.name, filename,
+                                            part.headers.get(b"content-type", b"").decode("latin-1"), path,
+                                            max_bytes=max_file_bytes)
+                form.files.append(part.upload)
+                if check_file is not None:
+                    check_file(part.upload)
+                part.out = await aiofiles.open(path, "wb")
+            elif event == "part_data":
+                if part.upload is not None:
+                    part.upload.size += len(data)
+                    max_bytes = part.upload.max_bytes
+                    if max_bytes > 0 and part.upload.size > max_bytes:
+                        raise HTTPException(status_code=413, detail=f"File '{part.upload.filename}' is too large. Maximum upload size is {max_bytes} bytes.")
+                    await part.out.write(data)
+                elif not part.is_file:
+                    if len(part.value) + len(data) > FORM_FIELD_MAX_BYTES:
+                        raise HTTPException(status_code=413, detail=f"Form field '{part.name}' is too large.")
+                    part.value += data
+            elif event == "part_end":
+                if part.out is not None:
+                    await part.out.close()
+                    part.out = None
+                    if part.upload.size == 0:
+                        raise HTTPException(status_code=422, detail=f"The uploaded file '{part.upload.filename}' is empty.")
+                elif part.name and not part.is_file:
+                    form.fields[part.name] = part.value.decode("utf-8", errors="replace")
+        events.clear()
+
+    received = 0
+    try:
+        with stage_timer("upload_read"):
+            async for chunk in request.stream():
+                received += len(chunk)
+                if max_request_bytes > 0 and received > max_request_bytes:
+                    raise HTTPException(status_code=413, detail=f"Request is too large. Maximum size is {max_request_bytes} bytes.")
+                parser.write(chunk)
+                await process_events()
+            parser.finalize()
+            await process_events()
+    except MultipartParseError:
+        form.remove_files()
+        raise HTTPException(status_code=400, detail="There was an error parsing the multipart form.")
+    except BaseException:
+        form.remove_files()
+        raise
+    finally:
+        if part.out is not None:
+            await part.out.close()
+    return form
+
+
+def remove_spooled_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def aiter_pdf_pages(path: str, chunk_pages: int = PDF_EXTRACT_CHUNK_PAGES,
+                          max_pages: int = MAX_PDF_PAGES,
+                          on_total_pages: Optional[Callable[[int], None]] = None,
+                          wait_for_slot: bool = False) -> AsyncIterator[dict]:
+    """
+    Yields pages of a spooled PDF as they are extracted. Pages are extracted in chunks in the
+    process pool, and the next chunk is extracted while the current one is being consumed,
+    so analysis of page 1 starts before the rest of the document is parsed.
+    `on_total_pages` is called with the page count before the first page is yielded.
+    With `wait_for_slot` a busy process pool delays extraction instead of failing it with 503.
+    The prefetched chunk always waits for a slot, so a request never rejects itself with its own
+    prefetch (e.g. with a single-slot pool).
+    """
+    total_pages = await cpu_pool.run("count_pages", count_pdf_pages, path, wait=wait_for_slot)
+    if max_pages > 0 and total_pages > max_pages:
+        raise HTTPException(status_code=413, detail=f"PDF has too many pages ({total_pages}). Maximum is {max_pages} pages.")
+    if on_total_pages is not None:
+        on_total_pages(total_pages)
+
+    chunk_pages = max(1, chunk_pages)
+    starts = range(0, total_pages, chunk_pages)
+    next_chunk = None
+    try:
+        for position, start in enumerate(starts):
+            current_chunk = next_chunk or asyncio.ensure_future(
+                cpu_pool.run("extract", extract_page_range, path, start, start + chunk_pages, wait=wait_for_slot)
+            )
+            next_chunk = None
+            if position + 1 < len(starts):
+                next_start = starts[position + 1]
+                next_chunk = asyncio.ensure_future(
+                    cpu_pool.run("extract", extract_page_range, path, next_start, next_start + chunk_pages, wait=True)
+                )
+            for page in await current_chunk:
+                yield page
+    finally:
+        if next_chunk is not None:
+            if next_chunk.done():
+                if not next_chunk.cancelled():
+                    next_chunk.exception()  # Ошибка уже не нужна, но должна быть "получена"
+            else:
+                next_chunk.cancel()
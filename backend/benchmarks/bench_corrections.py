@@ -0,0 +1,71 @@
+"""
+Benchmark of applying corrections to a page: the old repeated `str.replace` scans
+versus the single-pass Aho-Corasick engine.
+
+Run from the backend directory:
+    python -m benchmarks.bench_corrections --words 20000 --corrections 100 1000 5000
+"""
+import argparse
+import random
+import time
+
+from app.services.correction_engine import apply_corrections
+
+VOCABULARY = [
+    "contract", "party", "agreement", "shall", "payment", "term", "notice", "service", "provider",
+    "customer", "liability", "section", "schedule", "invoice", "period", "written", "consent", "data",
+]
+
+
+def legacy_apply_corrections_to_text(original_text: str, errors: list) -> str:
+    """The previous implementation: one `in` + `str.replace(..., 1)` scan per error."""
+    corrected_text = original_text
+    sorted_errors = sorted(errors, key=lambda e: len(e.get("original_snippet", "")), reverse=True)
+    for error in sorted_errors:
+        original_snippet = error.get("original_snippet")
+        corrected_snippet = error.get("corrected_snippet")
+        if original_snippet and corrected_snippet and original_snippet != "N/A":
+            if original_snippet in corrected_text:
+                corrected_text = corrected_text.replace(original_snippet, corrected_snippet, 1)
+    return corrected_text
+
+
+def make_page(words: int, corrections: int, rng: random.Random) -> tuple:
+    tokens = [rng.choice(VOCABULARY) for _ in range(words)]
+    errors = []
+    # Каждая ошибка - уникальный "опечатанный" токен в случайной позиции страницы
+    for index, position in enumerate(rng.sample(range(words), min(corrections, words))):
+        typo = f"{tokens[position]}x{index}"
+        tokens[position] = typo
+        errors.append({"page_number": 1, "original_snippet": typo, "corrected_snippet": f"fixed{index}"})
+    return " ".join(tokens), errors
+
+
+def measure(fn, *args, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=20000, help="Words per page.")
+    parser.add_argument("--corrections", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=3, help="Best-of-N timing.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'corrections':>12} {'legacy, ms':>12} {'engine, ms':>12} {'speedup':>9}")
+    for corrections in args.corrections:
+        text, errors = make_page(args.words, corrections, rng)
+        legacy = measure(legacy_apply_corrections_to_text, text, errors, repeat=args.repeat)
+        engine = measure(apply_corrections, text, errors, repeat=args.repeat)
+        print(f"{corrections:>12} {legacy * 1000:>12.1f} {engine * 1000:>12.1f} {legacy / engine:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
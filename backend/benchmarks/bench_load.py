@@ -0,0 +1,314 @@
+"""
+Load benchmark of the full pipeline against the local fake Gemini model (no quota is spent).
+For every concurrency level it uploads a synthetic PDF to /api/v1/analyze-pdf/ `--requests`
+times, then downloads the corrected PDF for every analyzed document via
+/api/v1/download-corrected-pdf/, and reports per phase:
+throughput, p50/p95/p99 latency, server-side stage latency (from the Server-Timing header:
+upload_read, count_pages, extract, model_call, parse_response, render, ...) and peak RSS of
+the server process and of the process pool workers. Memory is reported per phase, not per
+stage: stages of concurrent requests overlap in the server process and run in shared pool
+workers, so RSS cannot be attributed to one stage.
+
+The app runs in-process (httpx ASGI transport), configured through environment variables
+before it is imported; inputs and the fake model are seeded, so runs are comparable.
+Save a run with --output and compare later runs with --baseline (exit code 1 on regression).
+
+Run from the backend directory:
+    python -m benchmarks.bench_load --pages 20 --concurrency 1 4 16 --requests 16 --output baseline.json
+    python -m benchmarks.bench_load --pages 20 --concurrency 1 4 16 --requests 16 --baseline baseline.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.synthetic_pdf import canned_errors_for_typos, make_synthetic_pdf
+
+PERCENTILES = (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))
+# Метрики, по которым сравнение с базовым прогоном считает регрессию (больше = хуже)
+COMPARED_LATENCIES = ("p50", "p95")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linear interpolation between closest ranks."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower, upper = math.floor(position), math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    summary = {name: percentile(values, q) for name, q in PERCENTILES}
+    summary["mean"] = sum(values) / len(values) if values else 0.0
+    summary["max"] = max(values) if values else 0.0
+    return summary
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """'extract;dur=12.5, model_call;dur=300.1' -> {'extract': 0.0125, 'model_call': 0.3001} (seconds)."""
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if name and duration:
+            timings[name] = float(duration) / 1000
+    return timings
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class RssSampler:
+    """Samples RSS of this process and of its child processes (pool workers) while a phase runs. Linux only."""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak_server = 0
+        self.peak_workers = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> None:
+        self.peak_server = max(self.peak_server, _rss_bytes(os.getpid()))
+        workers = sum(_rss_bytes(child.pid) for child in multiprocessing.active_children())
+        self.peak_workers = max(self.peak_workers, workers)
+
+    async def _run(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self) -> "RssSampler":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self.sample()
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        if not sys.platform.startswith("linux"):
+            return {"server_mb": None, "pool_workers_mb": None}
+        return {"server_mb": self.peak_server / 2 ** 20, "pool_workers_mb": self.peak_workers / 2 ** 20}
+
+
+async def run_phase(concurrency: int, jobs: list, send) -> dict:
+    """Runs `send(job)` for every job with at most `concurrency` in flight and summarizes the results."""
+    latencies: List[float] = []
+    stage_samples: Dict[str, List[float]] = {}
+    failures: Dict[str, int] = {}
+    outputs: list = []
+    queue = list(reversed(jobs))
+
+    async def worker() -> None:
+        while queue:
+            job = queue.pop()
+            started_at = time.perf_counter()
+            response = await send(job)
+            latencies.append(time.perf_counter() - started_at)
+            if response.status_code >= 400:
+                failures[str(response.status_code)] = failures.get(str(response.status_code), 0) + 1
+                continue
+            outputs.append(response)
+            for stage, seconds in parse_server_timing(response.headers.get("server-timing")).items():
+                if stage != "total":
+                    stage_samples.setdefault(stage, []).append(seconds)
+
+    async with RssSampler() as rss:
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall_seconds = time.perf_counter() - started_at
+
+    return {
+        "requests": len(jobs),
+        "failures": failures,
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(jobs) / wall_seconds if wall_seconds else 0.0,
+        "latency_seconds": summarize(latencies),
+        "stage_seconds": {stage: summarize(samples) for stage, samples in sorted(stage_samples.items())},
+        "peak_rss": rss.as_dict(),
+        "_outputs": outputs,
+    }
+
+
+async def run_benchmark(args, pdf_bytes: bytes) -> dict:
+    from app.main import app  # Импорт после настройки окружения (см. configure_environment)
+
+    async def analyze(_job) -> httpx.Response:
+        files = {"file": ("synthetic.pdf", pdf_bytes, "application/pdf")}
+        return await client.post("/api/v1/analyze-pdf/", files=files)
+
+    async def download(document_id: str) -> httpx.Response:
+        data = {"document_id": document_id, "output_mode": args.output_mode}
+        return await client.post("/api/v1/download-corrected-pdf/", data=data)
+
+    levels = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # Прогрев: запуск процессов пула и первые импорты не должны попадать в замеры
+            for _ in range(args.warmup):
+                warmup = await analyze(None)
+                warmup.raise_for_status()
+                (await download(warmup.json()["document_id"])).raise_for_status()
+
+            for concurrency in args.concurrency:
+                analyze_result = await run_phase(concurrency, list(range(args.requests)), analyze)
+                document_ids = [response.json()["document_id"] for response in analyze_result.pop("_outputs")]
+                analyze_result["pages_per_second"] = analyze_result["throughput_rps"] * args.pages
+                download_result = await run_phase(concurrency, document_ids, download)
+                download_result.pop("_outputs")
+                levels.append({"concurrency": concurrency, "analyze": analyze_result, "download": download_result})
+                print_level(levels[-1])
+    return {"config": describe_config(args), "levels": levels}
+
+
+def configure_environment(args) -> None:
+    """The app reads its configuration at import time, so this must run before importing it."""
+    os.environ.update({
+        "GEMINI_FAKE_MODE": "true",
+        "GEMINI_FAKE_LATENCY_SECONDS": str(args.fake_latency),
+        "GEMINI_FAKE_RATE_LIMIT_ERROR_RATE": str(args.fake_rate_limit_error_rate),
+        "GEMINI_FAKE_SERVER_ERROR_RATE": str(args.fake_server_error_rate),
+        "GEMINI_FAKE_CANNED_ERRORS": json.dumps(canned_errors_for_typos()),
+        "GEMINI_FAKE_SEED": str(args.seed),
+        "ANALYZER_BACKEND": args.analyzer,
+        "METRICS_SERVER_TIMING": "true",
+        # Повторяющийся документ не должен обслуживаться из кэша, если не задано --cache
+        "ANALYSIS_CACHE_MAX_ENTRIES": os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "2048") if args.cache else "0",
+        "ANALYSIS_CACHE_DB_PATH": "",
+    })
+    # Квота и паузы между повторами не моделируются, если их не задали явно
+    os.environ.setdefault("GEMINI_REQUESTS_PER_MINUTE", "0")
+    os.environ.setdefault("GEMINI_BACKOFF_BASE_SECONDS", "0.05")
+    os.environ.setdefault("DOCUMENT_SESSION_MAX_DOCUMENTS", str(max(500, args.requests * len(args.concurrency) + args.warmup)))
+
+
+def describe_config(args) -> dict:
+    settings = {key: value for key, value in vars(args).items()
+                if key not in ("output", "baseline", "tolerance", "min_delta_ms")}
+    settings["environment"] = {
+        key: os.environ.get(key) for key in (
+            "GEMINI_REQUESTS_PER_MINUTE", "GEMINI_MAX_CONCURRENCY", "GEMINI_PER_REQUEST_CONCURRENCY",
+            "GEMINI_BATCH_TOKEN_BUDGET", "GEMINI_BATCH_MAX_PAGES", "PROCESS_POOL_WORKERS", "PDF_EXTRACT_CHUNK_PAGES",
+        )
+    }
+    settings["python"] = platform.python_version()
+    settings["platform"] = platform.platform()
+    settings["cpu_count"] = os.cpu_count()
+    return settings
+
+
+def _format_rss(value: Optional[float]) -> str:
+    return f"{value:.0f}" if value is not None else "n/a"
+
+
+def print_level(level: dict) -> None:
+    print(f"\nconcurrency {level['concurrency']}")
+    print(f"  {'phase':<9} {'req/s':>8} {'p50, ms':>9} {'p95, ms':>9} {'p99, ms':>9} {'failed':>7} "
+          f"{'rss MB':>7} {'pool MB':>8}")
+    for phase in ("analyze", "download"):
+        result = level[phase]
+        latency = result["latency_seconds"]
+        print(f"  {phase:<9} {result['throughput_rps']:>8.2f} {latency['p50'] * 1000:>9.1f} "
+              f"{latency['p95'] * 1000:>9.1f} {latency['p99'] * 1000:>9.1f} {sum(result['failures'].values()):>7} "
+              f"{_format_rss(result['peak_rss']['server_mb']):>7} {_format_rss(result['peak_rss']['pool_workers_mb']):>8}")
+        for stage, summary in result["stage_seconds"].items():
+            print(f"    {stage:<16} p50 {summary['p50'] * 1000:>8.1f}  p95 {summary['p95'] * 1000:>8.1f}  "
+                  f"p99 {summary['p99'] * 1000:>8.1f} ms")
+
+
+def compare_with_baseline(current: dict, baseline: dict, tolerance: float, min_delta_seconds: float) -> List[str]:
+    """
+    Returns human-readable regressions of `current` against `baseline` beyond `tolerance`.
+    Latency changes smaller than `min_delta_seconds` are ignored (noise of sub-millisecond stages).
+    """
+    regressions = []
+    differing = [key for key in ("pages", "words_per_page", "requests", "fake_latency", "analyzer", "output_mode")
+                 if current["config"].get(key) != baseline["config"].get(key)]
+    if differing:
+        print(f"\nWARNING: runs differ in {', '.join(differing)}; the comparison may not be meaningful.")
+
+    baseline_levels = {level["concurrency"]: level for level in baseline["levels"]}
+    print(f"\n{'concurrency':>11} {'phase':<9} {'metric':<22} {'baseline':>10} {'current':>10} {'change':>8}")
+    for level in current["levels"]:
+        previous = baseline_levels.get(level["concurrency"])
+        if previous is None:
+            continue
+        for phase in ("analyze", "download"):
+            rows = [("throughput_rps", previous[phase]["throughput_rps"], level[phase]["throughput_rps"], False)]
+            for name in COMPARED_LATENCIES:
+                rows.append((f"latency {name}", previous[phase]["latency_seconds"][name],
+                             level[phase]["latency_seconds"][name], True))
+            for stage, summary in level[phase]["stage_seconds"].items():
+                if stage in previous[phase]["stage_seconds"]:
+                    rows.append((f"{stage} p95", previous[phase]["stage_seconds"][stage]["p95"], summary["p95"], True))
+            for metric, before, after, higher_is_worse in rows:
+                change = (after - before) / before if before else 0.0
+                if higher_is_worse:
+                    regressed = change > tolerance and after - before > min_delta_seconds
+                else:
+                    regressed = change < -tolerance
+                marker = "  REGRESSION" if regressed else ""
+                print(f"{level['concurrency']:>11} {phase:<9} {metric:<22} {before:>10.4f} {after:>10.4f} {change:>+7.1%}{marker}")
+                if regressed:
+                    regressions.append(f"concurrency {level['concurrency']} {phase} {metric}: {before:.4f} -> {after:.4f} ({change:+.1%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20, help="Pages of the synthetic PDF.")
+    parser.add_argument("--words-per-page", type=int, default=300, help="Text density of the synthetic PDF.")
+    parser.add_argument("--typo-rate", type=float, default=0.01, help="Share of words replaced by misspellings.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=16, help="Documents analyzed (and downloaded) per concurrency level.")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured documents before the first level.")
+    parser.add_argument("--fake-latency", type=float, default=0.2, help="Latency of one fake model call, seconds.")
+    parser.add_argument("--fake-rate-limit-error-rate", type=float, default=0.0, help="Share of fake calls failing with 429.")
+    parser.add_argument("--fake-server-error-rate", type=float, default=0.0, help="Share of fake calls failing with 503.")
+    parser.add_argument("--analyzer", choices=("gemini", "hybrid", "local"), default="gemini")
+    parser.add_argument("--output-mode", choices=("rebuild", "inplace"), default="rebuild")
+    parser.add_argument("--cache", action="store_true", help="Keep the analysis cache enabled (repeated documents hit it).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Relative change reported as a regression.")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore latency changes smaller than this.")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    pdf_bytes = make_synthetic_pdf(args.pages, args.words_per_page, args.typo_rate, args.seed)
+    results = asyncio.run(run_benchmark(args, pdf_bytes))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file), args.tolerance, args.min_delta_ms / 1000)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
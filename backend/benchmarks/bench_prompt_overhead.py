@@ -0,0 +1,110 @@
+"""
+Micro-benchmark of the per-call overhead of one model request, excluding the network:
+the old way (new genai.GenerativeModel + full instruction f-string + markdown fence
+stripping on every page) versus the shared client with precompiled prompt templates
+and JSON response mode.
+
+Run from the backend directory:
+    python -m benchmarks.bench_prompt_overhead --calls 20000 --page-chars 3000
+"""
+import argparse
+import json
+import time
+
+import google.generativeai as genai
+
+from app.core.config import GEMINI_MODEL_NAME
+from app.services.ai_service import GeminiClient, parse_errors_json
+from app.services.prompts import PAGE_PROMPT
+
+SAMPLE_ERRORS = [
+    {"page_number": 1, "original_snippet": "He go to the store.", "corrected_snippet": "He goes to the store.",
+     "error_type": "grammar", "explanation": "Incorrect verb tense."},
+] * 5
+
+
+def legacy_prepare_call(text_to_analyze: str, original_page_number: int):
+    """The previous implementation: a new model object and the full prompt on every call."""
+    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    prompt = f"""
+        Analyze the following text for grammatical, spelling, punctuation, and stylistic errors.
+        The text to analyze (this is text from page {original_page_number if original_page_number != -1 else "unknown"}):
+        ---
+        {text_to_analyze}
+        ---
+        For each error found, provide the following information in a JSON array of objects. Each object must contain the following keys:
+        - "page_number": {original_page_number if original_page_number != -1 else "unknown"},
+        - "original_snippet": The exact short text fragment with the error (up to 15 words).
+        - "corrected_snippet": The corrected version of the fragment.
+        - "error_type": The type of error (e.g., "spelling", "grammar", "style", "punctuation").
+        - "explanation": A brief explanation of the error.
+
+        Example of one object in the JSON array:
+        {{
+        "page_number": {original_page_number if original_page_number != -1 else 1},
+        "original_snippet": "He go to the store.",
+        "corrected_snippet": "He goes to the store.",
+        "error_type": "grammar",
+        "explanation": "Incorrect verb tense. 'Go' should be 'goes' for third-person singular present."
+        }}
+
+        If no errors are found, return an empty JSON array [].
+        Please return ONLY the JSON array. Do not add any other text, comments, or explanations outside the JSON structure.
+        """
+    return model, prompt
+
+
+def legacy_parse(response_text: str) -> list:
+    cleaned_response_text = response_text.strip()
+    if cleaned_response_text.startswith("```json"):
+        cleaned_response_text = cleaned_response_text[7:]
+    if cleaned_response_text.endswith("```"):
+        cleaned_response_text = cleaned_response_text[:-3]
+    return json.loads(cleaned_response_text.strip())
+
+
+def measure(fn, calls: int, repeat: int) -> float:
+    """Best-of-N time per call, in microseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for page_number in range(calls):
+            fn(page_number)
+        best = min(best, time.perf_counter() - started_at)
+    return best / calls * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--page-chars", type=int, default=3000, help="Length of the page text.")
+    parser.add_argument("--repeat", type=int, default=3, help="Best-of-N timing.")
+    args = parser.parse_args()
+
+    genai.configure(api_key="benchmark")  # Сетевых вызовов нет, ключ нужен только для создания модели
+    text = ("lorem ipsum dolor sit amet " * (args.page_chars // 27 + 1))[:args.page_chars]
+    fenced_response = "```json\n" + json.dumps(SAMPLE_ERRORS) + "\n```"
+    bare_response = json.dumps(SAMPLE_ERRORS)
+    client = GeminiClient(json_mode=True)
+
+    def new_prepare_call(page_number: int):
+        return client.model_for(PAGE_PROMPT), PAGE_PROMPT.render(page_number=page_number, text=text)
+
+    rows = [
+        ("prepare call", measure(lambda n: legacy_prepare_call(text, n), args.calls, args.repeat),
+         measure(new_prepare_call, args.calls, args.repeat)),
+        ("parse response", measure(lambda n: legacy_parse(fenced_response), args.calls, args.repeat),
+         measure(lambda n: parse_errors_json(bare_response), args.calls, args.repeat)),
+    ]
+    legacy_prompt_chars = len(legacy_prepare_call(text, 1)[1])
+    new_prompt_chars = len(new_prepare_call(1)[1])
+
+    print(f"{'stage':>16} {'legacy, us':>12} {'new, us':>12} {'speedup':>9}")
+    for stage, legacy, new in rows:
+        print(f"{stage:>16} {legacy:>12.2f} {new:>12.2f} {legacy / new:>8.1f}x")
+    print(f"prompt text built per call: {legacy_prompt_chars} -> {new_prompt_chars} chars "
+          f"(instructions moved to the model's system instruction)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Deterministic synthetic PDFs for benchmarks: `pages` pages of `words_per_page` words each,
+with a share of words replaced by known misspellings so that analysis and correction have
+real work to do. The same arguments always produce the same document.
+Does not import the app: benchmarks configure it through environment variables first.
+"""
+import random
+from typing import List, Tuple
+
+import fitz  # PyMuPDF
+
+VOCABULARY = [
+    "contract", "party", "agreement", "shall", "payment", "term", "notice", "service", "provider",
+    "customer", "liability", "section", "schedule", "invoice", "period", "written", "consent", "data",
+    "the", "and", "of", "to", "in", "for", "with", "on", "by", "any", "such", "other", "each", "all",
+]
+
+# Опечатки, которые вставляются вместо слов и которые "находит" фейковая модель
+TYPOS: List[Tuple[str, str]] = [
+    ("recieve", "receive"), ("seperate", "separate"), ("definately", "definitely"), ("goverment", "government"),
+    ("occured", "occurred"), ("untill", "until"), ("accomodate", "accommodate"), ("neccessary", "necessary"),
+    ("independant", "independent"), ("maintainance", "maintenance"), ("responsability", "responsibility"),
+    ("succesful", "successful"),
+]
+
+WORDS_PER_PARAGRAPH = 60
+
+
+def make_page_text(words: int, typo_rate: float, rng: random.Random) -> str:
+    tokens = []
+    for _ in range(words):
+        if rng.random() < typo_rate:
+            tokens.append(rng.choice(TYPOS)[0])
+            continue
+        word = rng.choice(VOCABULARY)
+        while tokens and word == tokens[-1]:  # Без случайных повторов: единственные ошибки - вставленные опечатки
+            word = rng.choice(VOCABULARY)
+        tokens.append(word)
+    paragraphs = [
+        " ".join(tokens[start:start + WORDS_PER_PARAGRAPH]).capitalize() + "."
+        for start in range(0, len(tokens), WORDS_PER_PARAGRAPH)
+    ]
+    return "\n\n".join(paragraphs)
+
+
+def make_synthetic_pdf(pages: int = 10, words_per_page: int = 300, typo_rate: float = 0.01, seed: int = 42) -> bytes:
+    rng = random.Random(seed)
+    doc = fitz.open()
+    try:
+        for _ in range(pages):
+            page = doc.new_page()
+            text = make_page_text(words_per_page, typo_rate, rng)
+            # Текст, не поместившийся в рамку, отбрасывается: плотность ограничена размером страницы
+            page.insert_textbox(page.rect + (54, 54, -54, -54), text, fontsize=9)
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+
+def canned_errors_for_typos() -> list:
+    """Model answer matching the inserted typos (used as GEMINI_FAKE_CANNED_ERRORS)."""
+    return [
+        {
+            "original_snippet": typo,
+            "corrected_snippet": correction,
+            "error_type": "spelling",
+            "explanation": f"'{typo}' should be '{correction}'.",
+        }
+        for typo, correction in TYPOS
+    ]
@@ -0,0 +1,31 @@
+import pytest
+
+from app.services.analyzers import Analyzer
+from app.services.local_proofreader import LocalProofreader
+
+
+def _repeats(text):
+    proofreader = LocalProofreader(wordlist_path="")
+    return [error["original_snippet"] for error in proofreader.check_text(text, 1) if error["explanation"] == "Repeated word."]
+
+
+def test_repeated_word_is_flagged():
+    assert _repeats("We went to the the store.") == ["the the"]
+
+
+@pytest.mark.parametrize("text", [
+    "He had had enough.",
+    "Das ist das Haus, das das Kind gebaut hat.",
+    "Die Frau, die die Zeitung liest, wartet.",
+    "Haben Sie sie gesehen?",
+])
+def test_valid_repeats_are_not_flagged(text):
+    assert _repeats(text) == []
+
+
+def test_analyzer_without_analyze_batch_cannot_be_created():
+    class IncompleteAnalyzer(Analyzer):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        IncompleteAnalyzer()
@@ -0,0 +1,95 @@
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.batch_analysis import BatchDeduplicator, _extract_zip_members
+
+
+def _error(original, corrected="fixed", error_type="spelling"):
+    return {"original_snippet": original, "corrected_snippet": corrected, "error_type": error_type, "explanation": "x"}
+
+
+def _reduce(deduplicator, texts):
+    return [deduplicator.reduce(seq, text) for seq, text in enumerate(texts, start=1)]
+
+
+def _snippets(errors):
+    return [error["original_snippet"] for error in errors]
+
+
+def test_error_shared_between_documents_crossing_a_line_break():
+    shared = "Every morning he wakes up early and He go to\nthe store before work."
+    texts = [f"{shared}\n\nOnly in document A.", f"{shared}\n\nOnly in document B."]
+    deduplicator = BatchDeduplicator()
+    assert _reduce(deduplicator, texts) == texts[:1] + ["Only in document B."]
+
+    fanned = deduplicator.fan_out({1: [_error("He go to the store", "He goes to the store")], 2: []})
+    assert _snippets(fanned[1]) == ["He go to the store"]
+    assert _snippets(fanned[2]) == ["He go to the store"]
+    assert deduplicator.stats()["paragraphs_deduplicated"] == 1
+
+
+def test_unit_repeated_within_one_page_keeps_per_occurrence_errors():
+    deduplicator = BatchDeduplicator()
+    sent = _reduce(deduplicator, ["Header Lien\n\nBody text.\n\nHeader Lien", "Header Lien\n\nOther body."])
+    # Повтор на той же странице отправляется вместе с ней, на другой странице - нет
+    assert sent == ["Header Lien\n\nBody text.\n\nHeader Lien", "Other body."]
+
+    # Модель нашла ошибку только в первом вхождении
+    fanned = deduplicator.fan_out({1: [_error("Lien", "Line")], 2: []})
+    assert len(fanned[1]) == 1
+    assert len(fanned[2]) == 1
+
+    fanned = deduplicator.fan_out({1: [_error("Lien", "Line"), _error("Lien", "Line")], 2: []})
+    assert len(fanned[1]) == 2
+    assert len(fanned[2]) == 1
+
+
+def test_service_errors_are_copied_once_to_pages_reusing_units():
+    deduplicator = BatchDeduplicator()
+    _reduce(deduplicator, ["First shared.\n\nSecond shared.", "First shared.\n\nSecond shared.\n\nNew text."])
+    timeout = _error("", "", error_type="AI_TIMEOUT")
+    fanned = deduplicator.fan_out({1: [timeout], 2: []})
+    assert [error["error_type"] for error in fanned[2]] == ["AI_TIMEOUT"]
+
+
+def test_exact_duplicate_page_gets_errors_that_were_not_located():
+    text = "Some page text.\n\nAnother paragraph."
+    deduplicator = BatchDeduplicator()
+    assert _reduce(deduplicator, [text, text]) == [text, ""]
+
+    fanned = deduplicator.fan_out({1: [_error("Another paragraph"), _error("not on the page")], 2: []})
+    assert _snippets(fanned[2]) == ["Another paragraph", "not on the page"]
+    assert deduplicator.stats()["pages_deduplicated"] == 1
+
+
+def test_error_spanning_units_is_reused_only_where_the_whole_run_repeats():
+    first = "First sentence ends here.\nSecond sentence follows it."
+    texts = [first, first, "First sentence ends here.\nA different follow up."]
+    deduplicator = BatchDeduplicator()
+    assert _reduce(deduplicator, texts) == [first, "", "A different follow up."]
+
+    fanned = deduplicator.fan_out({1: [_error("here. Second")], 2: [], 3: []})
+    assert _snippets(fanned[1]) == ["here. Second"]
+    assert _snippets(fanned[2]) == ["here. Second"]
+    assert fanned[3] == []
+    # Третья страница совпадает лишь с частью фрагмента: первая единица анализируется заново
+    assert deduplicator.resend_pages() == [{"page_number": 3, "text": "First sentence ends here."}]
+
+    deduplicator.merge_resent(fanned, {3: [_error("ends here")]})
+    assert _snippets(fanned[3]) == ["ends here"]
+    assert deduplicator.stats()["paragraphs_reanalyzed"] == 1
+
+
+def test_zip_extraction_is_held_to_the_batch_budget(tmp_path):
+    archive_path = tmp_path / "batch.zip"
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for number in range(3):
+            archive.writestr(f"doc{number}.pdf", b"0" * 1000)
+    assert archive_path.stat().st_size < 2000
+
+    assert len(_extract_zip_members(str(archive_path), max_members=10, max_total_bytes=3000)) == 3
+    with pytest.raises(HTTPException) as raised:
+        _extract_zip_members(str(archive_path), max_members=10, max_total_bytes=2500)
+    assert raised.value.status_code == 413
@@ -0,0 +1,71 @@
+import random
+
+from app.services.correction_engine import (
+    AUTOMATON_MIN_PATTERNS,
+    AhoCorasick,
+    _find_all_by_scanning,
+    apply_corrections,
+    find_all_occurrences,
+)
+
+
+def _error(original, corrected, **extra):
+    return {"original_snippet": original, "corrected_snippet": corrected, **extra}
+
+
+def test_automaton_matches_scanning_on_random_texts():
+    rng = random.Random(1234)
+    for _ in range(300):
+        # Маленький алфавит: много перекрывающихся и вложенных вхождений
+        text = "".join(rng.choice("abc ") for _ in range(rng.randint(0, 60)))
+        patterns = ["".join(rng.choice("abc ") for _ in range(rng.randint(1, 5))) for _ in range(rng.randint(1, 8))]
+        assert sorted(AhoCorasick(patterns).find_all(text)) == sorted(_find_all_by_scanning(text, patterns))
+
+
+def test_automaton_handles_nested_and_duplicate_patterns():
+    patterns = ["he", "she", "his", "hers", "e", "he"]
+    text = "ushers and she said his hers"
+    assert sorted(AhoCorasick(patterns).find_all(text)) == sorted(_find_all_by_scanning(text, patterns))
+
+
+def test_find_all_occurrences_uses_automaton_for_many_patterns():
+    rng = random.Random(7)
+    patterns = sorted({"".join(rng.choice("abcd") for _ in range(rng.randint(2, 6)))
+                       for _ in range(AUTOMATON_MIN_PATTERNS * 2)})
+    assert len(patterns) >= AUTOMATON_MIN_PATTERNS
+    text = "".join(rng.choice("abcd ") for _ in range(2000))
+    assert sorted(find_all_occurrences(text, patterns)) == sorted(_find_all_by_scanning(text, patterns))
+
+
+def test_errors_with_the_same_snippet_take_successive_occurrences():
+    first, second, third = _error("teh", "the", n=1), _error("teh", "The", n=2), _error("teh", "THE", n=3)
+    result = apply_corrections("teh cat and teh dog", [first, second, third])
+    assert result.text == "the cat and The dog"
+    assert result.applied == [first, second]
+    assert result.not_found == [third]
+
+
+def test_overlapping_corrections_leftmost_then_longest_wins():
+    left, right = _error("abc", "X"), _error("bcd", "Y")
+    result = apply_corrections("abcd", [right, left])
+    assert result.text == "Xd"
+    assert result.not_found == [right]
+
+    short, long = _error("ab", "1"), _error("abc", "2")
+    result = apply_corrections("abcd", [short, long])
+    assert result.text == "2d"
+    assert result.not_found == [short]
+
+
+def test_replacements_are_matched_against_the_original_text_only():
+    result = apply_corrections("teh the", [_error("teh", "the"), _error("the", "THE")])
+    assert result.text == "the THE"
+
+
+def test_service_errors_and_missing_snippets_are_skipped():
+    service = {"original_snippet": "N/A", "corrected_snippet": "N/A", "error_type": "AI_Parse_Error"}
+    missing = _error("zzz", "y")
+    result = apply_corrections("some text", [service, missing])
+    assert result.text == "some text"
+    assert result.applied == []
+    assert result.not_found == [missing]
@@ -0,0 +1,36 @@
+from app.services.document_store import DocumentSessionStore
+
+
+def _source_file(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_source_files_of_least_recently_used_sessions_are_dropped_first(tmp_path):
+    store = DocumentSessionStore(max_file_bytes=250)
+    first = store.save("a.pdf", [{"page_number": 1, "text": "a"}], [], _source_file(tmp_path, "a.pdf", 100))
+    second = store.save("b.pdf", [], [], _source_file(tmp_path, "b.pdf", 100))
+    store.get(first)
+    third = store.save("c.pdf", [], [], _source_file(tmp_path, "c.pdf", 100))
+
+    assert store.get(second)["source_path"] is None  # Текст остался, файл удален
+    assert not (tmp_path / "b.pdf").exists()
+    assert store.get(first)["source_path"] and store.get(third)["source_path"]
+    assert store.stats()["total_file_bytes"] == 200
+
+
+def test_source_file_larger_than_the_budget_is_not_kept(tmp_path):
+    store = DocumentSessionStore(max_file_bytes=250)
+    document_id = store.save("big.pdf", [], [], _source_file(tmp_path, "big.pdf", 300))
+    assert store.get(document_id)["source_path"] is None
+    assert not (tmp_path / "big.pdf").exists()
+    assert store.stats()["total_file_bytes"] == 0
+
+
+def test_clear_removes_all_source_files(tmp_path):
+    store = DocumentSessionStore()
+    store.save("a.pdf", [], [], _source_file(tmp_path, "a.pdf", 10))
+    store.clear()
+    assert not (tmp_path / "a.pdf").exists()
+    assert store.stats() == {"documents": 0, "total_chars": 0, "total_file_bytes": 0}
@@ -0,0 +1,48 @@
+import fitz  # PyMuPDF
+
+from app.services.corrected_pdf_service import create_pdf_with_inplace_corrections
+
+
+def _make_pdf(tmp_path, lines):
+    doc = fitz.open()
+    page = doc.new_page()
+    for number, line in enumerate(lines):
+        page.insert_text((72, 72 + 14 * number), line)
+    path = tmp_path / "source.pdf"
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def _words(buffer):
+    with fitz.open(stream=buffer.getvalue()) as doc:
+        return [word[4] for word in doc.load_page(0).get_text("words")]
+
+
+def _error(original, corrected):
+    return {"page_number": 1, "original_snippet": original, "corrected_snippet": corrected}
+
+
+def test_snippet_wrapped_across_lines_is_replaced_on_every_line(tmp_path):
+    path = _make_pdf(tmp_path, ["Every day he walks and He go to", "the store every day."])
+    buffer, unresolved = create_pdf_with_inplace_corrections(path, [_error("He go to the store", "He goes to the store")])
+    assert unresolved == []
+    words = _words(buffer)
+    assert words.count("store") == 1  # Старый текст второй строки не остался рядом с исправлением
+    assert "go" not in words
+    assert ["He", "goes", "to", "the", "store"] == [w for w in words if w in ("He", "goes", "to", "the", "store")]
+
+
+def test_repeated_wrapped_snippets_take_separate_occurrences(tmp_path):
+    path = _make_pdf(tmp_path, ["And He go to", "the store. He go to the", "store again."])
+    errors = [_error("He go to the store", "He goes to the store")] * 2 + [_error("He go to the store", "x")]
+    buffer, unresolved = create_pdf_with_inplace_corrections(path, errors)
+    assert unresolved == [errors[2]]
+    assert _words(buffer).count("goes") == 2
+
+
+def test_missing_snippet_is_unresolved(tmp_path):
+    path = _make_pdf(tmp_path, ["Nothing to fix here."])
+    error = _error("zzz", "y")
+    _, unresolved = create_pdf_with_inplace_corrections(path, [error])
+    assert unresolved == [error]
@@ -0,0 +1,108 @@
+import asyncio
+import os
+
+from fastapi import HTTPException
+
+import app.services.jobs as jobs
+from app.services.jobs import InMemoryJobStore, JobManager
+from app.services.scheduler import GeminiScheduler
+
+
+def _fake_pages(texts, fail_after=None):
+    def aiter_pdf_pages(path, on_total_pages=None, wait_for_slot=False):
+        async def pages():
+            if on_total_pages is not None:
+                on_total_pages(len(texts))
+            for number, text in enumerate(texts, start=1):
+                if fail_after is not None and number > fail_after:
+                    raise HTTPException(status_code=500, detail="Error extracting text from PDF: broken page")
+                await asyncio.sleep(0.01)
+                yield {"page_number": number, "text": text}
+        return pages()
+    return aiter_pdf_pages
+
+
+async def _analyze_batch(batch):
+    await asyncio.sleep(0.01)
+    return {page["page_number"]: [{"original_snippet": "teh", "corrected_snippet": "the", "error_type": "spelling",
+                                   "explanation": "x"}] if "teh" in page["text"] else [] for page in batch}
+
+
+def _run_job(monkeypatch, tmp_path, texts, fail_after=None):
+    monkeypatch.setattr(jobs, "aiter_pdf_pages", _fake_pages(texts, fail_after))
+    monkeypatch.setattr(jobs, "gemini_scheduler", GeminiScheduler(analyze_batch_fn=_analyze_batch,
+                                                                  requests_per_minute=0, batch_token_budget=0))
+    pdf_path = tmp_path / "upload.pdf"
+    pdf_path.write_bytes(b"%PDF")
+    store = InMemoryJobStore()
+    statuses = []
+    original_update = store.update
+
+    def recording_update(job_id, **fields):
+        if "status" in fields:
+            statuses.append(fields["status"])
+        return original_update(job_id, **fields)
+
+    store.update = recording_update
+    manager = JobManager(store, workers=1)
+
+    async def run():
+        await manager.start()
+        job_id = await manager.submit("doc.pdf", str(pdf_path))
+        queued = manager.get_status(job_id)["status"]
+        streamed = [record async for record in manager.iter_page_results(job_id, poll_interval=0.05)]
+        await manager.stop()
+        return job_id, queued, streamed
+
+    job_id, queued, streamed = asyncio.run(run())
+    return manager, job_id, queued, statuses, streamed, str(pdf_path)
+
+
+def test_job_runs_to_completion_and_streams_page_results(monkeypatch, tmp_path):
+    manager, job_id, queued, statuses, streamed, pdf_path = _run_job(
+        monkeypatch, tmp_path, ["Fine page.", "Has teh typo.", "Another teh here."])
+
+    assert queued == "queued"
+    assert statuses == ["running", "completed"]
+    job = manager.get_status(job_id)
+    assert (job["pages_done"], job["total_pages"], job["errors_found"]) == (3, 3, 2)
+    assert job["document_id"]
+    assert sorted(record["page_number"] for record in streamed) == [1, 2, 3]
+    assert sum(len(record["errors"]) for record in streamed) == 2
+    assert os.path.exists(pdf_path)  # Файлом владеет сессия документа
+    assert manager._events == {}
+
+
+def test_job_fails_when_the_pdf_cannot_be_read(monkeypatch, tmp_path):
+    manager, job_id, _, statuses, _, pdf_path = _run_job(
+        monkeypatch, tmp_path, ["Page one.", "Page two.", "Page three."], fail_after=1)
+
+    assert statuses == ["running", "failed"]
+    job = manager.get_status(job_id)
+    assert job["detail"] == "Error extracting text from PDF: broken page"
+    assert job["document_id"] is None
+    assert not os.path.exists(pdf_path)
+    assert manager._events == {}
+
+
+def test_empty_document_fails(monkeypatch, tmp_path):
+    manager, job_id, _, statuses, _, _ = _run_job(monkeypatch, tmp_path, [])
+    assert statuses == ["running", "failed"]
+    assert "Could not extract any text" in manager.get_status(job_id)["detail"]
+
+
+def test_file_store_keeps_jobs_and_skips_a_partly_written_result(tmp_path):
+    store = jobs.FileJobStore(str(tmp_path))
+    store.create({"job_id": "abc", "status": "queued", "pages_done": 0})
+    store.append_page_result("abc", {"page_number": 1, "errors": []})
+    store.append_page_result("abc", {"page_number": 2, "errors": []})
+    with open(tmp_path / "abc.ndjson", "a", encoding="utf-8") as results:
+        results.write('{"page_number": 3, "err')  # Запись, прерванная на середине
+
+    store.update("abc", status="running", pages_done=2)
+    reopened = jobs.FileJobStore(str(tmp_path))
+    assert reopened.get("abc")["status"] == "running"
+    assert [record["page_number"] for record in reopened.get_page_results("abc")] == [1, 2]
+    assert [record["page_number"] for record in reopened.get_page_results("abc", offset=1)] == [2]
+    reopened.delete("abc")
+    assert reopened.get("abc") is None and reopened.list_jobs() == []
@@ -0,0 +1,83 @@
+import asyncio
+
+from app.services.ai_service import demultiplex_batch_errors
+from app.services.page_batching import CHARS_PER_TOKEN, PagePacker, split_oversized_page
+from app.services.scheduler import GeminiScheduler
+
+
+def _page(number, chars):
+    return {"page_number": number, "text": ("word " * chars)[:chars]}
+
+
+def _pack(packer, pages):
+    batches = []
+    for page in pages:
+        batches.extend(packer.add(page))
+    batches.extend(packer.flush())
+    return [[page["page_number"] for page in batch] for batch in batches]
+
+
+def test_sparse_pages_are_packed_within_the_token_budget():
+    # Каждая страница ~26 токенов: в бюджет 100 помещаются три
+    pages = [_page(number, 25 * CHARS_PER_TOKEN) for number in range(1, 8)]
+    assert _pack(PagePacker(token_budget=100, max_pages=10), pages) == [[1, 2, 3], [4, 5, 6], [7]]
+
+
+def test_batches_are_limited_by_page_count():
+    pages = [_page(number, 10) for number in range(1, 6)]
+    assert _pack(PagePacker(token_budget=1000, max_pages=2), pages) == [[1, 2], [3, 4], [5]]
+
+
+def test_oversized_page_is_split_into_its_own_batches():
+    pages = [_page(1, 10), _page(2, 1000), _page(3, 10)]
+    batches = _pack(PagePacker(token_budget=50, max_pages=10), pages)
+    # Накопленная страница уходит перед разрезанной, части большой страницы - отдельными запросами
+    assert batches[0] == [1]
+    assert batches[-1] == [3]
+    assert len(batches) > 3 and all(batch == [2] for batch in batches[1:-1])
+
+
+def test_split_keeps_the_whole_text_and_prefers_word_boundaries():
+    page = {"page_number": 4, "text": "alpha beta gamma delta " * 40}
+    chunks = split_oversized_page(page, max_tokens=20)
+    assert "".join(chunk["text"] for chunk in chunks) == page["text"]
+    assert all(chunk["page_number"] == 4 for chunk in chunks)
+    assert all(len(chunk["text"]) <= 20 * CHARS_PER_TOKEN for chunk in chunks)
+    assert all(chunk["text"].endswith(" ") for chunk in chunks[:-1])
+
+
+def test_zero_budget_disables_packing():
+    pages = [_page(number, 10_000) for number in range(1, 4)]
+    assert _pack(PagePacker(token_budget=0), pages) == [[1], [2], [3]]
+
+
+def test_errors_of_a_packed_request_go_back_to_their_pages():
+    batch = [{"page_number": 1, "text": "The frist page."}, {"page_number": 2, "text": "The secnd page."}]
+    errors = [
+        {"original_snippet": "frist", "page_number": 1},
+        {"original_snippet": "secnd", "page_number": "unknown"},  # Номер не указан - ищем по тексту
+        {"original_snippet": "elsewhere", "page_number": 9},      # Чужой номер и нет в тексте - первая страница
+        {"error_type": "AI_Parse_Error", "original_snippet": "N/A"},
+    ]
+    by_page = demultiplex_batch_errors(errors, batch)
+    assert [error["original_snippet"] for error in by_page[1]] == ["frist", "elsewhere", "N/A"]
+    assert [error["original_snippet"] for error in by_page[2]] == ["secnd", "N/A"]
+    assert all(error["page_number"] == 2 for error in by_page[2])
+
+
+def test_scheduler_merges_the_parts_of_a_split_page():
+    requests = []
+
+    async def analyze_batch(batch):
+        requests.append([page["page_number"] for page in batch])
+        return {page["page_number"]: [{"original_snippet": page["text"][:5]}] for page in batch}
+
+    scheduler = GeminiScheduler(analyze_batch_fn=analyze_batch, requests_per_minute=0,
+                                batch_token_budget=50, batch_max_pages=10)
+    pages = [_page(1, 10), _page(2, 10), _page(3, 600)]
+    results = asyncio.run(scheduler.analyze_pages(pages))
+
+    assert requests[0] == [1, 2]
+    assert all(request == [3] for request in requests[1:]) and len(requests) > 2
+    assert [page_number for page_number, _ in results] == [1, 2, 3]
+    assert len(results[2][1]) == len(requests) - 1  # Ошибки всех частей - у одной страницы
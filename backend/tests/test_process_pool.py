@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import fitz
+import pytest
+from fastapi import HTTPException
+
+import app.services.upload_service as upload_service
+
+from app.services.pdf_service import count_pdf_pages
+from app.services.process_pool import CpuTaskPool, StageHTTPException
+
+
+def _run(pool, coroutine):
+    async def run():
+        try:
+            return await coroutine(pool)
+        finally:
+            pool.shutdown()
+    return asyncio.run(run())
+
+
+def test_full_pool_rejects_with_503_and_wait_delays_instead():
+    pool = CpuTaskPool(max_workers=1, max_queued=0, task_timeout=60)
+
+    async def scenario(pool):
+        busy = asyncio.ensure_future(pool.run("sleep", time.sleep, 0.5))
+        await asyncio.sleep(0)  # Первая задача занимает единственный слот
+        with pytest.raises(HTTPException) as rejected:
+            await pool.run("abs", abs, -1)
+        waited = await pool.run("abs", abs, -2, wait=True)
+        await busy
+        return rejected.value, waited
+
+    rejected, waited = _run(pool, scenario)
+    assert rejected.status_code == 503
+    assert waited == 2
+    stats = pool.stats()
+    assert stats["in_flight"] == 0
+    assert stats["stages"]["abs"]["rejected"] == 1
+
+
+def test_slow_task_times_out_with_504():
+    pool = CpuTaskPool(max_workers=1, max_queued=0, task_timeout=0.2)
+
+    async def scenario(pool):
+        with pytest.raises(HTTPException) as raised:
+            await pool.run("sleep", time.sleep, 2)
+        return raised.value
+
+    timed_out = _run(pool, scenario)
+    assert timed_out.status_code == 504
+    assert pool.stats()["stages"]["sleep"]["timeouts"] == 1
+
+
+def test_error_of_the_stage_is_reported_as_stage_exception(tmp_path):
+    pool = CpuTaskPool(max_workers=1, max_queued=0, task_timeout=60)
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf")
+
+    async def scenario(pool):
+        with pytest.raises(StageHTTPException) as raised:
+            await pool.run("count_pages", count_pdf_pages, str(broken))
+        return raised.value
+
+    error = _run(pool, scenario)
+    assert error.status_code == 500
+    assert error.detail.startswith("Error extracting text from PDF")
+
+
+def test_single_slot_pool_does_not_reject_its_own_prefetch(monkeypatch, tmp_path):
+    pool = CpuTaskPool(max_workers=1, max_queued=0, task_timeout=60)
+    monkeypatch.setattr(upload_service, "cpu_pool", pool)
+    doc = fitz.open()
+    for number in range(1, 4):
+        doc.new_page().insert_text((72, 72), f"Page {number} text.")
+    path = tmp_path / "three.pdf"
+    doc.save(str(path))
+    doc.close()
+
+    async def scenario(pool):
+        # Следующая порция извлекается заранее и ждет слот, занятый текущей
+        return [page async for page in upload_service.aiter_pdf_pages(str(path), chunk_pages=1)]
+
+    pages = _run(pool, scenario)
+    assert [page["page_number"] for page in pages] == [1, 2, 3]
@@ -0,0 +1,115 @@
+from app.services.revision_diff import RevisionDiff, locate_errors, split_paragraphs, split_unit_spans
+
+
+def _error(page_number, original, corrected="fixed"):
+    return {"page_number": page_number, "original_snippet": original, "corrected_snippet": corrected,
+            "error_type": "spelling", "explanation": "x"}
+
+
+def _session(texts, errors):
+    return {"pages": [{"page_number": number, "text": text} for number, text in enumerate(texts, start=1)],
+            "errors": errors}
+
+
+def _run(revision, texts):
+    sent = [revision.prepare_page({"page_number": number, "text": text})["text"]
+            for number, text in enumerate(texts, start=1)]
+    carried = [error for number in range(1, len(texts) + 1) for error in revision.carried_errors(number)]
+    return sent, carried
+
+
+def test_lines_are_grouped_into_sentences():
+    text = "Every morning he wakes up early and He go to\nthe store before work.\nShort heading\nThe last line."
+    assert split_paragraphs(text) == [
+        "Every morning he wakes up early and He go to\nthe store before work.",
+        "Short heading",
+        "The last line.",
+    ]
+
+
+def test_blank_line_paragraphs_are_units():
+    text = "First paragraph line one\nline two\n\nSecond paragraph."
+    assert split_paragraphs(text) == ["First paragraph line one\nline two", "Second paragraph."]
+
+
+def test_repeated_paragraph_carries_only_its_own_errors():
+    header = "Teh Company Confidential"
+    texts = [f"{header}\n\nBody of page {number}." for number in range(1, 4)]
+    errors = [_error(number, "Teh", "The") for number in range(1, 4)]
+
+    revision = RevisionDiff(_session(texts, errors))
+    sent, carried = _run(revision, texts)
+    assert sent == ["", "", ""]
+    assert [(error["page_number"], error["original_snippet"]) for error in carried] == [(1, "Teh"), (2, "Teh"), (3, "Teh")]
+    assert revision.stats()["errors_carried_forward"] == 3
+
+    # Следующая ревизия от сохраненного результата не умножает ошибки
+    revision = RevisionDiff(_session(texts, carried))
+    _, carried_again = _run(revision, texts)
+    assert len(carried_again) == 3
+
+
+def test_paragraph_repeated_on_one_page_keeps_per_occurrence_errors():
+    text = "Header Lien\n\nBody text.\n\nHeader Lien"
+    errors = [_error(1, "Lien", "Line")]  # Модель нашла ошибку только в первом вхождении
+    revision = RevisionDiff(_session([text], errors))
+    _, carried = _run(revision, [text])
+    assert len(carried) == 1
+
+
+def test_error_crossing_a_line_break_is_carried_forward():
+    v1 = "Every morning he wakes up early and He go to\nthe store before work.\nThe last line is here."
+    v2 = "Every morning he wakes up early and He go to\nthe store before work.\nA completely different ending."
+    revision = RevisionDiff(_session([v1], [_error(1, "He go to the store", "He goes to the store")]))
+    sent, carried = _run(revision, [v2])
+    assert [error["original_snippet"] for error in carried] == ["He go to the store"]
+    assert sent == ["A completely different ending."]
+
+
+def test_error_spanning_units_is_reused_only_with_the_whole_run():
+    v1 = "Intro line.\n\nHe go to\n\nthe store."
+    error = _error(1, "He go to the store", "He goes to the store")
+    revision = RevisionDiff(_session([v1], [error]))
+    sent, carried = _run(revision, [v1])
+    assert sent == [""] and len(carried) == 1
+
+    # Вторая единица изменилась: первая единица ошибки отправляется заново вместе с ней
+    v2 = "Intro line.\n\nHe go to\n\nthe market."
+    revision = RevisionDiff(_session([v1], [error]))
+    sent, carried = _run(revision, [v2])
+    assert carried == []
+    assert sent == ["He go to\n\nthe market."]
+
+
+def test_changed_units_are_sent_whole_with_adjacent_lines_together():
+    v1 = "Alpha sentence one.\nBeta sentence two.\nGamma sentence three."
+    v2 = "Alpha sentence one.\nBeta sentence 2 changed.\nGamma sentence 3 changed."
+    revision = RevisionDiff(_session([v1], []))
+    sent, _ = _run(revision, [v2])
+    assert sent == ["Beta sentence 2 changed.\nGamma sentence 3 changed."]
+
+
+def test_unlocated_errors_are_carried_only_for_unchanged_pages():
+    text = "Some page text."
+    paraphrased = _error(1, "text that is not on the page")
+    revision = RevisionDiff(_session([text, "Other page."], [paraphrased]))
+    _, carried = _run(revision, [text, "Other page changed."])
+    assert [error["original_snippet"] for error in carried] == ["text that is not on the page"]
+
+
+def test_pages_with_service_errors_are_not_reused():
+    text = "Some page text."
+    service = {"page_number": 1, "original_snippet": "N/A", "corrected_snippet": "N/A",
+               "error_type": "AI_Parse_Error", "explanation": "x"}
+    revision = RevisionDiff(_session([text], [service]))
+    sent, carried = _run(revision, [text])
+    assert sent == [text] and carried == []
+
+
+def test_locate_errors_takes_occurrences_in_order():
+    text = "teh one.\n\nteh two."
+    spans = split_unit_spans(text)
+    assert len(spans) == 2
+    located, not_found = locate_errors(text, spans, [_error(1, "teh"), _error(1, "teh"), _error(1, "zzz")])
+    assert [covered for _, covered in located] == [(0, 0), (1, 1)]
+    assert [error["original_snippet"] for error in not_found] == ["zzz"]
@@ -0,0 +1,141 @@
+import asyncio
+import random
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.fake_gemini import FakeRateLimitError, FakeServerError
+from app.services.scheduler import GeminiScheduler, TokenBucket
+
+
+def _pages(count):
+    return [{"page_number": number, "text": f"Text of page {number}."} for number in range(1, count + 1)]
+
+
+def _scheduler(analyze_batch_fn, **options):
+    options = {"requests_per_minute": 0, "batch_token_budget": 0, "backoff_base": 0.0, **options}
+    return GeminiScheduler(analyze_batch_fn=analyze_batch_fn, **options)
+
+
+class _ConcurrencyProbe:
+    """Fake model call that records how many calls were in flight at once."""
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, batch):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+        return {page["page_number"]: [] for page in batch}
+
+
+def test_global_concurrency_cap_is_shared_by_requests():
+    probe = _ConcurrencyProbe()
+    scheduler = _scheduler(probe, max_concurrency=2, per_request_concurrency=10)
+
+    async def run():
+        await asyncio.gather(scheduler.analyze_pages(_pages(6)), scheduler.analyze_pages(_pages(6)))
+
+    asyncio.run(run())
+    assert probe.max_in_flight == 2
+
+
+def test_per_request_concurrency_cap():
+    probe = _ConcurrencyProbe()
+    scheduler = _scheduler(probe, max_concurrency=10, per_request_concurrency=3)
+    results = asyncio.run(scheduler.analyze_pages(_pages(12)))
+    assert probe.max_in_flight == 3
+    assert [page_number for page_number, _ in results] == list(range(1, 13))
+
+
+def test_retryable_error_is_retried_until_success():
+    calls = []
+
+    async def flaky(batch):
+        calls.append(batch)
+        if len(calls) < 3:
+            raise FakeServerError("busy") if len(calls) == 1 else FakeRateLimitError("quota")
+        return {page["page_number"]: [{"original_snippet": "x"}] for page in batch}
+
+    results = asyncio.run(_scheduler(flaky, max_retries=3).analyze_pages(_pages(1)))
+    assert len(calls) == 3
+    assert results == [(1, [{"original_snippet": "x"}])]
+
+
+def test_retries_give_up_with_the_status_of_the_last_error():
+    calls = []
+
+    async def always_rate_limited(batch):
+        calls.append(batch)
+        raise FakeRateLimitError("quota")
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(_scheduler(always_rate_limited, max_retries=2).analyze_pages(_pages(1)))
+    assert raised.value.status_code == 429
+    assert len(calls) == 3
+
+
+def test_non_retryable_error_is_not_retried():
+    calls = []
+
+    async def broken(batch):
+        calls.append(batch)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(_scheduler(broken, max_retries=5).analyze_pages(_pages(1)))
+    assert len(calls) == 1
+
+
+def test_failed_request_uses_the_fallback_results():
+    async def always_down(batch):
+        raise FakeServerError("down")
+
+    async def fallback(batch, exc):
+        return {page["page_number"]: [{"error_type": "AI_Fallback_Local"}] for page in batch}
+
+    scheduler = _scheduler(always_down, max_retries=1, fallback_batch_fn=fallback)
+    assert asyncio.run(scheduler.analyze_pages(_pages(2))) == [
+        (1, [{"error_type": "AI_Fallback_Local"}]),
+        (2, [{"error_type": "AI_Fallback_Local"}]),
+    ]
+
+
+def test_backoff_delay_uses_full_jitter_within_the_cap():
+    scheduler = _scheduler(None, backoff_base=0.5, backoff_max=4.0)
+    random.seed(7)
+    for attempt in range(8):
+        delays = [scheduler._backoff_delay(attempt) for _ in range(50)]
+        cap = min(4.0, 0.5 * 2 ** attempt)
+        assert all(0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap / 2  # Задержки распределены по всему интервалу, а не фиксированы
+
+
+def test_token_bucket_limits_the_rate_after_the_burst():
+    bucket = TokenBucket(rate=20.0, capacity=2)
+
+    async def acquire_all():
+        started_at = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - started_at
+
+    # 2 токена сразу, еще 4 со скоростью 20 в секунду
+    assert asyncio.run(acquire_all()) >= 0.18
+
+
+def test_token_bucket_with_zero_rate_does_not_wait():
+    bucket = TokenBucket(rate=0, capacity=1)
+
+    async def acquire_all():
+        started_at = time.monotonic()
+        for _ in range(100):
+            await bucket.acquire()
+        return time.monotonic() - started_at
+
+    assert asyncio.run(acquire_all()) < 0.1